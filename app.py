@@ -1,13 +1,33 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, Response, stream_with_context
 import os
 import logging
 from utils.openai_helper import OpenAIHelper
 from utils.auto_debugger import auto_debug, AutoDebugger
-import requests
-import xml.etree.ElementTree as ET
+from utils.capabilities_parser import open_capabilities
+from utils.service_detector import ServiceDetector
+from utils.lexicon_schema import init_lexicon_schema
+from utils.service_crawler import ServiceCrawler
+from utils import http_client
+from utils.schema_loader import SchemaLoader
+from utils.state_classifier import classify_state
+from utils.service_monitor import ServiceMonitor
+from utils.lexicon_db import get_lexicon_db
+from utils.llm_cache import get_llm_cache
+from utils.llm_dispatcher import get_llm_dispatcher
+from utils.name_normalizer import normalizer_stats
+from utils.enrichment_queue import EnrichmentQueue, enqueue_layers
+from utils.lexicon_search import refresh_attribute_index, search_layers
+from utils.lexicon_listing import FILTER_COLUMNS, filter_options, list_layers
+from utils.attribute_profiler import AttributeProfiler, load_attribute_statistics
+from utils.lexicon_extents import (
+    find_layers, find_services, parse_bbox_param, parse_point_param,
+    store_layer_extents, update_service_extent
+)
 import sqlite3
 import json
 import re
+import uuid
+from threading import Lock, Thread
 from config.environment import config
 
 # Logger Konfiguration
@@ -33,6 +53,9 @@ def create_app(config_name='default'):
     
     # Datenbank-Name basierend auf Umgebung
     app.config['DATABASE'] = os.path.join('database', app.config['DATABASE_NAME'])
+
+    # Gemeinsamer Verbindungspool (WAL) für alle Zugriffe auf das Lexikon
+    lexicon_db = get_lexicon_db(app.config['DATABASE'])
     
     # Auto-Debugger initialisieren
     debugger = AutoDebugger()
@@ -45,62 +68,226 @@ def create_app(config_name='default'):
     config_path = os.path.join(config_dir, 'config.json')
     ai_helper = OpenAIHelper(config_path=config_path)
 
+    # Attribut-Schemas per DescribeFeatureType, zwischengespeichert pro Dienst
+    schema_loader = SchemaLoader()
+
+    # Von GetCapabilities gemeldete WFS-Version pro Dienst, für DescribeFeatureType
+    wfs_versions = {}
+
+    def detect_wfs_version(url):
+        """WFS-Version aus den zuletzt gelesenen Capabilities, sonst aus dem Kopf einer neuen Anfrage"""
+        if url not in wfs_versions:
+            reader = open_capabilities(url, 'WFS')
+            try:
+                if reader.read_header() == 'WFS' and reader.version:
+                    wfs_versions[url] = reader.version
+            finally:
+                reader.close()
+        return wfs_versions.get(url, '2.0.0')
+
     @app.route('/')
     def overview():
         return render_template('overview.html')
 
+    # Layer pro Seite in der Lexikon-Übersicht
+    LEXICON_PAGE_SIZE = 50
+
+    def lexicon_filters(args):
+        """Filter der Lexikon-Übersicht aus den Anfrageparametern"""
+        return {column: args.get(column) for column in FILTER_COLUMNS if args.get(column)}
+
     @app.route('/data_lexicon')
     def data_lexicon():
-        """Zeigt das Datenlexikon an"""
+        """Zeigt die erste Seite des Datenlexikons an, weitere Seiten lädt die Seite per API nach"""
+        filters = lexicon_filters(request.args)
+        include_stale = bool(request.args.get('include_stale'))
         try:
-            logger.info("=== Start: Lade Datenlexikon ===")
-            conn = sqlite3.connect(app.config['DATABASE'], detect_types=sqlite3.PARSE_DECLTYPES)
-            cursor = conn.cursor()
-            
-            # Debug: Zeige Tabellen
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-            tables = cursor.fetchall()
-            logger.info(f"Verfügbare Tabellen: {tables}")
-            
-            # Debug: Zeige Spalten der wfs_layers Tabelle
-            cursor.execute("PRAGMA table_info(wfs_layers);")
-            columns = cursor.fetchall()
-            logger.info(f"Spalten in wfs_layers: {columns}")
-            
-            # Hole alle Layer mit ihren Details
-            cursor.execute('''
-                SELECT 
-                    id, name, title, description, 
-                    source_type, source_url, state,
-                    strftime('%Y-%m-%d', created_at) as created_date,
-                    strftime('%Y-%m-%d', last_updated) as updated_date
-                FROM wfs_layers 
-                ORDER BY created_at DESC
-            ''')
-            
-            layers = cursor.fetchall()
-            logger.info(f"Gefundene Layer: {len(layers)}")
-            
-            # Debug: Zeige die ersten paar Layer
-            if layers:
-                logger.info(f"Erster Layer: {layers[0]}")
-            else:
-                logger.warning("Keine Layer in der Datenbank gefunden!")
-                
-                # Debug: Prüfe ob Layer existieren
-                cursor.execute("SELECT COUNT(*) FROM wfs_layers")
-                count = cursor.fetchone()[0]
-                logger.info(f"Anzahl Layer in der Datenbank: {count}")
-            
-            logger.info("=== Ende: Datenlexikon geladen ===")
-            return render_template('data_lexicon.html', layers=layers)
-            
+            with lexicon_db.connection() as conn:
+                layers, next_cursor = list_layers(
+                    conn, limit=LEXICON_PAGE_SIZE, include_stale=include_stale, **filters
+                )
+                options = filter_options(conn)
+
+            return render_template(
+                'data_lexicon.html',
+                layers=layers,
+                next_cursor=next_cursor,
+                # Nachgeladene Seiten und die Suche übernehmen die Parameter der Seite
+                filters={**filters, 'include_stale': '1'} if include_stale else filters,
+                options=options
+            )
+
         except Exception as e:
             logger.error(f"Fehler beim Laden des Lexikons: {str(e)}")
-            return render_template('data_lexicon.html', layers=[], error=str(e))
-        finally:
-            if 'conn' in locals():
-                conn.close()
+            return render_template(
+                'data_lexicon.html',
+                layers=[],
+                next_cursor=None,
+                filters=filters,
+                options={'states': [], 'source_types': []},
+                error=str(e)
+            )
+
+    @app.route('/api/lexicon/layers')
+    def lexicon_layers():
+        """Seitenweise Lexikon-Übersicht mit Keyset-Cursor"""
+        try:
+            limit = min(500, max(1, request.args.get('limit', LEXICON_PAGE_SIZE, type=int)))
+            with lexicon_db.connection() as conn:
+                layers, next_cursor = list_layers(
+                    conn,
+                    limit=limit,
+                    cursor=request.args.get('cursor'),
+                    include_stale=bool(request.args.get('include_stale')),
+                    **lexicon_filters(request.args)
+                )
+
+            return jsonify({
+                'status': 'success',
+                'layers': layers,
+                'next_cursor': next_cursor
+            })
+
+        except ValueError as e:
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 400
+        except Exception as e:
+            logger.error(f"Fehler beim Laden der Lexikon-Seite: {str(e)}")
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 500
+
+    @app.route('/api/lexicon/search')
+    def search_lexicon():
+        """Volltextsuche im Lexikon, nach Relevanz sortiert und seitenweise"""
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({
+                'status': 'error',
+                'message': 'Kein Suchbegriff angegeben'
+            }), 400
+
+        try:
+            page = max(1, request.args.get('page', 1, type=int))
+            per_page = min(100, max(1, request.args.get('per_page', 20, type=int)))
+
+            with lexicon_db.connection() as conn:
+                layers, total = search_layers(
+                    conn, query,
+                    limit=per_page,
+                    offset=(page - 1) * per_page,
+                    state=request.args.get('state'),
+                    source_type=request.args.get('source_type'),
+                    source_url=request.args.get('source_url'),
+                    include_stale=bool(request.args.get('include_stale'))
+                )
+
+            return jsonify({
+                'status': 'success',
+                'query': query,
+                'page': page,
+                'per_page': per_page,
+                'total': total,
+                'layers': layers
+            })
+
+        except Exception as e:
+            logger.error(f"Fehler bei der Lexikon-Suche: {str(e)}")
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 500
+
+    @app.route('/api/lexicon/spatial')
+    def spatial_lexicon():
+        """Findet Layer, deren Ausdehnung eine Bounding Box oder einen Punkt schneidet, optional mit Suchtext"""
+        try:
+            if request.args.get('point'):
+                bbox = parse_point_param(request.args['point'])
+            else:
+                bbox = parse_bbox_param(request.args.get('bbox'))
+            limit = min(int(request.args.get('limit', 50)), 500)
+            offset = max(int(request.args.get('offset', 0)), 0)
+        except ValueError as e:
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 400
+
+        try:
+            with lexicon_db.connection() as conn:
+                layers, total = find_layers(
+                    conn, bbox,
+                    text=request.args.get('q', '').strip() or None,
+                    limit=limit,
+                    offset=offset,
+                    state=request.args.get('state'),
+                    source_type=request.args.get('source_type'),
+                    include_stale=bool(request.args.get('include_stale'))
+                )
+                services = find_services(conn, bbox) if request.args.get('services') else None
+
+            return jsonify({
+                'status': 'success',
+                'bbox': list(bbox),
+                'total': total,
+                'layers': layers,
+                'services': services
+            })
+        except Exception as e:
+            logger.error(f"Fehler bei der räumlichen Suche: {str(e)}")
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 500
+
+    @app.route('/api/lexicon/get-layers', methods=['POST'])
+    def get_lexicon_layers():
+        """Liefert Layer für den LexiconService (mit Suchbegriff nach Relevanz sortiert)"""
+        try:
+            data = request.get_json(silent=True) or {}
+            layer_filter = data.get('filter') or {}
+            limit = min(500, max(1, int(layer_filter.get('limit', 100))))
+            offset = max(0, int(layer_filter.get('offset', 0)))
+
+            with lexicon_db.connection() as conn:
+                if layer_filter.get('query'):
+                    layers, total = search_layers(
+                        conn, layer_filter['query'],
+                        limit=limit,
+                        offset=offset,
+                        state=layer_filter.get('state'),
+                        source_type=layer_filter.get('source_type'),
+                        source_url=layer_filter.get('source_url'),
+                        include_stale=bool(layer_filter.get('include_stale'))
+                    )
+                    next_cursor = None
+                else:
+                    layers, next_cursor = list_layers(
+                        conn,
+                        limit=limit,
+                        cursor=layer_filter.get('cursor'),
+                        include_stale=bool(layer_filter.get('include_stale')),
+                        **lexicon_filters(layer_filter)
+                    )
+                    total = None
+
+            return jsonify({
+                'status': 'success',
+                'total': total,
+                'layers': layers,
+                'next_cursor': next_cursor
+            })
+
+        except Exception as e:
+            logger.error(f"Fehler beim Laden der Lexikon-Layer: {str(e)}")
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 500
 
     @app.route('/wfs_wms_explorer')
     def wfs_wms_explorer():
@@ -157,6 +344,7 @@ def create_app(config_name='default'):
                         'source_url': service_url,
                         'source_type': service_type,
                         'state': state,
+                        'bbox': layer_info.get('bbox'),
                         'attributes': layer_info.get('attributes', [])
                     }
                     layer_batch.append(lexicon_entry)
@@ -174,11 +362,18 @@ def create_app(config_name='default'):
                         'status': 'error',
                         'message': f'Fehler beim Import: {str(e)}'
                     })
+
+            # Fehlende Attribute per DescribeFeatureType im Hintergrund nachladen
+            if service_type == 'WFS':
+                missing = [layer for layer in layer_batch if not layer['attributes']]
+                if missing:
+                    Thread(target=load_missing_attributes, args=(service_url, missing), daemon=True).start()
             
             return jsonify({
                 'status': 'success',
                 'imported_layers': imported,
-                'message': f'{imported} Layer erfolgreich ins Lexikon importiert'
+                'enrichment': enrichment_queue.progress(service_url),
+                'message': f'{imported} Layer erfolgreich ins Lexikon importiert, KI-Anreicherung läuft im Hintergrund'
             })
             
         except Exception as e:
@@ -205,21 +400,22 @@ def create_app(config_name='default'):
                     'message': 'Keine Service-URL angegeben'
                 })
 
-            # Versuche zuerst als WFS
+            # Streaming-Modus: Layer werden als NDJSON ausgegeben, sobald sie gelesen sind
+            if request.form.get('stream'):
+                return Response(
+                    stream_with_context(stream_layers(service_url)),
+                    mimetype='application/x-ndjson'
+                )
+
+            # Alle Diensttypen gleichzeitig anfragen, die erste gültige Antwort gewinnt
             try:
-                layers = get_wfs_layers(service_url)
-                service_type = 'WFS'
-            except Exception as wfs_error:
-                logger.info(f'WFS-Abruf fehlgeschlagen, versuche WMS: {str(wfs_error)}')
-                try:
-                    layers = get_wms_layers(service_url)
-                    service_type = 'WMS'
-                except Exception as wms_error:
-                    logger.error(f'Beide Service-Typen fehlgeschlagen - WFS: {str(wfs_error)}, WMS: {str(wms_error)}')
-                    return jsonify({
-                        'status': 'error',
-                        'message': 'Service nicht erkannt oder nicht erreichbar'
-                    })
+                service_type, layers = service_detector.detect(service_url)
+            except Exception as detect_error:
+                logger.error(f'Alle Service-Typen fehlgeschlagen - {str(detect_error)}')
+                return jsonify({
+                    'status': 'error',
+                    'message': 'Service nicht erkannt oder nicht erreichbar'
+                })
 
             return jsonify({
                 'status': 'success',
@@ -236,165 +432,129 @@ def create_app(config_name='default'):
                 'message': f'Fehler beim Laden der Layer: {str(e)}'
             })
 
-    def get_wfs_layers(url):
-        """Holt Layer von einem WFS-Service"""
-        params = {
-            'service': 'WFS',
-            'request': 'GetCapabilities'
-        }
-        
-        response = requests.get(url, params=params, verify=False, timeout=30)
-        if response.status_code != 200:
-            raise Exception(f'WFS-Server antwortet nicht (Status: {response.status_code})')
-
-        root = ET.fromstring(response.content)
-        namespaces = {
-            'wfs': 'http://www.opengis.net/wfs/2.0',
-            'wfs1': 'http://www.opengis.net/wfs',
-            'ows': 'http://www.opengis.net/ows/1.1',
-            'ows2': 'http://www.opengis.net/ows'
-        }
-
-        layers = {}
-        feature_types = []
-
-        # Suche FeatureTypes
-        for xpath in ['.//wfs:FeatureType', './/wfs1:FeatureType', './/FeatureType']:
-            feature_types = root.findall(xpath, namespaces)
-            if feature_types:
-                break
-
-        if not feature_types:
-            raise Exception('Keine Layer im WFS-Dienst gefunden')
-
-        # Layer-Informationen sammeln
-        for feature_type in feature_types:
-            name = None
-            for name_path in ['Name', 'wfs:Name', 'wfs1:Name']:
-                name_elem = feature_type.find(name_path, namespaces)
-                if name_elem is not None:
-                    name = name_elem.text
-                    break
-
-            if name is None:
-                continue
-
-            title = None
-            for title_path in ['Title', 'wfs:Title', 'wfs1:Title']:
-                title_elem = feature_type.find(title_path, namespaces)
-                if title_elem is not None:
-                    title = title_elem.text
-                    break
-
-            abstract = None
-            for abstract_path in ['Abstract', 'wfs:Abstract', 'wfs1:Abstract']:
-                abstract_elem = feature_type.find(abstract_path, namespaces)
-                if abstract_elem is not None:
-                    abstract = abstract_elem.text
-                    break
-
-            title = title or name
-            namespace = name.split(':')[0] if ':' in name else 'default'
-            layer_name = name.split(':')[1] if ':' in name else name
+    def read_capabilities_layers(url, service_type):
+        """Liest die Layer eines Dienstes inkrementell aus dem GetCapabilities-Dokument"""
+        reader = open_capabilities(url, service_type)
+        try:
+            detected_type = reader.read_header()
+            if detected_type != service_type:
+                raise Exception(f'Kein {service_type}-Dienst (Antwort: {reader.root_tag})')
+            if service_type == 'WFS' and reader.version:
+                wfs_versions[url] = reader.version
 
-            if namespace not in layers:
-                layers[namespace] = {}
+            layers = reader.layers_by_namespace()
+        finally:
+            reader.close()
 
-            layers[namespace][layer_name] = {
-                'name': name,
-                'title': title,
-                'description': abstract or '',
-                'attributes': []  # Attribute werden später geladen
-            }
+        if not layers:
+            raise Exception(f'Keine Layer im {service_type}-Dienst gefunden')
 
         return layers
 
+    def get_wfs_layers(url):
+        """Holt Layer von einem WFS-Service"""
+        return read_capabilities_layers(url, 'WFS')
+
     def get_wms_layers(url):
         """Holt Layer von einem WMS-Service"""
-        params = {
-            'service': 'WMS',
-            'request': 'GetCapabilities'
-        }
-        
-        response = requests.get(url, params=params, verify=False, timeout=30)
-        if response.status_code != 200:
-            raise Exception(f'WMS-Server antwortet nicht (Status: {response.status_code})')
+        return read_capabilities_layers(url, 'WMS')
 
-        root = ET.fromstring(response.content)
-        namespaces = {
-            'wms': 'http://www.opengis.net/wms'
-        }
+    def get_wmts_layers(url):
+        """Holt Layer von einem WMTS-Service"""
+        return read_capabilities_layers(url, 'WMTS')
 
-        layers = {}
-        wms_layers = root.findall('.//wms:Layer', namespaces) or root.findall('.//Layer', {})
+    def get_ogcapi_features_layers(url):
+        """Holt die Collections eines OGC API Features-Dienstes"""
+        response = http_client.get(
+            url.rstrip('/') + '/collections',
+            params={'f': 'json'},
+            headers={'Accept': 'application/json'},
+            timeout=30
+        )
+        if response.status_code != 200:
+            raise Exception(f'OGC API antwortet nicht (Status: {response.status_code})')
 
-        if not wms_layers:
-            raise Exception('Keine Layer im WMS-Dienst gefunden')
+        collections = response.json().get('collections')
+        if not collections:
+            raise Exception('Keine Collections im OGC API Features-Dienst gefunden')
 
-        # Layer-Informationen sammeln
-        for layer in wms_layers:
-            name = layer.find('wms:Name', namespaces) or layer.find('Name')
-            if name is None or not name.text:
+        layers = {'default': {}}
+        for collection in collections:
+            if not collection.get('id'):
                 continue
+            bboxes = (collection.get('extent') or {}).get('spatial', {}).get('bbox') or [None]
+            layers['default'][collection['id']] = {
+                'name': collection['id'],
+                'title': collection.get('title') or collection['id'],
+                'description': collection.get('description') or '',
+                'bbox': bboxes[0],
+                'attributes': []
+            }
+        return layers
 
-            title = layer.find('wms:Title', namespaces) or layer.find('Title')
-            abstract = layer.find('wms:Abstract', namespaces) or layer.find('Abstract')
+    # Erkennung des Diensttyps mit parallelen Anfragen, Typ wird pro URL gemerkt
+    service_detector = ServiceDetector({
+        'WFS': get_wfs_layers,
+        'WMS': get_wms_layers,
+        'WMTS': get_wmts_layers,
+        'OGCAPI-Features': get_ogcapi_features_layers
+    })
 
-            name_text = name.text
-            title_text = title.text if title is not None else name_text
-            abstract_text = abstract.text if abstract is not None else ''
+    def stream_layers(url):
+        """Gibt die Layer eines Dienstes als NDJSON aus, während die Capabilities gelesen werden"""
+        reader = None
+        errors = []
+        # Bereits erkannten Diensttyp zuerst versuchen
+        service_types = ['WFS', 'WMS']
+        cached_type = service_detector.get_cached_type(url)
+        if cached_type in service_types:
+            service_types.remove(cached_type)
+            service_types.insert(0, cached_type)
 
-            namespace = name_text.split(':')[0] if ':' in name_text else 'default'
-            layer_name = name_text.split(':')[1] if ':' in name_text else name_text
+        for service_type in service_types:
+            try:
+                candidate = open_capabilities(url, service_type)
+                if candidate.read_header() == service_type:
+                    reader = candidate
+                    break
+                candidate.close()
+                errors.append(f'{service_type}: Antwort ist {candidate.root_tag}')
+            except Exception as e:
+                errors.append(f'{service_type}: {str(e)}')
 
-            if namespace not in layers:
-                layers[namespace] = {}
+        if reader is None:
+            logger.error(f'Beide Service-Typen fehlgeschlagen - {"; ".join(errors)}')
+            yield json.dumps({
+                'type': 'error',
+                'message': 'Service nicht erkannt oder nicht erreichbar'
+            }) + '\n'
+            return
 
-            layers[namespace][layer_name] = {
-                'name': name_text,
-                'title': title_text,
-                'description': abstract_text,
-                'attributes': []  # WMS hat keine Attribute
-            }
+        if reader.service_type == 'WFS' and reader.version:
+            wfs_versions[url] = reader.version
 
-        return layers
+        yield json.dumps({
+            'type': 'service',
+            'service_type': reader.service_type,
+            'version': reader.version,
+            'service_url': url
+        }) + '\n'
 
-    def detect_state(url, root=None):
-        """Erkennt das Bundesland aus der URL oder den Metadaten"""
-        states = {
-            'baden-wuerttemberg': ['bw', 'baden', 'wuerttemberg'],
-            'bayern': ['by', 'bayern', 'bavarian'],
-            'berlin': ['be', 'berlin'],
-            'brandenburg': ['bb', 'brandenburg'],
-            'bremen': ['hb', 'bremen'],
-            'hamburg': ['hh', 'hamburg'],
-            'hessen': ['he', 'hessen'],
-            'mecklenburg-vorpommern': ['mv', 'mecklenburg', 'vorpommern'],
-            'niedersachsen': ['ni', 'niedersachsen'],
-            'nordrhein-westfalen': ['nw', 'nrw', 'nordrhein', 'westfalen'],
-            'rheinland-pfalz': ['rp', 'rheinland', 'pfalz'],
-            'saarland': ['sl', 'saar'],
-            'sachsen': ['sn', 'sachsen', 'saxony'],
-            'sachsen-anhalt': ['st', 'sachsen-anhalt'],
-            'schleswig-holstein': ['sh', 'schleswig'],
-            'thueringen': ['th', 'thueringen', 'thüringen']
-        }
-        
-        url = url.lower()
-        
-        # Suche in URL
-        for state, keywords in states.items():
-            if any(kw in url for kw in keywords):
-                return state
-            
-        # Suche in Metadaten falls vorhanden
-        if root is not None:
-            metadata_text = ET.tostring(root, encoding='unicode').lower()
-            for state, keywords in states.items():
-                if any(kw in metadata_text for kw in keywords):
-                    return state
-        
-        return 'unknown'
+        count = 0
+        try:
+            for record in reader.iter_layers():
+                count += 1
+                yield json.dumps({'type': 'layer', 'layer': record}) + '\n'
+        except Exception as e:
+            logger.error(f"Fehler beim Lesen der Capabilities: {str(e)}")
+            yield json.dumps({'type': 'error', 'message': str(e)}) + '\n'
+            return
+
+        yield json.dumps({'type': 'done', 'layer_count': count}) + '\n'
+
+    def detect_state(url, service_info=None):
+        """Erkennt das Bundesland aus der URL oder den Capabilities-Feldern des Dienstes"""
+        return classify_state(url, service_info)
 
     def extract_wfs_layer_info(feature_type, service_url, state):
         """Extrahiert Layer-Informationen aus WFS FeatureType"""
@@ -454,148 +614,85 @@ def create_app(config_name='default'):
             return None
 
     def import_layer_batch(layer_batch):
-        """Importiert einen Batch von Layern ins Lexikon"""
-        conn = sqlite3.connect(app.config['DATABASE'])
-        cursor = conn.cursor()
-        
+        """
+        Importiert einen Batch von Layern ins Lexikon (Upsert in einer Transaktion).
+        Bereinigte Namen und KI-Beschreibungen ergänzt anschließend die Enrichment-Queue.
+        """
+        layer_rows = [
+            (
+                layer['name'],
+                layer['title'],
+                layer['description'],
+                layer['source_url'],
+                layer['source_type'],
+                layer['state']
+            )
+            for layer in layer_batch
+        ]
+
+        with lexicon_db.transaction() as conn:
+            conn.executemany('''
+                INSERT INTO wfs_layers (
+                    name, title, description,
+                    source_url, source_type, state,
+                    created_at, last_updated
+                ) VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+                ON CONFLICT(name, source_url) DO UPDATE SET
+                    title = excluded.title,
+                    description = excluded.description,
+                    state = excluded.state,
+                    last_updated = CURRENT_TIMESTAMP
+            ''', layer_rows)
+
+            upsert_layer_attributes(conn, layer_batch)
+
+            store_layer_extents(conn, [
+                (layer['name'], layer['source_url'], layer.get('bbox')) for layer in layer_batch
+            ])
+            for source_url in {layer['source_url'] for layer in layer_batch}:
+                update_service_extent(conn, source_url)
+
+            enqueue_layers(conn, [(layer['name'], layer['source_url']) for layer in layer_batch])
+
+        enrichment_queue.notify()
+
+    def upsert_layer_attributes(conn, layers):
+        """Schreibt die Attribute der Layer (im with-Block des Aufrufers) und aktualisiert den Suchindex"""
+        # Attribute über (Layer, Name) eindeutig, ein erneuter Import legt keine Duplikate an
+        conn.executemany('''
+            INSERT INTO layer_attributes (layer_id, name, type, description)
+            SELECT id, ?, ?, ? FROM wfs_layers WHERE name = ? AND source_url = ?
+            ON CONFLICT(layer_id, name) DO UPDATE SET
+                type = excluded.type,
+                description = excluded.description
+        ''', [
+            (attr['name'], attr.get('type', ''), attr.get('description', ''), layer['name'], layer['source_url'])
+            for layer in layers
+            for attr in layer['attributes']
+        ])
+        refresh_attribute_index(conn, [(layer['name'], layer['source_url']) for layer in layers])
+
+    def load_missing_attributes(service_url, layers):
+        """Lädt die Attribute importierter WFS-Layer gesammelt per DescribeFeatureType nach"""
         try:
-            for layer in layer_batch:
-                # KI-Verarbeitung der Layer-Informationen
-                cleaned_name = ai_helper.clean_layer_name(layer['name'])
-                ai_description = ai_helper.generate_layer_description(layer['name'], layer['description'])
-                
-                # Prüfe ob Layer bereits existiert
-                cursor.execute('''
-                    SELECT id FROM wfs_layers 
-                    WHERE name = ? AND source_url = ?
-                ''', (layer['name'], layer['source_url']))
-                
-                existing = cursor.fetchone()
-                
-                if existing:
-                    # Update existierenden Layer
-                    cursor.execute('''
-                        UPDATE wfs_layers 
-                        SET title = ?,
-                            description = ?,
-                            cleaned_name = ?,
-                            ai_description = ?,
-                            state = ?,
-                            last_updated = CURRENT_TIMESTAMP
-                        WHERE name = ? AND source_url = ?
-                    ''', (
-                        layer['title'],
-                        layer['description'],
-                        cleaned_name,
-                        ai_description,
-                        layer['state'],
-                        layer['name'],
-                        layer['source_url']
-                    ))
-                else:
-                    # Füge neuen Layer hinzu
-                    cursor.execute('''
-                        INSERT INTO wfs_layers (
-                            name, title, description, 
-                            cleaned_name, ai_description,
-                            source_url, source_type, state,
-                            created_at, last_updated
-                        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-                    ''', (
-                        layer['name'],
-                        layer['title'],
-                        layer['description'],
-                        cleaned_name,
-                        ai_description,
-                        layer['source_url'],
-                        layer['source_type'],
-                        layer['state']
-                    ))
-                
-                layer_id = cursor.lastrowid if not existing else existing[0]
-                
-                # Füge Attribute hinzu
-                for attr in layer['attributes']:
-                    cursor.execute('''
-                        INSERT INTO layer_attributes (
-                            layer_id, name, type, description
-                        ) VALUES (?, ?, ?, ?)
-                    ''', (
-                        layer_id,
-                        attr['name'],
-                        attr.get('type', ''),
-                        attr.get('description', '')
-                    ))
-        
-            conn.commit()
-            
+            version = detect_wfs_version(service_url)
+            schemas = schema_loader.load(service_url, [layer['name'] for layer in layers], version)
+            for layer in layers:
+                layer['attributes'] = schemas.get(layer['name'], [])
+            with lexicon_db.transaction() as conn:
+                upsert_layer_attributes(conn, [layer for layer in layers if layer['attributes']])
+            logger.info(f"Attribute für {len(schemas)} von {len(layers)} Layern geladen (WFS {version})")
         except Exception as e:
-            conn.rollback()
-            raise e
-        
-        finally:
-            conn.close()
+            logger.warning(f"Attribute für {service_url} konnten nicht geladen werden: {str(e)}")
 
     def init_data_lexicon():
         """Initialisiert die Datenbank für das Daten-Lexikon"""
-        conn = sqlite3.connect(app.config['DATABASE'])
+        conn = lexicon_db.acquire()
         cursor = conn.cursor()
         
         try:
-            # Erstelle Tabelle für Layer
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS wfs_layers (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    cleaned_name TEXT,
-                    title TEXT,
-                    description TEXT,
-                    ai_description TEXT,
-                    source_url TEXT NOT NULL,
-                    source_type TEXT NOT NULL,
-                    state TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(name, source_url)
-                )
-            ''')
-            
-            # Füge neue Spalten hinzu, falls sie noch nicht existieren
-            cursor.execute("PRAGMA table_info(wfs_layers)")
-            columns = [column[1] for column in cursor.fetchall()]
-            
-            if 'cleaned_name' not in columns:
-                cursor.execute('ALTER TABLE wfs_layers ADD COLUMN cleaned_name TEXT')
-            if 'ai_description' not in columns:
-                cursor.execute('ALTER TABLE wfs_layers ADD COLUMN ai_description TEXT')
-
-            # Erstelle Tabelle für Layer-Attribute
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS layer_attributes (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    layer_id INTEGER NOT NULL,
-                    name TEXT NOT NULL,
-                    type TEXT,
-                    description TEXT,
-                    FOREIGN KEY (layer_id) REFERENCES wfs_layers(id)
-                )
-            ''')
-            
-            # Erstelle Tabelle für Services
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS services (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    url TEXT NOT NULL,
-                    type TEXT NOT NULL,
-                    title TEXT,
-                    description TEXT,
-                    state TEXT,
-                    status TEXT DEFAULT 'active',
-                    last_checked TIMESTAMP,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(url, type)
-                )
-            ''')
+            # Tabellen für Layer, Attribute und Services anlegen
+            init_lexicon_schema(cursor)
             
             conn.commit()
             
@@ -604,16 +701,235 @@ def create_app(config_name='default'):
             raise e
         
         finally:
-            conn.close()
+            lexicon_db.release(conn)
 
     # Initialisiere Datenbank beim Start
     init_data_lexicon()
 
+    # Laufende und abgeschlossene Crawl-Jobs
+    crawl_jobs = {}
+    crawl_jobs_lock = Lock()
+
+    def run_crawl_job(job_id, urls, sync=False):
+        """Führt einen Crawl-Job im Hintergrund aus"""
+        def update_progress(done, total, service):
+            with crawl_jobs_lock:
+                crawl_jobs[job_id]['done'] = done
+                crawl_jobs[job_id]['last_service'] = service
+
+        try:
+            crawler = ServiceCrawler(app.config['DATABASE'], state_detector=detect_state, sync=sync)
+            summary = crawler.crawl(urls, progress_callback=update_progress)
+            enrichment_queue.notify()
+            with crawl_jobs_lock:
+                crawl_jobs[job_id]['status'] = 'finished'
+                crawl_jobs[job_id]['summary'] = summary
+        except Exception as e:
+            logger.error(f"Fehler im Crawl-Job {job_id}: {str(e)}")
+            with crawl_jobs_lock:
+                crawl_jobs[job_id]['status'] = 'error'
+                crawl_jobs[job_id]['message'] = str(e)
+
+    @app.route('/api/crawl', methods=['POST'])
+    def start_crawl():
+        """Startet das Crawlen einer Liste von Dienst-URLs, mit 'sync' nur als Abgleich der Änderungen"""
+        data = request.get_json()
+        if not data or not data.get('urls'):
+            return jsonify({
+                'status': 'error',
+                'message': 'Keine Dienst-URLs angegeben'
+            }), 400
+
+        job_id = uuid.uuid4().hex
+        with crawl_jobs_lock:
+            crawl_jobs[job_id] = {
+                'status': 'running',
+                'total': len(data['urls']),
+                'done': 0,
+                'last_service': None,
+                'summary': None
+            }
+
+        Thread(target=run_crawl_job, args=(job_id, data['urls'], bool(data.get('sync'))), daemon=True).start()
+        logger.info(f"Crawl-Job {job_id} mit {len(data['urls'])} Diensten gestartet")
+
+        return jsonify({
+            'status': 'success',
+            'job_id': job_id,
+            'message': f"Crawlen von {len(data['urls'])} Diensten gestartet"
+        })
+
+    @app.route('/api/crawl/<job_id>')
+    def crawl_status(job_id):
+        """Liefert Fortschritt und Zusammenfassung eines Crawl-Jobs"""
+        with crawl_jobs_lock:
+            job = crawl_jobs.get(job_id)
+            if job is None:
+                return jsonify({
+                    'status': 'error',
+                    'message': 'Crawl-Job nicht gefunden'
+                }), 404
+            return jsonify(dict(job, job_id=job_id))
+
+    # Laufende und abgeschlossene Wertestatistik-Jobs je Layer
+    profile_jobs = {}
+    profile_jobs_lock = Lock()
+
+    def run_profile_job(layer_id, max_features):
+        """Erstellt die Wertestatistik eines Layers im Hintergrund"""
+        try:
+            profiler = AttributeProfiler(app.config['DATABASE'])
+            summary = profiler.profile_layer(layer_id, max_features=max_features)
+            with profile_jobs_lock:
+                profile_jobs[layer_id]['status'] = 'finished'
+                profile_jobs[layer_id]['summary'] = summary
+        except Exception as e:
+            logger.error(f"Fehler bei der Wertestatistik für Layer {layer_id}: {str(e)}")
+            with profile_jobs_lock:
+                profile_jobs[layer_id]['status'] = 'error'
+                profile_jobs[layer_id]['message'] = str(e)
+
+    @app.route('/api/lexicon/layers/<int:layer_id>/profile', methods=['POST'])
+    def start_profile(layer_id):
+        """Startet die Wertestatistik eines Layers (ein Durchlauf über alle Features)"""
+        data = request.get_json(silent=True) or {}
+        try:
+            max_features = int(data['max_features']) if data.get('max_features') else None
+        except (TypeError, ValueError):
+            return jsonify({
+                'status': 'error',
+                'message': 'Ungültige Anzahl an Features'
+            }), 400
+
+        with profile_jobs_lock:
+            if profile_jobs.get(layer_id, {}).get('status') == 'running':
+                return jsonify({
+                    'status': 'error',
+                    'message': 'Wertestatistik für diesen Layer läuft bereits'
+                }), 409
+            profile_jobs[layer_id] = {'status': 'running', 'summary': None}
+
+        Thread(target=run_profile_job, args=(layer_id, max_features), daemon=True).start()
+        return jsonify({
+            'status': 'success',
+            'message': 'Wertestatistik gestartet'
+        })
+
+    @app.route('/api/lexicon/layers/<int:layer_id>/attributes')
+    def layer_attribute_statistics(layer_id):
+        """Liefert die gespeicherte Wertestatistik und den Stand eines laufenden Jobs"""
+        try:
+            top = min(int(request.args.get('top', 10)), 50)
+            with lexicon_db.connection() as conn:
+                attributes = load_attribute_statistics(conn, layer_id, top=top)
+            with profile_jobs_lock:
+                job = dict(profile_jobs.get(layer_id) or {})
+
+            return jsonify({
+                'status': 'success',
+                'layer_id': layer_id,
+                'job': job or None,
+                'attributes': attributes
+            })
+        except ValueError:
+            return jsonify({
+                'status': 'error',
+                'message': 'Ungültiger Parameter top'
+            }), 400
+        except Exception as e:
+            logger.error(f"Fehler beim Laden der Wertestatistik: {str(e)}")
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 500
+
+    # KI-Anreicherung (bereinigte Namen, Beschreibungen) im Hintergrund
+    # Die Worker werden vom Server-Einstiegspunkt gestartet, nicht pro App-Instanz
+    enrichment_queue = EnrichmentQueue(app.config['DATABASE'], ai_helper)
+    app.extensions['enrichment_queue'] = enrichment_queue
+
+    @app.route('/api/enrichment/progress')
+    def enrichment_progress():
+        """Liefert den Fortschritt der KI-Anreicherung, optional für einen Dienst"""
+        try:
+            return jsonify({
+                'status': 'success',
+                'progress': enrichment_queue.progress(request.args.get('source_url'))
+            })
+        except Exception as e:
+            logger.error(f"Fehler beim Laden des Anreicherungs-Fortschritts: {str(e)}")
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 500
+
+    @app.route('/api/ai/cache-stats')
+    def ai_cache_stats():
+        """Trefferquote und Größe des KI-Antwort-Caches, Zähler des KI-Dispatchers und Anteil lokal bereinigter Namen"""
+        try:
+            return jsonify({
+                'status': 'success',
+                'stats': get_llm_cache().stats(),
+                'dispatcher': get_llm_dispatcher().stats(),
+                'name_normalizer': normalizer_stats()
+            })
+        except Exception as e:
+            logger.error(f"Fehler beim Laden der Cache-Statistik: {str(e)}")
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 500
+
+    # Regelmäßige Prüfung aller registrierten Dienste; gestartet wird nur vom Server-Einstiegspunkt
+    service_monitor = ServiceMonitor(
+        app.config['DATABASE'],
+        interval=app.config.get('SERVICE_MONITOR_INTERVAL') or 900
+    )
+    app.extensions['service_monitor'] = service_monitor
+
+    @app.route('/api/services/health')
+    def services_health():
+        """Liefert Verfügbarkeit, Latenzen und Download-Empfehlungen aller Dienste"""
+        try:
+            conn = lexicon_db.acquire()
+            conn.row_factory = sqlite3.Row
+            services = [dict(row) for row in conn.execute('''
+                SELECT id, url, type, title, state, status, last_checked,
+                       availability, latency_p50, latency_p95,
+                       preferred_version, preferred_format, capabilities_hash
+                FROM services
+                ORDER BY status, latency_p95
+            ''')]
+
+            return jsonify({
+                'status': 'success',
+                'services': services
+            })
+
+        except Exception as e:
+            logger.error(f"Fehler beim Laden des Dienst-Status: {str(e)}")
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 500
+        finally:
+            if 'conn' in locals():
+                lexicon_db.release(conn)
+
+    @app.route('/api/services/check', methods=['POST'])
+    def check_services():
+        """Startet sofort einen Prüflauf über alle Dienste"""
+        Thread(target=service_monitor.run_once, daemon=True).start()
+        return jsonify({
+            'status': 'success',
+            'message': 'Prüfung der Dienste gestartet'
+        })
+
     @app.route('/debug_lexicon')
     def debug_lexicon():
         """Debug-Endpunkt für das Lexikon"""
         try:
-            conn = sqlite3.connect(app.config['DATABASE'])
+            conn = lexicon_db.acquire()
             cursor = conn.cursor()
             
             cursor.execute('''
@@ -643,7 +959,7 @@ def create_app(config_name='default'):
             })
         finally:
             if 'conn' in locals():
-                conn.close()
+                lexicon_db.release(conn)
 
     @app.route('/api/clean-layer-names', methods=['POST'])
     @auto_debug
@@ -658,41 +974,49 @@ def create_app(config_name='default'):
                 }), 400
 
             layers = data['layers']
-            cleaned_layers = []
-            batch_size = 10  # Maximale Batch-Größe
-            
-            # Verarbeite Layer in Batches
-            for i in range(0, len(layers), batch_size):
-                batch = layers[i:i + batch_size]
-                
+
+            def process_batch(batch):
                 try:
-                    # Erstelle Liste der Layer-Namen für diesen Batch
-                    layer_names = [layer['name'] for layer in batch]
-                    layer_titles = [layer.get('title', '') for layer in batch]
-                    
-                    # Batch-Verarbeitung der Namen
-                    cleaned_names = ai_helper.clean_layer_names_batch(layer_names)
-                    descriptions = ai_helper.generate_layer_descriptions_batch(layer_names, layer_titles)
+                    # Namen und Erklärungen in einer strukturierten Anfrage, Zuordnung über die Position
+                    results = {
+                        result['id']: result
+                        for result in ai_helper.clean_layers_batch([
+                            {'id': j, 'name': layer['name'], 'title': layer.get('title', '')}
+                            for j, layer in enumerate(batch)
+                        ])
+                    }
                     
-                    # Füge die Ergebnisse zur Liste hinzu
-                    for j, layer in enumerate(batch):
-                        cleaned_layers.append({
-                            'id': layer['name'],
-                            'cleaned_name': cleaned_names[j] if j < len(cleaned_names) else layer['name'],
-                            'explanation': descriptions[j] if j < len(descriptions) else "Keine Beschreibung verfügbar"
-                        })
-                        
                     logger.info(f"Batch von {len(batch)} Layern verarbeitet")
+                    return [
+                        {
+                            'id': layer['name'],
+                            'cleaned_name': results[j]['cleaned_name'] if j in results else layer['name'],
+                            'explanation': results[j]['explanation'] if j in results else "Keine Beschreibung verfügbar"
+                        }
+                        for j, layer in enumerate(batch)
+                    ]
                     
                 except Exception as e:
                     logger.error(f"Fehler bei der Batch-Verarbeitung: {str(e)}")
                     # Bei Fehler, füge unverarbeitete Layer hinzu
-                    for layer in batch:
-                        cleaned_layers.append({
+                    return [
+                        {
                             'id': layer['name'],
                             'cleaned_name': layer['name'],
                             'explanation': f"Fehler bei der Verarbeitung: {str(e)}"
-                        })
+                        }
+                        for layer in batch
+                    ]
+
+            # Batches nach Token-Budget des Modells packen (zusammenhängend, in Eingabereihenfolge)
+            batches = ai_helper.layer_batches(layers)
+
+            # Batches nebenläufig über den KI-Dispatcher verarbeiten, Reihenfolge bleibt erhalten
+            cleaned_layers = [
+                cleaned
+                for batch_result in get_llm_dispatcher().map(process_batch, batches)
+                for cleaned in batch_result
+            ]
 
             return jsonify({
                 'status': 'success',
@@ -721,4 +1045,10 @@ if __name__ == '__main__':
     print(f"Debug mode: {debug}")
     print(f"Database: {app.config['DATABASE']}")
     
+    # Hintergrund-Worker mit Reloader nur im Arbeitsprozess starten, nicht zusätzlich im überwachenden Prozess
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        app.extensions['enrichment_queue'].start()
+        if app.config.get('SERVICE_MONITOR_INTERVAL'):
+            app.extensions['service_monitor'].start()
+    
     app.run(host='0.0.0.0', port=port, debug=debug) 
\ No newline at end of file
@@ -3,6 +3,8 @@ class Config:
     TESTING = False
     DATABASE_NAME = 'data_lexicon.db'
     PORT = 5001
+    # Abstand in Sekunden zwischen zwei Prüfläufen des Dienst-Monitors (0 = deaktiviert)
+    SERVICE_MONITOR_INTERVAL = 900
 
 class ProductionConfig(Config):
     DATABASE_NAME = 'production_lexicon.db'
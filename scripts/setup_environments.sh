@@ -46,6 +46,10 @@ PORT=5001
 DEBUG=False
 EOL
 
+# Handbücher einmalig für die KI-Prompts aufbereiten
+echo -e "${GREEN}Erstelle Handbuch-Index...${NC}"
+python -m utils.handbook_index || echo "Handbuch-Index nicht erstellt (pypdf installiert?)"
+
 echo -e "${BLUE}=== Setup abgeschlossen ===${NC}"
 echo -e "${GREEN}Entwicklungsserver starten mit: ./scripts/start_development.sh${NC}"
 echo -e "${GREEN}Produktionsserver starten mit: ./scripts/start_production.sh${NC}" 
\ No newline at end of file
@@ -35,8 +35,52 @@ import shutil
 import sqlite3
 from datetime import datetime
 from langchain_community.llms import OpenAI
-from langchain.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import sys
+
+# Projektverzeichnis in den Suchpfad aufnehmen, damit die gemeinsamen Module (utils/) importierbar sind
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from utils.capabilities_parser import open_capabilities
+from utils import http_client
+from utils.service_monitor import DOWNLOAD_PLAN_MAX_AGE, load_download_plan
+from utils.lexicon_db import get_lexicon_db
+from utils.llm_cache import get_llm_cache, template_hash
+from utils.llm_dispatcher import estimate_tokens, get_llm_dispatcher
+from utils.batch_packer import berechne_tokens, format_batch, pack_batches, split_response
+from utils.name_normalizer import resolve_layer_name, to_identifier
+from utils.handbook_retriever import retrieve_context, retrieve_context_batch
+
+# owslib-Anfragen über die gemeinsame HTTP-Session leiten
+http_client.patch_owslib()
+
+# Lexikon-Datenbank, in die der Dienst-Monitor Version, Format und Status schreibt
+LEXICON_DATABASE = os.getenv(
+    'LEXICON_DATABASE',
+    os.path.join(PROJECT_ROOT, 'database', 'development_lexicon.db')
+)
+
+
+def llm_predict(llm, prompt_name, prompt):
+    """
+    Fragt ein langchain-LLM an; bekannte Prompts werden aus dem gemeinsamen KI-Cache beantwortet,
+    neue Anfragen laufen über den gemeinsamen Dispatcher (Ratenlimits, Wiederholung bei 429)
+    """
+    return get_llm_cache().cached(
+        getattr(llm, 'model_name', 'langchain'),
+        getattr(llm, 'temperature', 0.7),
+        template_hash('langchain', prompt_name),
+        prompt,
+        lambda: get_llm_dispatcher().call(
+            lambda: llm.predict(prompt),
+            estimate_tokens(prompt, completion_tokens=getattr(llm, 'max_tokens', 256))
+        )
+    )
+
+
+# Erwartete Antwortlänge pro Layer beim Säubern der Namen ('original_name|neuer_name')
+CLEAN_NAMES_OUTPUT_TOKENS = 40
 
 # Lade Umgebungsvariablen aus config.env
 config_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'config.env')
@@ -105,7 +149,7 @@ def test_wfs_version(url, version):
             'version': version,
             'request': 'GetCapabilities'
         }
-        response = requests.get(url, params=params, timeout=10, verify=False)
+        response = http_client.get(url, params=params, timeout=10)
         if response.status_code == 200:
             try:
                 root = ET.fromstring(response.content)
@@ -128,6 +172,22 @@ def get_working_wfs_version(url):
     """
     Findet die funktionierende WFS-Version für einen Dienst
     """
+    # Vom Dienst-Monitor ermittelte Version verwenden, sofern die letzte Prüfung aktuell ist;
+    # läuft der Monitor nicht (z.B. unter flask run oder WSGI), werden die Versionen getestet
+    plan = load_download_plan(LEXICON_DATABASE, url, max_age=DOWNLOAD_PLAN_MAX_AGE)
+    if plan:
+        if plan['status'] == 'error':
+            # Nicht erreichbare Dienste nicht erneut mit allen Versionen abfragen
+            logger.error(f"Dienst {url} ist laut Monitor nicht erreichbar "
+                         f"(Verfügbarkeit: {plan['availability']})")
+            return None
+        if plan['status'] == 'slow':
+            logger.warning(f"Dienst {url} ist laut Monitor langsam "
+                           f"(Verfügbarkeit: {plan['availability']}, p95: {plan['latency_p95']} ms)")
+        if plan['preferred_version'] in WFS_VERSIONS:
+            logger.info(f"Verwende vom Monitor ermittelte WFS-Version: {plan['preferred_version']}")
+            return plan['preferred_version']
+
     logger.info(f"Teste WFS-Versionen für URL: {url}")
     working_versions = []
     
@@ -159,111 +219,73 @@ def get_layers():
     logger.info(f"Versuche WFS-Layer zu laden von: {wfs_url}")
     
     try:
-        # GetCapabilities-Anfrage mit SSL-Verifizierung deaktiviert
-        params = {
-            'service': 'WFS',
-            'request': 'GetCapabilities'
-        }
-        
-        response = requests.get(wfs_url, params=params, verify=False, timeout=30)
-        if response.status_code != 200:
-            logger.error(f"Server-Fehler: Status {response.status_code}")
-            return jsonify({
-                'status': 'error',
-                'message': f'Server antwortet nicht (Status: {response.status_code})'
-            })
+        # GetCapabilities-Anfrage, die Antwort wird direkt aus dem Stream gelesen
+        reader = open_capabilities(wfs_url, 'WFS')
 
-        # Parse XML mit besserer Fehlerbehandlung
         try:
-            root = ET.fromstring(response.content)
-        except ET.ParseError as e:
+            service_type = reader.read_header()
+        except (ET.ParseError, ValueError) as e:
+            reader.close()
             logger.error(f"XML-Parsing-Fehler: {str(e)}")
             return jsonify({
                 'status': 'error',
                 'message': 'Ungültige Server-Antwort: Kein gültiges XML'
             })
 
-        # Finde WFS Version
-        version = root.get('version')
+        # Capabilities eines anderen Diensttyps (z.B. WMS) nicht als WFS auswerten
+        if service_type not in (None, 'WFS'):
+            reader.close()
+            raise Exception(f'Kein WFS-Dienst (Antwort: {reader.root_tag})')
+
+        # Finde WFS Version; Fehlerdokumente ohne Version führen zu den alternativen Versionen
+        version = reader.version if service_type == 'WFS' else None
         if not version:
+            reader.close()
+            reader = None
             # Versuche alternative Versionen
             for v in WFS_VERSIONS:
-                params['version'] = v
-                response = requests.get(wfs_url, params=params, verify=False)
-                if response.status_code == 200:
+                try:
+                    candidate = open_capabilities(wfs_url, 'WFS', version=v)
+                    if candidate.read_header() != 'WFS':
+                        candidate.close()
+                        raise Exception(f'Kein WFS-Dienst (Antwort: {candidate.root_tag})')
                     version = v
-                    root = ET.fromstring(response.content)
+                    reader = candidate
                     break
-        
+                except Exception as e:
+                    logger.warning(f"WFS Version {v} nicht erfolgreich: {str(e)}")
+
         if not version:
             return jsonify({
                 'status': 'error',
                 'message': 'Keine kompatible WFS-Version gefunden'
             })
 
-        # Namespace-Handling
-        namespaces = {
-            'wfs': 'http://www.opengis.net/wfs/2.0',
-            'wfs1': 'http://www.opengis.net/wfs',
-            'ows': 'http://www.opengis.net/ows/1.1',
-            'ows2': 'http://www.opengis.net/ows'
-        }
-        
         layers = {}
-        feature_types = []
-
-        # Suche FeatureTypes
-        for xpath in [
-            './/wfs:FeatureType',
-            './/wfs1:FeatureType',
-            './/FeatureType'
-        ]:
-            feature_types = root.findall(xpath, namespaces)
-            if feature_types:
-                break
-
-        if not feature_types:
-            return jsonify({
-                'status': 'error',
-                'message': 'Keine Layer im WFS-Dienst gefunden'
-            })
-
-        # Layer-Informationen sammeln
-        for feature_type in feature_types:
-            name = None
-            for name_path in ['Name', 'wfs:Name', 'wfs1:Name']:
-                name_elem = feature_type.find(name_path, namespaces)
-                if name_elem is not None:
-                    name = name_elem.text
-                    break
 
-            if name is None:
-                continue
-
-            title = None
-            for title_path in ['Title', 'wfs:Title', 'wfs1:Title']:
-                title_elem = feature_type.find(title_path, namespaces)
-                if title_elem is not None:
-                    title = title_elem.text
-                    break
+        # Layer-Informationen sammeln, Namespace-Varianten werden im Reader aufgelöst
+        for record in reader.iter_layers():
+            name = record['name']
+            title = record['title']
 
-            title = title or name
-            
             # ATKIS Layer erkennen und verarbeiten
             if name.startswith('ax_'):
                 title = process_atkis_layer(name, title)
 
-            namespace = name.split(':')[0] if ':' in name else 'default'
-            layer_name = name.split(':')[1] if ':' in name else name
-
-            if namespace not in layers:
-                layers[namespace] = {}
+            if record['namespace'] not in layers:
+                layers[record['namespace']] = {}
 
-            layers[namespace][layer_name] = {
+            layers[record['namespace']][record['layer_name']] = {
                 'title': title,
                 'name': name
             }
 
+        if not layers:
+            return jsonify({
+                'status': 'error',
+                'message': 'Keine Layer im WFS-Dienst gefunden'
+            })
+
         return jsonify({
             'status': 'success',
             'version': version,
@@ -302,9 +324,12 @@ def download_wfs_with_paging(wfs_url, layer_name, version, output_format='GeoJSO
         wfs = WebFeatureService(url=wfs_url, version=version, timeout=30, verify=False)
         
         # Bestimme das richtige Ausgabeformat für die WFS-Anfrage
+        plan = load_download_plan(LEXICON_DATABASE, wfs_url)
         if version == '2.0.0':
             output_formats = wfs.getOperationByName('GetFeature').parameters['outputFormat']['values']
-            if 'application/json' in output_formats:
+            if plan and plan['preferred_format'] in output_formats:
+                wfs_output = plan['preferred_format']
+            elif 'application/json' in output_formats:
                 wfs_output = 'application/json'
             elif 'GML3' in output_formats:
                 wfs_output = 'GML3'
@@ -485,19 +510,16 @@ def check_layer_status(layer_info):
 # Datenlexikon Datenbank initialisieren
 def init_data_lexicon():
     db_path = os.path.join(os.getcwd(), 'data_lexicon.db')
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS wfs_layers
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  name TEXT, 
-                  title TEXT, 
-                  translated_title TEXT,
-                  type TEXT, 
-                  source_url TEXT,
-                  attributes TEXT,
-                  discovery_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-    conn.commit()
-    conn.close()
+    with get_lexicon_db(db_path).transaction() as conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS wfs_layers
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      name TEXT, 
+                      title TEXT, 
+                      translated_title TEXT,
+                      type TEXT, 
+                      source_url TEXT,
+                      attributes TEXT,
+                      discovery_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
 
 def add_to_lexicon(layer_name, layer_title, layer_type, source_url, attributes=None):
     """Fügt einen Layer zum Lexikon hinzu"""
@@ -524,7 +546,7 @@ def add_to_lexicon(layer_name, layer_title, layer_type, source_url, attributes=N
         raise
     finally:
         if 'conn' in locals():
-            conn.close()
+            release_db_connection(conn)
 
 @app.route('/delete_lexicon_entry', methods=['POST'])
 def delete_lexicon_entry():
@@ -535,11 +557,8 @@ def delete_lexicon_entry():
             return jsonify({'status': 'error', 'message': 'Keine ID angegeben'})
             
         db_path = os.path.join(os.getcwd(), 'data_lexicon.db')
-        conn = sqlite3.connect(db_path)
-        c = conn.cursor()
-        c.execute('DELETE FROM wfs_layers WHERE id = ?', (entry_id,))
-        conn.commit()
-        conn.close()
+        with get_lexicon_db(db_path).transaction() as conn:
+            conn.execute('DELETE FROM wfs_layers WHERE id = ?', (entry_id,))
         
         return jsonify({
             'status': 'success',
@@ -570,7 +589,7 @@ def show_data_lexicon():
         return jsonify({'status': 'error', 'message': str(e)})
     finally:
         if 'conn' in locals():
-            conn.close()
+            release_db_connection(conn)
 
 # Modifiziere die prepare_download Funktion
 @app.route('/prepare_download', methods=['POST'])
@@ -925,27 +944,6 @@ def get_layer_info():
             'message': f'Fehler beim Laden der Layer-Info: {str(e)}'
         })
 
-# ATKIS Handbuch Verarbeitung
-def init_atkis_processor():
-    """Initialisiert den ATKIS-Prozessor mit dem Handbuch"""
-    global atkis_knowledge
-    try:
-        # PDF laden (Pfad muss angepasst werden)
-        loader = PyPDFLoader("docs/atkis_handbook.pdf")
-        pages = loader.load_and_split()
-        
-        # Text in Chunks aufteilen für bessere Verarbeitung
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200
-        )
-        atkis_knowledge = text_splitter.split_documents(pages)
-        logger.info("ATKIS Handbuch erfolgreich geladen")
-        return True
-    except Exception as e:
-        logger.error(f"Fehler beim Laden des ATKIS Handbuchs: {str(e)}")
-        return False
-
 def process_atkis_layer(layer_name, layer_title):
     """Verarbeitet einen ATKIS Layer mit KI-Unterstützung"""
     if not layer_name.startswith('ax_'):
@@ -955,11 +953,8 @@ def process_atkis_layer(layer_name, layer_title):
         # OpenAI API für Analyse nutzen
         llm = OpenAI(temperature=0)
         
-        # Kontext aus dem Handbuch suchen
-        relevant_context = []
-        for chunk in atkis_knowledge:
-            if layer_name[3:] in chunk.page_content.lower():
-                relevant_context.append(chunk.page_content)
+        # Kontext aus dem Handbuch suchen (BM25)
+        relevant_context = retrieve_context(f"{layer_name} {layer_title or ''}")
         
         if not relevant_context:
             return layer_title
@@ -976,7 +971,7 @@ def process_atkis_layer(layer_name, layer_title):
         """
         
         # Neuen Titel generieren
-        new_title = llm.predict(prompt).strip()
+        new_title = llm_predict(llm, 'atkis_layer_title', prompt).strip()
         logger.info(f"Layer {layer_name} umbenannt zu: {new_title}")
         return new_title
         
@@ -984,20 +979,13 @@ def process_atkis_layer(layer_name, layer_title):
         logger.error(f"Fehler bei der ATKIS-Verarbeitung: {str(e)}")
         return layer_title
 
-# Initialisiere ATKIS-Prozessor beim Start
-atkis_knowledge = []
-init_atkis_processor()
-
 def process_atkis_attributes(layer_name, attributes):
     """Verarbeitet die Attributwerte eines ATKIS Layers mit KI-Unterstützung"""
     try:
         llm = OpenAI(temperature=0)
         
-        # Kontext aus dem Handbuch suchen
-        relevant_context = []
-        for chunk in atkis_knowledge:
-            if layer_name[3:] in chunk.page_content.lower():
-                relevant_context.append(chunk.page_content)
+        # Kontext aus dem Handbuch suchen (BM25)
+        relevant_context = retrieve_context(layer_name)
         
         if not relevant_context:
             return attributes
@@ -1005,17 +993,19 @@ def process_atkis_attributes(layer_name, attributes):
         # Für jedes Attribut eine Beschreibung generieren
         translated_attributes = {}
         for attr_name, attr_value in attributes.items():
+            # Abschnitte zum Attribut, sonst der Kontext des Layers
+            context = retrieve_context(f"{layer_name} {attr_name} {attr_value}") or relevant_context
             prompt = f"""
             Basierend auf dem ATKIS-Handbuch, interpretiere das Attribut '{attr_name}' mit Wert '{attr_value}' für den Layer '{layer_name}'.
             
             Kontext aus dem Handbuch:
-            {' '.join(relevant_context[:3])}
+            {' '.join(context)}
             
             Gib eine kurze, präzise deutsche Erklärung für diesen Attributwert.
             Antworte NUR mit der Erklärung, keine weiteren Kommentare.
             """
             
-            explanation = llm.predict(prompt).strip()
+            explanation = llm_predict(llm, 'atkis_attribute', prompt).strip()
             translated_attributes[attr_name] = {
                 'original': attr_value,
                 'explanation': explanation
@@ -1039,11 +1029,15 @@ def get_attributes():
         if not wfs_url or not layer_name:
             return jsonify({'status': 'error', 'message': 'URL oder Layer-Name fehlt'})
         
+        version = get_working_wfs_version(wfs_url)
+        if not version:
+            return jsonify({'status': 'error', 'message': 'Keine kompatible WFS-Version gefunden'})
+        
         # WFS Layer laden
         uri = QgsDataSourceUri()
         uri.setParam('url', wfs_url)
         uri.setParam('typename', layer_name)
-        uri.setParam('version', get_working_wfs_version(wfs_url))
+        uri.setParam('version', version)
         uri.setParam('srsname', 'EPSG:4326')
         
         layer = QgsVectorLayer(uri.uri(), layer_name, 'WFS')
@@ -1071,6 +1065,9 @@ def get_attributes():
         start_index = (page - 1) * page_size
         end_index = start_index + page_size
         
+        # Bereits gesehene Werte je Attribut (Set statt Listensuche)
+        seen_values = {field.name(): set() for field in fields}
+
         features = []
         for i, feature in enumerate(layer.getFeatures()):
             if i < start_index:
@@ -1083,7 +1080,13 @@ def get_attributes():
                 value = feature[field.name()]
                 feature_data[field.name()] = value
                 # Sammle eindeutige Werte für jedes Attribut
-                if value not in attribute_info[field.name()]['values']:
+                try:
+                    key = value
+                    hash(key)
+                except TypeError:
+                    key = repr(value)
+                if key not in seen_values[field.name()]:
+                    seen_values[field.name()].add(key)
                     attribute_info[field.name()]['values'].append(value)
             
             features.append(feature_data)
@@ -1116,6 +1119,17 @@ def get_attributes():
             'message': str(e)
         })
 
+def handbook_context_batch(queries):
+    """
+    Handbuch-Kontext für mehrere Anfragen über die unscharfe TF-IDF-Suche (findet auch
+    Abkürzungen und Schreibvarianten); ohne numpy/scipy je Anfrage über BM25
+    """
+    try:
+        return retrieve_context_batch(queries)
+    except RuntimeError as e:
+        logger.warning(f"Unscharfe Handbuch-Suche nicht verfügbar: {str(e)}")
+        return [retrieve_context(query) for query in queries]
+
 @app.route('/sync_atkis_names', methods=['POST'])
 def sync_atkis_names():
     """Synchronisiert ATKIS-Attributnamen mit KI-Unterstützung"""
@@ -1154,11 +1168,8 @@ def sync_atkis_names():
         llm = OpenAI(temperature=0)
         
         # Kontext aus dem Handbuch suchen
-        relevant_context = []
         search_term = layer_name[3:] if layer_name.startswith('ax_') else layer_name
-        for chunk in atkis_knowledge:
-            if search_term.lower() in chunk.page_content.lower():
-                relevant_context.append(chunk.page_content)
+        relevant_context = retrieve_context(search_term) or handbook_context_batch([search_term])[0]
         
         if not relevant_context:
             logger.warning(f"Keine Kontextinformationen für Layer {layer_name} gefunden")
@@ -1168,13 +1179,21 @@ def sync_atkis_names():
             }), 404
         
         logger.info(f"Gefundene Kontexte: {len(relevant_context)}")
+
+        # Kontext aller Attribute in einer Abfrage statt einer Suche pro Attribut
+        attribute_items = list(attributes.items())
+        queries = [
+            f"{search_term} {attr_name} " + (' '.join(map(str, attr_value)) if isinstance(attr_value, (list, tuple)) else str(attr_value))
+            for attr_name, attr_value in attribute_items
+        ]
+        attribute_contexts = dict(zip(attributes, handbook_context_batch(queries)))
         
         # Verbesserte Prompts für verschiedene Attributtypen
-        translated_attributes = {}
-        for attr_name, attr_value in attributes.items():
+        def translate_attribute(item):
+            attr_name, attr_value = item
             try:
-                # Basis-Kontext für den Prompt
-                context = ' '.join(relevant_context[:3])
+                # Abschnitte zum Attribut, sonst der Kontext des Layers
+                context = ' '.join(attribute_contexts.get(attr_name) or relevant_context)
                 
                 # Spezifischer Prompt je nach Attributtyp
                 if isinstance(attr_value, (list, tuple)):
@@ -1215,20 +1234,23 @@ def sync_atkis_names():
                     """
                 
                 logger.info(f"Verarbeite Attribut: {attr_name}")
-                explanation = llm.predict(prompt).strip()
-                translated_attributes[attr_name] = {
+                explanation = llm_predict(llm, 'atkis_attribute_value', prompt).strip()
+                logger.info(f"Attribut {attr_name} erfolgreich übersetzt")
+                return attr_name, {
                     'original': attr_value,
                     'explanation': explanation
                 }
-                logger.info(f"Attribut {attr_name} erfolgreich übersetzt")
                 
             except Exception as e:
                 logger.error(f"Fehler bei der Übersetzung von Attribut {attr_name}: {str(e)}")
-                translated_attributes[attr_name] = {
+                return attr_name, {
                     'original': attr_value,
                     'explanation': f"Fehler bei der Übersetzung: {str(e)}"
                 }
-        
+
+        # Attribute nebenläufig über den KI-Dispatcher übersetzen
+        translated_attributes = dict(get_llm_dispatcher().map(translate_attribute, attribute_items))
+
         logger.info(f"Synchronisierung für Layer {layer_name} abgeschlossen")
         return jsonify({
             'status': 'success',
@@ -1243,15 +1265,19 @@ def sync_atkis_names():
         }), 500
 
 def get_db_connection():
-    """Stellt eine Verbindung zur SQLite-Datenbank her"""
+    """Entnimmt eine Verbindung zur SQLite-Datenbank aus dem Verbindungspool"""
     try:
-        conn = sqlite3.connect('src/backend/database.db')
+        conn = get_lexicon_db('src/backend/database.db').acquire()
         conn.row_factory = sqlite3.Row
         return conn
     except Exception as e:
         logger.error(f"Fehler beim Verbinden zur Datenbank: {str(e)}")
         raise
 
+def release_db_connection(conn):
+    """Gibt eine Verbindung aus get_db_connection an den Pool zurück"""
+    get_lexicon_db('src/backend/database.db').release(conn)
+
 @app.route('/api/download/<layer_id>')
 def download_layer(layer_id):
     try:
@@ -1310,7 +1336,7 @@ def sync_atkis(layer_id):
         llm = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
         
         # Features durchgehen und Namen optimieren
-        for feature in layer_data['features']:
+        def sync_feature(feature):
             if 'properties' in feature:
                 # Aktuelle Eigenschaften als Kontext sammeln
                 properties = feature['properties']
@@ -1342,14 +1368,13 @@ def sync_atkis(layer_id):
                 """
                 
                 # Neuen Namen generieren
-                response = llm.generate(prompt)
-                new_name = response.strip()
+                new_name = llm_predict(llm, 'atkis_feature_name', prompt).strip()
                 
                 # Namen aktualisieren
                 feature['properties']['display_name'] = new_name
                 
                 # Zusätzliche ATKIS-spezifische Attribute übersetzen
-                for key, value in properties.items():
+                for key, value in list(properties.items()):
                     if key in ['objektart', 'funktion', 'zustand', 'art']:
                         translation_prompt = f"""
                         Übersetze den ATKIS-Attributwert:
@@ -1359,9 +1384,12 @@ def sync_atkis(layer_id):
                         Gib eine kurze, fachlich korrekte Erklärung in maximal 100 Zeichen.
                         Antworte NUR mit der Übersetzung.
                         """
-                        translated_value = llm.generate(translation_prompt).strip()
+                        translated_value = llm_predict(llm, 'atkis_translation', translation_prompt).strip()
                         feature['properties'][f'{key}_beschreibung'] = translated_value
-        
+
+        # Features nebenläufig über den KI-Dispatcher verarbeiten
+        get_llm_dispatcher().map(sync_feature, layer_data['features'])
+
         # Aktualisierten Layer im Cache speichern
         with layer_cache_lock:
             layer_cache[layer_id] = layer_data
@@ -1422,16 +1450,13 @@ def sync_atkis_all():
         # OpenAI für ATKIS-Optimierung initialisieren
         llm = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
         
-        # ATKIS-Handbuch laden
-        atkis_handbook = load_atkis_handbook()
-        
         # Jeden Layer verarbeiten
         for layer_id in layer_ids:
             with layer_cache_lock:
                 layer_data = layer_cache[layer_id]
             
             # Features durchgehen und Namen optimieren
-            for feature in layer_data['features']:
+            def sync_feature(feature):
                 if 'properties' in feature:
                     properties = feature['properties']
                     
@@ -1445,7 +1470,7 @@ def sync_atkis_all():
                         atkis_context.append(f"Zustand: {properties['zustand']}")
                     
                     # Relevante Informationen aus dem Handbuch suchen
-                    handbook_context = search_atkis_handbook(atkis_handbook, properties)
+                    handbook_context = search_atkis_handbook(properties)
                     
                     context = ' '.join(atkis_context) if atkis_context else ' '.join(str(v) for v in properties.values())
                     if handbook_context:
@@ -1467,14 +1492,13 @@ def sync_atkis_all():
                     """
                     
                     # Neuen Namen generieren
-                    response = llm.generate(prompt)
-                    new_name = response.strip()
+                    new_name = llm_predict(llm, 'atkis_feature_name_handbook', prompt).strip()
                     
                     # Namen aktualisieren
                     feature['properties']['display_name'] = new_name
                     
                     # Zusätzliche ATKIS-spezifische Attribute übersetzen
-                    for key, value in properties.items():
+                    for key, value in list(properties.items()):
                         if key in ['objektart', 'funktion', 'zustand', 'art']:
                             translation_prompt = f"""
                             Übersetze den ATKIS-Attributwert basierend auf dem ATKIS-Handbuch:
@@ -1487,9 +1511,12 @@ def sync_atkis_all():
                             Gib eine kurze, fachlich korrekte Erklärung in maximal 100 Zeichen.
                             Antworte NUR mit der Übersetzung.
                             """
-                            translated_value = llm.generate(translation_prompt).strip()
+                            translated_value = llm_predict(llm, 'atkis_translation_handbook', translation_prompt).strip()
                             feature['properties'][f'{key}_beschreibung'] = translated_value
-            
+
+            # Features nebenläufig über den KI-Dispatcher verarbeiten
+            get_llm_dispatcher().map(sync_feature, layer_data['features'])
+
             # Aktualisierten Layer im Cache speichern
             with layer_cache_lock:
                 layer_cache[layer_id] = layer_data
@@ -1504,41 +1531,17 @@ def sync_atkis_all():
         logger.error(f'Fehler bei der ATKIS-Synchronisierung aller Layer: {str(e)}')
         return jsonify({'error': str(e)}), 500
 
-def load_atkis_handbook():
-    """Lädt das ATKIS-Handbuch aus der PDF"""
-    try:
-        handbook_path = os.path.join(os.path.dirname(__file__), '../../docs/atkis_handbook.pdf')
-        loader = PyPDFLoader(handbook_path)
-        pages = loader.load_and_split()
-        
-        # Text in Chunks aufteilen
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200
-        )
-        return text_splitter.split_documents(pages)
-    except Exception as e:
-        logger.error(f'Fehler beim Laden des ATKIS-Handbuchs: {str(e)}')
-        return []
-
-def search_atkis_handbook(handbook_pages, properties):
-    """Sucht relevante Informationen im ATKIS-Handbuch"""
+def search_atkis_handbook(properties):
+    """Sucht relevante Informationen im Handbuch (BM25 über die Handbuch-Abschnitte)"""
     try:
-        relevant_text = []
         search_terms = [
             properties.get('objektart', ''),
             properties.get('funktion', ''),
             properties.get('zustand', ''),
             properties.get('art', '')
         ]
-        
-        for page in handbook_pages:
-            for term in search_terms:
-                if term and term.lower() in page.page_content.lower():
-                    relevant_text.append(page.page_content)
-                    break
-        
-        return '\n'.join(relevant_text[:3])  # Nur die ersten 3 relevanten Abschnitte
+        query = ' '.join(str(term) for term in search_terms if term)
+        return '\n'.join(retrieve_context(query, k=3))  # Nur die 3 relevantesten Abschnitte
     except Exception as e:
         logger.error(f'Fehler bei der ATKIS-Handbuch-Suche: {str(e)}')
         return ''
@@ -1563,11 +1566,8 @@ def clean_layer_names():
             logger.error("OpenAI API Key nicht gefunden!")
             return jsonify({'error': 'OpenAI API Key nicht konfiguriert'}), 500
         
-        # Verarbeite alle Layer auf einmal
-        layer_names = "\n".join([f"- {layer['name']}: {layer['title']}" for layer in layers])
-        logger.info("Zusammengestellte Layer-Namen: %s", layer_names)
-        
-        user_prompt = f"""Hier ist eine Liste von Layer-Namen, die gesäubert werden müssen. 
+        # Layer nach Token-Budget des Modells auf möglichst wenige Anfragen verteilen
+        user_template = """Hier ist eine Liste von Layer-Namen, die gesäubert werden müssen. 
         Formatiere jeden Namen nach diesen Regeln:
 
         Layer-Liste:
@@ -1591,39 +1591,52 @@ def clean_layer_names():
         original_name|neuer_name
         """
 
-        try:
-            logger.info("Sende Prompt an OpenAI")
-            response = llm.predict(user_prompt).strip()
+        # AdV-Objektarten ohne KI auflösen, nur der Rest geht an das LLM
+        cleaned_names = {}
+        for layer in layers:
+            resolved = resolve_layer_name(layer['name'])
+            if resolved is not None:
+                cleaned_names[layer['name']] = to_identifier(resolved['cleaned_name'])
+        remaining = [layer for layer in layers if layer['name'] not in cleaned_names]
+        logger.info("Lokal bereinigt: %d von %d Layern", len(cleaned_names), len(layers))
+
+        model = getattr(llm, 'model_name', 'gpt-3.5-turbo-instruct')
+        max_tokens = getattr(llm, 'max_tokens', -1)
+        batches = pack_batches(
+            [(layer['name'], f"- {layer['name']}: {layer['title']}") for layer in remaining],
+            model,
+            berechne_tokens(user_template.format(layer_names=''), model),
+            CLEAN_NAMES_OUTPUT_TOKENS,
+            max_output_tokens=max_tokens if max_tokens > 0 else None
+        )
+        logger.info("Layer auf %d Anfrage(n) verteilt", len(batches))
+
+        def clean_batch(batch):
+            user_prompt = user_template.format(layer_names=format_batch(batch))
+            response = llm_predict(llm, 'clean_layer_names', user_prompt).strip()
             logger.info("Antwort von OpenAI: %s", response)
-            
-            # Verarbeite die Antwort
+            # Antwortzeilen über den Original-Namen zuordnen
+            return split_response(response, [name for name, _ in batch])
+
+        try:
+            logger.info("Sende Prompts an OpenAI")
+            for result in get_llm_dispatcher().map(clean_batch, batches):
+                cleaned_names.update(result)
+
             cleaned_layers = []
-            for line in response.split('\n'):
-                logger.info("Verarbeite Zeile: %s", line)
-                if '|' in line:
-                    original_id, new_name = line.strip().split('|')
-                    original_id = original_id.strip()
-                    new_name = new_name.strip()
-                    logger.info("Aufgeteilte Werte - Original: '%s', Neu: '%s'", original_id, new_name)
-                    
-                    # Finde den ursprünglichen Layer
-                    matching_layer = None
-                    for layer in layers:
-                        if layer['name'] == original_id:
-                            matching_layer = layer
-                            break
-                    
-                    if matching_layer:
-                        cleaned_layer = {
-                            'id': matching_layer['name'],
-                            'name': matching_layer['name'],
-                            'title': new_name,
-                            'namespace': matching_layer.get('namespace', '')
-                        }
-                        cleaned_layers.append(cleaned_layer)
-                        logger.info("Layer hinzugefügt: %s", cleaned_layer)
-                    else:
-                        logger.warning("Kein passender Layer gefunden für: %s", original_id)
+            for layer in layers:
+                if layer['name'] not in cleaned_names:
+                    logger.warning("Keine Antwort für Layer: %s", layer['name'])
+                    continue
+
+                cleaned_layer = {
+                    'id': layer['name'],
+                    'name': layer['name'],
+                    'title': cleaned_names[layer['name']],
+                    'namespace': layer.get('namespace', '')
+                }
+                cleaned_layers.append(cleaned_layer)
+                logger.info("Layer hinzugefügt: %s", cleaned_layer)
             
             logger.info("Erfolgreich verarbeitete Layer: %d", len(cleaned_layers))
             return jsonify({
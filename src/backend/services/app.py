@@ -14,6 +14,8 @@ import logging
 import traceback
 import sys
 import tempfile
+import time
+from threading import Lock
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import text
 
@@ -31,6 +33,29 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 # Datenbank initialisieren
 db = SQLAlchemy(app)
 
+# Zuletzt geladene Dienste, damit nachgeladene Metadaten die Capabilities nicht erneut abrufen
+EXPLORER_CACHE_TTL = 600
+EXPLORER_CACHE_SIZE = 32
+_explorers = {}
+_explorers_lock = Lock()
+
+def remember_explorer(wfs_url, explorer):
+    with _explorers_lock:
+        _explorers[wfs_url] = (time.monotonic(), explorer)
+        # Ältesten Eintrag verwerfen, wenn der Cache voll ist
+        if len(_explorers) > EXPLORER_CACHE_SIZE:
+            oldest = min(_explorers, key=lambda url: _explorers[url][0])
+            del _explorers[oldest]
+    return explorer
+
+def get_explorer(wfs_url):
+    """Gibt den WFSExplorer eines Dienstes aus dem Cache zurück und lädt ihn nur bei Bedarf neu"""
+    with _explorers_lock:
+        entry = _explorers.get(wfs_url)
+    if entry and time.monotonic() - entry[0] < EXPLORER_CACHE_TTL:
+        return entry[1]
+    return remember_explorer(wfs_url, WFSExplorer(wfs_url))
+
 def setup_database():
     """Initialisiert die SQLite-Datenbank"""
     try:
@@ -57,18 +82,13 @@ def index():
 def get_layers():
     wfs_url = request.form.get('wfs_url')
     try:
-        explorer = WFSExplorer(wfs_url)
+        explorer = remember_explorer(wfs_url, WFSExplorer(wfs_url))
         
         # Layer-Struktur und Metadaten abrufen
         layers = explorer.layer_structure
         
-        # Für jeden Layer detaillierte Informationen abrufen
-        layer_details = {}
-        for namespace, ns_layers in layers.items():
-            for layer_name in ns_layers:
-                details = explorer.get_layer_details(layer_name)
-                if details:
-                    layer_details[layer_name] = details
+        # Layer-Details sofort zurückgeben, fehlende Metadaten werden im Hintergrund geladen
+        layer_details = explorer.get_all_layer_details()
         
         response_data = {
             'status': 'success',
@@ -89,6 +109,29 @@ def get_layers():
             'message': error_msg
         }), 500
 
+@app.route('/layer_metadata', methods=['POST'])
+def layer_metadata():
+    """Liefert die aufgelösten Metadaten eines Layers nach"""
+    try:
+        wfs_url = request.form.get('wfs_url')
+        layer_name = request.form.get('layer_name')
+
+        explorer = get_explorer(wfs_url)
+        details = explorer.get_layer_details(layer_name)
+        if not details:
+            return jsonify({
+                'status': 'error',
+                'message': 'Layer nicht gefunden'
+            }), 404
+
+        return jsonify({
+            'status': 'success',
+            'metadata': details['metadata']
+        })
+
+    except Exception as e:
+        return handle_error(e, 'layer_metadata')
+
 @app.route('/preview_layer', methods=['POST'])
 def preview_layer():
     try:
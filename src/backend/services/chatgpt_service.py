@@ -1,20 +1,35 @@
 import openai
-import tiktoken
 import json
 import logging
 
+from utils.llm_cache import get_llm_cache, template_hash
+from utils.llm_dispatcher import get_llm_dispatcher
+from utils.batch_packer import (
+    berechne_tokens, context_window, format_batch, kuerze_auf_tokens, output_limit, pack_batches
+)
+
 logger = logging.getLogger(__name__)
 
+# Erwartete Antwortlänge pro Layer in clean_layer_names (JSON-Eintrag mit Titel und Erklärung)
+CLEAN_NAMES_OUTPUT_TOKENS = 80
+
+# Zusätzliche Antwort-Tokens pro Anfrage für die JSON-Hülle um die Einträge
+CLEAN_NAMES_JSON_OVERHEAD = 20
+
 class ChatGPTService:
     def __init__(self, api_key):
         self.api_key = api_key
         openai.api_key = api_key
+        try:
+            self.cache = get_llm_cache()
+        except Exception as e:
+            logger.warning(f"KI-Cache nicht verfügbar: {str(e)}")
+            self.cache = None
+        self.dispatcher = get_llm_dispatcher()
 
     def berechne_tokens(self, text, model="gpt-4"):
         """Berechnet die Anzahl der Tokens in einem Text"""
-        enc = tiktoken.get_encoding("cl100k_base")
-        tokens = enc.encode(text)
-        return len(tokens)
+        return berechne_tokens(text, model)
 
     def frage_chatgpt(self, prompt, model="gpt-3.5-turbo", max_tokens=500, temperature=0.7):
         """Sendet eine Anfrage an ChatGPT"""
@@ -24,46 +39,82 @@ class ChatGPTService:
             for token in forbidden_tokens:
                 prompt = prompt.replace(token, "")
 
-            # Berechne die Token-Menge und begrenze den Text
-            token_limit = 4096 - max_tokens
-            gesamt_text_tokens = self.berechne_tokens(prompt)
+            # Berechne die Token-Menge und begrenze den Text auf Token-Ebene
+            token_limit = context_window(model) - max_tokens
+            gesamt_text_tokens = self.berechne_tokens(prompt, model)
             
             if gesamt_text_tokens > token_limit:
-                prompt = prompt[:token_limit]
+                logger.warning(f"Prompt mit {gesamt_text_tokens} Tokens wird auf {token_limit} Tokens gekürzt")
+                prompt = kuerze_auf_tokens(prompt, token_limit, model)
+
+            def request():
+                response = self.dispatcher.call(
+                    lambda: openai.Completion.create(
+                        model=model,
+                        prompt=prompt,
+                        max_tokens=max_tokens,
+                        temperature=temperature,
+                    ),
+                    min(gesamt_text_tokens, token_limit) + max_tokens
+                )
+                return response["choices"][0]["text"]
 
-            response = openai.Completion.create(
-                model=model,
-                prompt=prompt,
-                max_tokens=max_tokens,
-                temperature=temperature,
+            if self.cache is None:
+                return request()
+            return self.cache.cached(
+                model, temperature, template_hash('frage_chatgpt', str(max_tokens)), prompt, request
             )
-            return response["choices"][0]["text"]
         except Exception as e:
             logger.error(f"Fehler bei der ChatGPT-Anfrage: {str(e)}")
             raise RuntimeError(f"Fehler bei der Anfrage: {e}")
 
-    def clean_layer_names(self, layers, custom_prompt=None):
+    def clean_layer_names(self, layers, custom_prompt=None, model="gpt-3.5-turbo"):
         """Säubert Layer-Namen mit Hilfe von ChatGPT"""
         try:
             # Standard-Prompt oder benutzerdefinierter Prompt
             prompt = custom_prompt or "Bitte säubere und vereinfache diese GIS-Layer-Namen. Entferne technische Präfixe, mache sie benutzerfreundlich und füge eine kurze Erklärung hinzu."
-            
-            # Erstelle den Prompt für ChatGPT
-            layer_list = "\n".join([f"- {layer['title']}" for layer in layers])
-            full_prompt = f"{prompt}\n\nLayer-Namen:\n{layer_list}\n\nBitte gib die gesäuberten Namen im JSON-Format zurück, z.B.:\n{{\n  'layers': [\n    {{'id': 'original_name', 'title': 'Gesäuberter Name', 'explanation': 'Kurze Erklärung'}}\n  ]\n}}"
-            
-            # Sende Anfrage an ChatGPT
-            response = self.frage_chatgpt(full_prompt)
-            
-            # Extrahiere JSON aus der Antwort
-            json_start = response.find('{')
-            json_end = response.rfind('}') + 1
-            if json_start >= 0 and json_end > json_start:
-                json_str = response[json_start:json_end]
-                return json.loads(json_str)
-            else:
-                raise ValueError("Keine gültige JSON-Antwort von ChatGPT erhalten")
+            kopf = f"{prompt}\n\nLayer-Namen:\n"
+            fuss = "\n\nBitte gib die gesäuberten Namen im JSON-Format zurück, z.B.:\n{\n  'layers': [\n    {'id': 'original_name', 'title': 'Gesäuberter Name', 'explanation': 'Kurze Erklärung'}\n  ]\n}"
+
+            # Layer auf so wenige Anfragen wie möglich verteilen, ohne den Prompt zu kürzen;
+            # die JSON-Hülle zählt zum Prompt-Budget und zur maximalen Antwortlänge des Modells
+            batches = pack_batches(
+                [(layer['title'], f"- {layer['title']}") for layer in layers],
+                model,
+                self.berechne_tokens(kopf + fuss, model) + CLEAN_NAMES_JSON_OVERHEAD,
+                CLEAN_NAMES_OUTPUT_TOKENS,
+                max_output_tokens=output_limit(model) - CLEAN_NAMES_JSON_OVERHEAD
+            )
+
+            def clean_batch(batch):
+                full_prompt = kopf + format_batch(batch) + fuss
+                response = self.frage_chatgpt(
+                    full_prompt,
+                    model=model,
+                    max_tokens=CLEAN_NAMES_OUTPUT_TOKENS * len(batch) + CLEAN_NAMES_JSON_OVERHEAD
+                )
+
+                # Extrahiere JSON aus der Antwort
+                json_start = response.find('{')
+                json_end = response.rfind('}') + 1
+                if json_start < 0 or json_end <= json_start:
+                    raise ValueError("Keine gültige JSON-Antwort von ChatGPT erhalten")
+
+                # Ergebnisse über die ID (Original-Namen) den Layern des Batches zuordnen
+                batch_ids = {item_id for item_id, _ in batch}
+                return [
+                    entry for entry in json.loads(response[json_start:json_end]).get('layers', [])
+                    if entry.get('id') in batch_ids
+                ]
+
+            # Batches nebenläufig über den gemeinsamen Dispatcher
+            cleaned = {}
+            for entries in self.dispatcher.map(clean_batch, batches):
+                for entry in entries:
+                    cleaned.setdefault(entry['id'], entry)
+
+            return {'layers': [cleaned[layer['title']] for layer in layers if layer['title'] in cleaned]}
                 
         except Exception as e:
             logger.error(f"Fehler beim Säubern der Layer-Namen: {str(e)}")
-            raise 
\ No newline at end of file
+            raise
@@ -1,13 +1,12 @@
 import logging
 from owslib.wfs import WebFeatureService
-import requests
 import xml.etree.ElementTree as ET
-import urllib3
 from threading import Lock
+from utils import http_client
 from .qgis_service import QgisService
 
-# SSL-Warnungen unterdrücken
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+# owslib-Anfragen über die gemeinsame HTTP-Session leiten
+http_client.patch_owslib()
 
 logger = logging.getLogger(__name__)
 
@@ -33,7 +32,7 @@ class LayerService:
                 'request': 'GetCapabilities'
             }
             logger.info(f"Sende GetCapabilities Anfrage mit Parametern: {params}")
-            response = requests.get(url, params=params, timeout=10, verify=False)
+            response = http_client.get(url, params=params, timeout=10)
             logger.info(f"Server Antwort Status: {response.status_code}")
             
             if response.status_code == 200:
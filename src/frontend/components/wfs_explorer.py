@@ -1,13 +1,12 @@
-import requests
 import xml.etree.ElementTree as ET
 from urllib.parse import urlencode
 import json
 import os
+import sys
 import geopandas as gpd
 from shapely.geometry import shape, Point, Polygon
 from datetime import datetime
 import psycopg2
-import xmltodict
 from owslib.wfs import WebFeatureService
 import logging
 from io import BytesIO
@@ -21,6 +20,17 @@ import tempfile
 import shutil
 from shapely.geometry import mapping
 
+# Projektverzeichnis in den Suchpfad aufnehmen, damit die gemeinsamen Module (utils/) importierbar sind
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from utils import http_client
+from utils.metadata_resolver import get_resolver
+
+# owslib-Anfragen über die gemeinsame HTTP-Session leiten
+http_client.patch_owslib()
+
 # Logger konfigurieren
 logger = logging.getLogger(__name__)
 
@@ -532,30 +542,49 @@ class WFSExplorer:
                 'features': []
             }
 
-    def get_layer_details(self, layer_name):
-        """Ruft detaillierte Informationen für einen spezifischen Layer ab"""
+    def _get_metadata_urls(self, layer):
+        """Gibt die Metadaten-URLs eines Layers zurück"""
+        if not hasattr(layer, 'metadataUrls'):
+            return []
+        return [
+            url_info['url']
+            for url_info in layer.metadataUrls
+            if isinstance(url_info, dict) and url_info.get('url')
+        ]
+
+    def _merge_metadata(self, urls, records):
+        """Übernimmt wie bisher den letzten erfolgreich gelesenen Datensatz"""
+        metadata = {}
+        for url in urls:
+            if records.get(url):
+                metadata = records[url]
+        return metadata
+
+    def get_layer_details(self, layer_name, resolve_metadata=True):
+        """
+        Ruft detaillierte Informationen für einen spezifischen Layer ab.
+        Mit resolve_metadata=False werden nur bereits zwischengespeicherte
+        Metadaten übernommen, fehlende werden im Hintergrund geladen.
+        """
         try:
             if layer_name in self.wfs.contents:
                 layer = self.wfs.contents[layer_name]
-                
-                # Versuche zusätzliche Metadaten abzurufen
-                metadata = {}
-                if hasattr(layer, 'metadataUrls'):
-                    for url_info in layer.metadataUrls:
-                        try:
-                            if isinstance(url_info, dict) and 'url' in url_info:
-                                response = requests.get(url_info['url'], timeout=5)
-                                if response.status_code == 200:
-                                    metadata = xmltodict.parse(response.text)
-                        except Exception as e:
-                            logger.warning(f"Fehler beim Abrufen der Metadaten: {str(e)}")
-                
+                resolver = get_resolver()
+
+                metadata_urls = self._get_metadata_urls(layer)
+                if resolve_metadata:
+                    records = resolver.resolve_many(metadata_urls)
+                else:
+                    records = {url: resolver.get_cached(url) for url in metadata_urls}
+                    resolver.prefetch(metadata_urls)
+
                 return {
                     'title': layer.title or layer_name,
                     'abstract': layer.abstract or self._get_default_description(layer_name),
                     'keywords': layer.keywords if hasattr(layer, 'keywords') else [],
                     'bbox': layer.boundingBoxWGS84 if hasattr(layer, 'boundingBoxWGS84') else None,
-                    'metadata': metadata,
+                    'metadata': self._merge_metadata(metadata_urls, records),
+                    'metadata_pending': not all(resolver.is_resolved(url) for url in metadata_urls),
                     'provider': self._get_provider_info()
                 }
             return None
@@ -563,6 +592,29 @@ class WFSExplorer:
             logger.error(f"Fehler beim Abrufen der Layer-Details: {str(e)}")
             return None
 
+    def get_all_layer_details(self, resolve_metadata=False):
+        """
+        Gibt die Details aller Layer zurück. Die Metadaten aller Layer werden
+        gemeinsam angestoßen, sodass die Anfragen parallel laufen.
+        """
+        resolver = get_resolver()
+        all_urls = [
+            url
+            for layer_name in self.wfs.contents
+            for url in self._get_metadata_urls(self.wfs.contents[layer_name])
+        ]
+        if resolve_metadata:
+            resolver.resolve_many(all_urls)
+        else:
+            resolver.prefetch(all_urls)
+
+        layer_details = {}
+        for layer_name in self.wfs.contents:
+            details = self.get_layer_details(layer_name, resolve_metadata=False)
+            if details:
+                layer_details[layer_name] = details
+        return layer_details
+
     def get_layer_descriptions(self):
         """Gibt detaillierte Beschreibungen für jeden Layer zurück"""
         descriptions = {
@@ -0,0 +1,317 @@
+import hashlib
+import logging
+import math
+import xml.etree.ElementTree as ET
+
+from utils import http_client
+from utils.lexicon_db import get_lexicon_db
+from utils.lexicon_search import refresh_attribute_index
+
+logger = logging.getLogger(__name__)
+
+# Bis zu dieser Anzahl verschiedener Werte wird exakt gezählt
+EXACT_LIMIT = 1000
+
+# Anzahl der häufigsten Werte, die pro Attribut gespeichert werden
+TOP_K = 50
+
+# Elemente, deren Kinder einzelne Features sind (WFS 2.0 bzw. WFS 1.x)
+MEMBER_TAGS = ('member', 'featureMember', 'featureMembers')
+
+
+def _local(tag):
+    return tag.rsplit('}', 1)[-1] if '}' in tag else tag
+
+
+class HyperLogLog:
+    """Schätzt die Anzahl verschiedener Werte mit 2^p Registern (Standardfehler ca. 1.04 / sqrt(2^p))"""
+
+    def __init__(self, p=12):
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(self.m)
+        self.alpha = 0.7213 / (1 + 1.079 / self.m)
+
+    def add(self, value):
+        x = int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+        index = x >> (64 - self.p)
+        rest = x & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        estimate = self.alpha * self.m * self.m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        # Korrektur für kleine Mengen (Linear Counting)
+        if estimate <= 2.5 * self.m and zeros:
+            estimate = self.m * math.log(self.m / zeros)
+        return int(round(estimate))
+
+
+class SpaceSaving:
+    """Top-k-Sketch (Space-Saving): Häufigkeiten sind Obergrenzen, höchstens um 'error' zu hoch"""
+
+    def __init__(self, k, initial=None):
+        self.k = k
+        self.counts = {}
+        self.errors = {}
+        for value, count in sorted((initial or {}).items(), key=lambda item: item[1], reverse=True)[:k]:
+            self.counts[value] = count
+            self.errors[value] = 0
+
+    def add(self, value):
+        if value in self.counts:
+            self.counts[value] += 1
+        elif len(self.counts) < self.k:
+            self.counts[value] = 1
+            self.errors[value] = 0
+        else:
+            # Seltensten Eintrag ersetzen; der neue Wert erbt dessen Zähler als Fehler
+            victim = min(self.counts, key=self.counts.get)
+            floor = self.counts.pop(victim)
+            self.errors.pop(victim)
+            self.counts[value] = floor + 1
+            self.errors[value] = floor
+
+    def top(self):
+        return sorted(self.counts.items(), key=lambda item: item[1], reverse=True)
+
+
+class AttributeProfile:
+    """
+    Zählt die Werte eines Attributs exakt, solange es wenige verschiedene sind,
+    und wechselt danach auf HyperLogLog (Anzahl) und Space-Saving (häufigste Werte)
+    """
+
+    def __init__(self, exact_limit=EXACT_LIMIT, top_k=TOP_K):
+        self.exact_limit = exact_limit
+        self.top_k = top_k
+        self.value_count = 0
+        self.null_count = 0
+        self.exact = {}
+        self.hll = HyperLogLog()
+        self.sketch = None
+
+    def add(self, value):
+        self.value_count += 1
+        if value is None or value == '':
+            self.null_count += 1
+            return
+
+        self.hll.add(value)
+        if self.sketch is not None:
+            self.sketch.add(value)
+            return
+
+        self.exact[value] = self.exact.get(value, 0) + 1
+        if len(self.exact) > self.exact_limit:
+            self.sketch = SpaceSaving(self.top_k, self.exact)
+            self.exact = None
+
+    @property
+    def is_exact(self):
+        return self.sketch is None
+
+    def result(self):
+        if self.is_exact:
+            top = sorted(self.exact.items(), key=lambda item: item[1], reverse=True)[:self.top_k]
+            distinct = len(self.exact)
+        else:
+            top = self.sketch.top()
+            distinct = self.hll.count()
+        return {
+            'value_count': self.value_count,
+            'null_count': self.null_count,
+            'distinct_count': distinct,
+            'distinct_exact': self.is_exact,
+            'top_values': top
+        }
+
+
+def iter_feature_properties(source):
+    """
+    Liest eine GML-Antwort von GetFeature inkrementell und gibt pro Feature
+    ein Dictionary {attribut: text} aus; Geometrien und verschachtelte Elemente werden übersprungen
+    """
+    stack = []
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            stack.append(elem)
+            continue
+
+        stack.pop()
+        parent = stack[-1] if stack else None
+        if parent is None:
+            continue
+        if _local(parent.tag) not in MEMBER_TAGS:
+            # Geleerte member-Elemente aus der FeatureCollection entfernen
+            if _local(elem.tag) in MEMBER_TAGS and len(stack) == 1:
+                parent.remove(elem)
+            continue
+
+        properties = {}
+        for child in elem:
+            if len(child):
+                continue
+            text = child.text.strip() if child.text else None
+            properties[_local(child.tag)] = text
+        yield properties
+
+        elem.clear()
+        parent.remove(elem)
+
+
+class AttributeProfiler:
+    """Lädt die Features eines Lexikon-Layers einmal im Stream und speichert die Wertestatistik"""
+
+    def __init__(self, db_path, exact_limit=EXACT_LIMIT, top_k=TOP_K, timeout=300):
+        self.lexicon_db = get_lexicon_db(db_path)
+        self.exact_limit = exact_limit
+        self.top_k = top_k
+        self.timeout = timeout
+
+    def _open_features(self, url, typename, version, max_features=None):
+        type_param = 'typeNames' if version.startswith('2') else 'typeName'
+        params = {
+            'service': 'WFS',
+            'version': version,
+            'request': 'GetFeature',
+            type_param: typename
+        }
+        if max_features:
+            params['count' if version.startswith('2') else 'maxFeatures'] = max_features
+
+        response = http_client.get(url, params=params, timeout=self.timeout, stream=True)
+        if response.status_code != 200:
+            response.close()
+            raise Exception(f'GetFeature fehlgeschlagen (Status: {response.status_code})')
+        response.raw.decode_content = True
+        return response
+
+    def profile(self, features):
+        """Erstellt die Profile aller Attribute aus einem Iterator von Feature-Dictionaries"""
+        profiles = {}
+        feature_count = 0
+        for properties in features:
+            feature_count += 1
+            for name, value in properties.items():
+                profile = profiles.get(name)
+                if profile is None:
+                    profile = profiles[name] = AttributeProfile(self.exact_limit, self.top_k)
+                profile.add(value)
+
+        # Features ohne Element für ein Attribut als leer zählen
+        for profile in profiles.values():
+            missing = feature_count - profile.value_count
+            profile.value_count += missing
+            profile.null_count += missing
+
+        return feature_count, {name: profile.result() for name, profile in profiles.items()}
+
+    def profile_layer(self, layer_id, version='2.0.0', max_features=None):
+        """Profiliert einen Layer aus wfs_layers und schreibt attribute_values in einer Transaktion"""
+        with self.lexicon_db.connection() as conn:
+            row = conn.execute(
+                'SELECT name, source_url, source_type FROM wfs_layers WHERE id = ?', (layer_id,)
+            ).fetchone()
+        if row is None:
+            raise ValueError(f'Layer {layer_id} nicht gefunden')
+        name, source_url, source_type = row
+        if source_type != 'WFS':
+            raise ValueError('Wertestatistiken sind nur für WFS-Layer verfügbar')
+
+        response = self._open_features(source_url, name, version, max_features)
+        try:
+            feature_count, results = self.profile(iter_feature_properties(response.raw))
+        finally:
+            response.close()
+
+        self.store(layer_id, results)
+        logger.info(f'Wertestatistik für {name}: {feature_count} Features, {len(results)} Attribute')
+        return {'layer_id': layer_id, 'feature_count': feature_count, 'attributes': len(results)}
+
+    def store(self, layer_id, results):
+        with self.lexicon_db.transaction() as conn:
+            conn.executemany('''
+                INSERT INTO layer_attributes (layer_id, name)
+                VALUES (?, ?)
+                ON CONFLICT(layer_id, name) DO NOTHING
+            ''', [(layer_id, name) for name in results])
+            # Neu gefundene Attribute in den Volltextindex übernehmen
+            refresh_attribute_index(conn, conn.execute(
+                'SELECT name, source_url FROM wfs_layers WHERE id = ?', (layer_id,)
+            ).fetchall())
+
+            attribute_ids = dict(conn.execute(
+                'SELECT name, id FROM layer_attributes WHERE layer_id = ?', (layer_id,)
+            ).fetchall())
+
+            conn.executemany('''
+                UPDATE layer_attributes SET
+                    value_count = ?,
+                    null_count = ?,
+                    distinct_count = ?,
+                    distinct_exact = ?,
+                    profiled_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', [
+                (
+                    result['value_count'], result['null_count'], result['distinct_count'],
+                    int(result['distinct_exact']), attribute_ids[name]
+                )
+                for name, result in results.items()
+            ])
+
+            ids = [(attribute_ids[name],) for name in results]
+            conn.executemany('DELETE FROM attribute_values WHERE attribute_id = ?', ids)
+            conn.executemany('''
+                INSERT INTO attribute_values (attribute_id, value, frequency)
+                VALUES (?, ?, ?)
+            ''', [
+                (attribute_ids[name], value, frequency)
+                for name, result in results.items()
+                for value, frequency in result['top_values']
+            ])
+
+
+def load_attribute_statistics(conn, layer_id, top=10):
+    """Liefert die gespeicherte Wertestatistik eines Layers für UI und KI-Prompts"""
+    attributes = conn.execute('''
+        SELECT id, name, type, value_count, null_count, distinct_count, distinct_exact
+        FROM layer_attributes
+        WHERE layer_id = ? AND profiled_at IS NOT NULL
+        ORDER BY name
+    ''', (layer_id,)).fetchall()
+
+    statistics = []
+    for attribute_id, name, attr_type, value_count, null_count, distinct_count, distinct_exact in attributes:
+        top_values = conn.execute('''
+            SELECT value, frequency FROM attribute_values
+            WHERE attribute_id = ?
+            ORDER BY frequency DESC
+            LIMIT ?
+        ''', (attribute_id, top)).fetchall()
+        statistics.append({
+            'name': name,
+            'type': attr_type,
+            'value_count': value_count,
+            'null_count': null_count,
+            'distinct_count': distinct_count,
+            'distinct_exact': bool(distinct_exact),
+            'top_values': [{'value': value, 'frequency': frequency} for value, frequency in top_values]
+        })
+    return statistics
+
+
+def format_attribute_statistics(statistics, top=5):
+    """Fasst die Wertestatistik kurz als Text zusammen, z.B. für KI-Prompts"""
+    lines = []
+    for attribute in statistics:
+        prefix = '' if attribute['distinct_exact'] else 'ca. '
+        values = ', '.join(str(item['value']) for item in attribute['top_values'][:top])
+        line = f"{attribute['name']}: {prefix}{attribute['distinct_count']} verschiedene Werte"
+        if values:
+            line += f' (häufig: {values})'
+        lines.append(line)
+    return '\n'.join(lines)
@@ -0,0 +1,132 @@
+import logging
+from functools import lru_cache
+
+import tiktoken
+
+logger = logging.getLogger(__name__)
+
+# Kontextfenster (Eingabe und Ausgabe zusammen) bekannter Modelle in Tokens
+CONTEXT_WINDOWS = {
+    'gpt-3.5-turbo-instruct': 4096,
+    'gpt-3.5-turbo': 16385,
+    'gpt-4-turbo': 128000,
+    'gpt-4o': 128000,
+    'gpt-4': 8192,
+    'text-davinci-003': 4097,
+}
+
+# Obergrenze für die Antwortlänge, sofern das Modell sie unabhängig vom Kontext begrenzt
+OUTPUT_LIMITS = {
+    'gpt-3.5-turbo-instruct': 4096,
+    'gpt-3.5-turbo': 4096,
+    'gpt-4-turbo': 4096,
+    'gpt-4o': 16384,
+}
+
+DEFAULT_CONTEXT_WINDOW = 4096
+
+# Reserve für Nachrichten-Overhead und Abweichungen der Zählung
+SAFETY_MARGIN = 0.05
+
+
+def _lookup(table, model, default=None):
+    # Längster passender Präfix, damit z.B. 'gpt-4o-mini' nicht als 'gpt-4' gilt
+    for prefix in sorted(table, key=len, reverse=True):
+        if model.startswith(prefix):
+            return table[prefix]
+    return default
+
+
+def context_window(model):
+    return _lookup(CONTEXT_WINDOWS, model, DEFAULT_CONTEXT_WINDOW)
+
+
+def output_limit(model):
+    """Maximale Antwortlänge des Modells; ohne eigene Grenze das gesamte Kontextfenster"""
+    return _lookup(OUTPUT_LIMITS, model, context_window(model))
+
+
+@lru_cache(maxsize=None)
+def _encoding(model):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding('cl100k_base')
+
+
+def berechne_tokens(text, model='gpt-3.5-turbo'):
+    """Berechnet die Anzahl der Tokens in einem Text"""
+    return len(_encoding(model).encode(text or '', disallowed_special=()))
+
+
+def kuerze_auf_tokens(text, limit, model='gpt-3.5-turbo'):
+    """Kürzt einen Text auf höchstens 'limit' Tokens (statt auf Zeichen)"""
+    encoding = _encoding(model)
+    tokens = encoding.encode(text or '', disallowed_special=())
+    if len(tokens) <= limit:
+        return text
+    return encoding.decode(tokens[:max(limit, 0)])
+
+
+def pack_batches(items, model, prompt_tokens, output_tokens_per_item, max_output_tokens=None):
+    """
+    Verteilt Einträge so auf Anfragen, dass jede Anfrage das Kontextfenster und das
+    Ausgabebudget des Modells möglichst weit ausschöpft, ohne es zu überschreiten.
+
+    items: Liste von (item_id, zeile); prompt_tokens: Tokens des festen Prompt-Anteils;
+    output_tokens_per_item: erwartete Antwortlänge pro Eintrag.
+    Gibt eine Liste von Batches zurück, jeder Batch ist eine Liste von (item_id, zeile).
+    Ein Eintrag, der allein das Budget überschreitet, wird einzeln gesendet.
+    """
+    budget = int(context_window(model) * (1 - SAFETY_MARGIN)) - prompt_tokens
+    output_budget = output_limit(model)
+    if max_output_tokens:
+        output_budget = min(output_budget, max_output_tokens)
+
+    batches = []
+    current = []
+    input_used = 0
+    output_used = 0
+    for item_id, line in items:
+        # Zeile plus Zeilenumbruch
+        cost = berechne_tokens(line, model) + 1
+        if current and (
+            input_used + cost + output_used + output_tokens_per_item > budget
+            or output_used + output_tokens_per_item > output_budget
+        ):
+            batches.append(current)
+            current, input_used, output_used = [], 0, 0
+
+        if not current and cost + output_tokens_per_item > budget:
+            logger.warning(f'Eintrag {item_id} überschreitet allein das Token-Budget von {model}')
+
+        current.append((item_id, line))
+        input_used += cost
+        output_used += output_tokens_per_item
+
+    if current:
+        batches.append(current)
+    return batches
+
+
+def format_batch(batch):
+    """Setzt die Zeilen eines Batches zum Listenteil des Prompts zusammen"""
+    return '\n'.join(line for _, line in batch)
+
+
+def split_response(response, item_ids, separator='|'):
+    """
+    Ordnet eine zeilenweise Antwort der Form 'item_id|ergebnis' den Einträgen zu.
+    Unbekannte IDs und doppelte Zeilen werden ignoriert; gibt {item_id: ergebnis} zurück.
+    """
+    wanted = {str(item_id): item_id for item_id in item_ids}
+    results = {}
+    for line in (response or '').splitlines():
+        line = line.strip().lstrip('-*').strip()
+        if separator not in line:
+            continue
+        key, value = line.split(separator, 1)
+        key = key.strip().strip('[]').rstrip('.').strip()
+        if key in wanted and wanted[key] not in results:
+            results[wanted[key]] = value.strip()
+    return results
@@ -0,0 +1,263 @@
+import logging
+import xml.etree.ElementTree as ET
+from utils import http_client
+
+logger = logging.getLogger(__name__)
+
+# Root-Elemente der Capabilities-Dokumente je Diensttyp
+ROOT_TAGS = {
+    'WFS_Capabilities': 'WFS',
+    'WMS_Capabilities': 'WMS',
+    'WMT_MS_Capabilities': 'WMS',
+    'Capabilities': 'WMTS'
+}
+
+# Root-Elemente von Fehlerantworten
+EXCEPTION_TAGS = ('ExceptionReport', 'ServiceExceptionReport')
+
+# Elemente, die einen Layer-Eintrag bilden
+LAYER_TAGS = ('FeatureType', 'Layer')
+
+# Elemente mit Dienst-Informationen (Titel, Anbieter, Schlüsselwörter)
+SERVICE_TAGS = ('ServiceIdentification', 'ServiceProvider', 'Service')
+
+# Elemente mit den unterstützten Operationen (WFS 1.1/2.0 bzw. WFS 1.0)
+OPERATION_TAGS = ('OperationsMetadata', 'Capability')
+
+
+def _local(tag):
+    """Entfernt den Namespace aus einem Element-Tag ({ns}Name -> Name)"""
+    return tag.rsplit('}', 1)[-1] if '}' in tag else tag
+
+
+def _child_text(elem, *names):
+    """Liefert den Text des ersten direkten Kindelements mit passendem lokalen Namen"""
+    for child in elem:
+        if _local(child.tag) in names and child.text:
+            return child.text.strip()
+    return None
+
+
+def _keywords(elem):
+    """Sammelt alle Keyword-Texte unterhalb eines Elements"""
+    keywords = []
+    for child in elem:
+        if _local(child.tag) in ('Keywords', 'KeywordList'):
+            for keyword in child:
+                if _local(keyword.tag) == 'Keyword' and keyword.text:
+                    keywords.append(keyword.text.strip())
+    return keywords
+
+
+def _floats(values):
+    try:
+        return [float(value) for value in values]
+    except (TypeError, ValueError):
+        return None
+
+
+def _bbox(elem):
+    """
+    Liest die geographische Ausdehnung (WGS84, Länge/Breite) eines Layer-Elements
+    als (min_x, min_y, max_x, max_y); None, falls keine angegeben ist
+    """
+    for child in elem:
+        tag = _local(child.tag)
+        coords = None
+        # WFS 1.1/2.0, WMTS: <ows:WGS84BoundingBox><ows:LowerCorner>x y</ows:LowerCorner>...
+        if tag == 'WGS84BoundingBox':
+            lower = _child_text(child, 'LowerCorner')
+            upper = _child_text(child, 'UpperCorner')
+            if lower and upper:
+                coords = _floats(lower.split() + upper.split())
+        # WMS 1.3: <EX_GeographicBoundingBox><westBoundLongitude>...
+        elif tag == 'EX_GeographicBoundingBox':
+            coords = _floats([
+                _child_text(child, 'westBoundLongitude'),
+                _child_text(child, 'southBoundLatitude'),
+                _child_text(child, 'eastBoundLongitude'),
+                _child_text(child, 'northBoundLatitude')
+            ])
+        # WFS 1.0, WMS 1.1: <LatLongBoundingBox minx="..." .../>
+        elif tag in ('LatLongBoundingBox', 'LatLonBoundingBox'):
+            coords = _floats([child.get('minx'), child.get('miny'), child.get('maxx'), child.get('maxy')])
+
+        if coords and len(coords) == 4:
+            return tuple(coords)
+    return None
+
+
+class CapabilitiesReader:
+    """
+    Liest ein GetCapabilities-Dokument inkrementell mit iterparse.
+    Layer werden ausgegeben, sobald ihr Element vollständig gelesen ist,
+    und danach sofort aus dem Baum entfernt.
+    """
+
+    def __init__(self, source, response=None):
+        self.response = response
+        self.version = None
+        self.service_type = None
+        self.root_tag = None
+        self.service_info = {'title': None, 'abstract': None, 'provider': None, 'keywords': []}
+        self.output_formats = []
+        self._events = ET.iterparse(source, events=('start', 'end'))
+        self._root = None
+
+    def read_header(self):
+        """Liest bis zum Root-Element und bestimmt Diensttyp und Version"""
+        if self._root is not None:
+            return self.service_type
+
+        for event, elem in self._events:
+            if event == 'start':
+                self._root = elem
+                self.root_tag = _local(elem.tag)
+                self.version = elem.get('version')
+                self.service_type = ROOT_TAGS.get(self.root_tag)
+                break
+
+        if self._root is None:
+            raise ValueError('Leeres Capabilities-Dokument')
+        if self.root_tag in EXCEPTION_TAGS:
+            raise ValueError(f'Server meldet einen Fehler ({self.root_tag})')
+        return self.service_type
+
+    def iter_layers(self):
+        """Gibt die Layer des Dokuments als Dictionaries aus, während es gelesen wird"""
+        self.read_header()
+        stack = [self._root]
+
+        try:
+            for event, elem in self._events:
+                if event == 'start':
+                    stack.append(elem)
+                    continue
+
+                stack.pop()
+                parent = stack[-1] if stack else None
+                tag = _local(elem.tag)
+
+                if tag in LAYER_TAGS:
+                    record = self._layer_record(elem, stack)
+                    if record is not None:
+                        yield record
+                    # Verschachtelte WMS-Layer wurden bereits beim eigenen Ende entfernt,
+                    # daher kann jeder Layer nach der Ausgabe komplett freigegeben werden
+                    elem.clear()
+                    if parent is not None:
+                        parent.remove(elem)
+                elif parent is self._root:
+                    if tag in SERVICE_TAGS:
+                        self._read_service_info(elem)
+                    elif tag in OPERATION_TAGS:
+                        self._read_output_formats(elem)
+                    # Direkte Kinder des Roots (OperationsMetadata, Filter_Capabilities, ...)
+                    # nach dem Lesen freigeben
+                    parent.remove(elem)
+        finally:
+            self.close()
+
+    def _layer_record(self, elem, ancestors=()):
+        """Extrahiert Name, Titel, Beschreibung und Ausdehnung aus einem Layer-Element"""
+        name = _child_text(elem, 'Name', 'Identifier')
+        if not name:
+            return None
+
+        # WMS-Layer ohne eigene Ausdehnung erben sie vom übergeordneten Layer
+        bbox = _bbox(elem)
+        for ancestor in reversed(ancestors):
+            if bbox is not None:
+                break
+            if _local(ancestor.tag) in LAYER_TAGS:
+                bbox = _bbox(ancestor)
+
+        title = _child_text(elem, 'Title') or name
+        namespace = name.split(':')[0] if ':' in name else 'default'
+        layer_name = name.split(':')[1] if ':' in name else name
+
+        return {
+            'name': name,
+            'title': title,
+            'description': _child_text(elem, 'Abstract') or '',
+            'keywords': _keywords(elem),
+            'namespace': namespace,
+            'layer_name': layer_name,
+            'bbox': bbox,
+            'service_type': self.service_type
+        }
+
+    def _read_service_info(self, elem):
+        """Übernimmt Titel, Anbieter und Schlüsselwörter des Dienstes"""
+        tag = _local(elem.tag)
+        if tag == 'ServiceProvider':
+            self.service_info['provider'] = _child_text(elem, 'ProviderName')
+            return
+
+        self.service_info['title'] = _child_text(elem, 'Title') or self.service_info['title']
+        self.service_info['abstract'] = _child_text(elem, 'Abstract') or self.service_info['abstract']
+        self.service_info['keywords'].extend(_keywords(elem))
+
+        # WMS: Anbieter steht in ContactInformation
+        for child in elem.iter():
+            if _local(child.tag) == 'ContactOrganization' and child.text:
+                self.service_info['provider'] = child.text.strip()
+                break
+
+    def _read_output_formats(self, elem):
+        """Übernimmt die Ausgabeformate der GetFeature-Operation"""
+        for operation in elem.iter():
+            tag = _local(operation.tag)
+            # WFS 1.1/2.0: <ows:Operation name="GetFeature"><ows:Parameter name="outputFormat">
+            if tag == 'Operation' and operation.get('name') == 'GetFeature':
+                for parameter in operation.iter():
+                    if _local(parameter.tag) == 'Parameter' and parameter.get('name') == 'outputFormat':
+                        self.output_formats.extend(
+                            value.text.strip() for value in parameter.iter()
+                            if _local(value.tag) == 'Value' and value.text
+                        )
+            # WFS 1.0: <GetFeature><ResultFormat><GML2/>...</ResultFormat>
+            elif tag == 'ResultFormat':
+                self.output_formats.extend(_local(fmt.tag) for fmt in operation)
+
+    def layers_by_namespace(self):
+        """Liest alle Layer und gruppiert sie wie in /get_layers nach Namespace"""
+        layers = {}
+        for record in self.iter_layers():
+            ns_layers = layers.setdefault(record['namespace'], {})
+            ns_layers[record['layer_name']] = {
+                'name': record['name'],
+                'title': record['title'],
+                'description': record['description'],
+                'bbox': record['bbox'],
+                'attributes': []
+            }
+        return layers
+
+    def close(self):
+        """Schließt die zugrunde liegende HTTP-Antwort"""
+        if self.response is not None:
+            self.response.close()
+            self.response = None
+
+
+def open_capabilities(url, service_type, version=None, timeout=30):
+    """
+    Startet eine GetCapabilities-Anfrage und liefert einen CapabilitiesReader,
+    der die Antwort direkt aus dem Netzwerk-Stream liest
+    """
+    params = {
+        'service': service_type,
+        'request': 'GetCapabilities'
+    }
+    if version:
+        params['version'] = version
+
+    response = http_client.get(url, params=params, timeout=timeout, stream=True)
+    if response.status_code != 200:
+        response.close()
+        raise Exception(f'{service_type}-Server antwortet nicht (Status: {response.status_code})')
+
+    # gzip/deflate transparent entpacken
+    response.raw.decode_content = True
+    return CapabilitiesReader(response.raw, response=response)
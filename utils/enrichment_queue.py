@@ -0,0 +1,218 @@
+import logging
+import sqlite3
+from threading import Event, Thread
+
+from utils.attribute_profiler import format_attribute_statistics, load_attribute_statistics
+from utils.lexicon_db import get_lexicon_db
+
+logger = logging.getLogger(__name__)
+
+# Legt für importierte Layer ohne KI-Daten eine Aufgabe an; fehlgeschlagene werden erneut eingereiht
+ENQUEUE_SQL = '''
+    INSERT INTO enrichment_tasks (layer_id, status, attempts, created_at, updated_at)
+    SELECT id, 'pending', 0, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP
+    FROM wfs_layers
+    WHERE name = ? AND source_url = ?
+      AND (cleaned_name IS NULL OR ai_description IS NULL)
+    ON CONFLICT(layer_id) DO UPDATE SET
+        status = 'pending',
+        attempts = 0,
+        error = NULL,
+        updated_at = CURRENT_TIMESTAMP
+    WHERE enrichment_tasks.status = 'error'
+'''
+
+
+# Reiht geänderte Layer unabhängig von vorhandenen KI-Daten erneut ein
+REENQUEUE_SQL = '''
+    INSERT INTO enrichment_tasks (layer_id, status, attempts, created_at, updated_at)
+    SELECT id, 'pending', 0, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP
+    FROM wfs_layers
+    WHERE name = ? AND source_url = ?
+    ON CONFLICT(layer_id) DO UPDATE SET
+        status = 'pending',
+        attempts = 0,
+        error = NULL,
+        updated_at = CURRENT_TIMESTAMP
+    WHERE enrichment_tasks.status != 'pending'
+'''
+
+
+def enqueue_layers(conn, layer_keys, force=False):
+    """
+    Reiht Layer (name, source_url) zur KI-Anreicherung ein; mit force auch Layer,
+    die bereits angereichert sind (z.B. nach einer Änderung im Dienst).
+    Läuft in der Transaktion des Aufrufers, damit Import und Warteschlange zusammen gespeichert werden.
+    """
+    conn.executemany(REENQUEUE_SQL if force else ENQUEUE_SQL, layer_keys)
+
+
+class EnrichmentQueue:
+    """
+    Arbeitet die Tabelle enrichment_tasks im Hintergrund ab.
+    Jeder Worker holt sich einen Block offener Aufgaben, bereinigt Namen und erzeugt
+    Erklärungen außerhalb jeder Transaktion mit einer strukturierten KI-Anfrage pro Block
+    und schreibt cleaned_name und ai_description anschließend in einer kurzen Transaktion.
+    Schlägt ein KI-Aufruf fehl, wird die Aufgabe bis 'max_attempts' erneut eingereiht.
+    """
+
+    def __init__(self, db_path, ai_helper, workers=2, batch_size=10, poll_interval=5, max_attempts=3):
+        self.lexicon_db = get_lexicon_db(db_path)
+        self.ai_helper = ai_helper
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self._wakeup = Event()
+        self._stop = Event()
+        self._threads = []
+
+    def notify(self):
+        """Weckt wartende Worker nach dem Einreihen neuer Aufgaben"""
+        self._wakeup.set()
+
+    def _claim_batch(self):
+        """Markiert einen Block offener Aufgaben als laufend und gibt die Layer zurück"""
+        with self.lexicon_db.transaction() as conn:
+            rows = conn.execute('''
+                SELECT t.id, t.layer_id, l.name, l.title, l.description
+                FROM enrichment_tasks t
+                JOIN wfs_layers l ON l.id = t.layer_id
+                WHERE t.status = 'pending'
+                ORDER BY t.id
+                LIMIT ?
+            ''', (self.batch_size,)).fetchall()
+
+            conn.executemany('''
+                UPDATE enrichment_tasks
+                SET status = 'running', attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', [(row[0],) for row in rows])
+
+        return [
+            {'task_id': row[0], 'layer_id': row[1], 'name': row[2], 'title': row[3] or '', 'description': row[4] or ''}
+            for row in rows
+        ]
+
+    def _enrich(self, tasks):
+        """
+        Bereinigt Namen und erzeugt Erklärungen für alle Aufgaben eines Blocks in einer Anfrage.
+        Gibt (erfolgreiche, fehlgeschlagene) Aufgaben zurück; bei Fehlern der KI werden keine
+        Ersatzwerte als Ergebnis gespeichert.
+        """
+        # Vorhandene Wertestatistik gibt der KI Hinweise auf den Inhalt des Layers (nur im Prompt)
+        layers = []
+        with self.lexicon_db.connection() as conn:
+            for task in tasks:
+                statistics = format_attribute_statistics(load_attribute_statistics(conn, task['layer_id']))
+                description = task['description']
+                if statistics:
+                    description = f"{description}\n\nAttribute:\n{statistics}".strip()
+                layers.append({
+                    'id': task['task_id'],
+                    'name': task['name'],
+                    'title': task['title'],
+                    'description': description
+                })
+
+        try:
+            results = {result['id']: result for result in self.ai_helper.clean_layers_batch(layers)}
+        except Exception as e:
+            logger.error(f"KI-Anreicherung für {len(tasks)} Layer fehlgeschlagen: {str(e)}")
+            for task in tasks:
+                task['error'] = str(e)
+            return [], tasks
+
+        done, failed = [], []
+        for task in tasks:
+            result = results.get(task['task_id'])
+            if result is None:
+                logger.error(f"KI-Anreicherung für {task['name']} fehlgeschlagen: keine verwertbare Antwort")
+                task['error'] = 'Keine verwertbare KI-Antwort'
+                failed.append(task)
+                continue
+            task['cleaned_name'] = result['cleaned_name']
+            task['ai_description'] = result['explanation']
+            done.append(task)
+        return done, failed
+
+    def process_batch(self):
+        """Verarbeitet einen Block; gibt die Anzahl der bearbeiteten Aufgaben zurück"""
+        tasks = self._claim_batch()
+        if not tasks:
+            return 0
+
+        done, failed = self._enrich(tasks)
+
+        with self.lexicon_db.transaction() as conn:
+            conn.executemany('''
+                UPDATE wfs_layers
+                SET cleaned_name = ?, ai_description = ?, last_updated = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', [(task['cleaned_name'], task['ai_description'], task['layer_id']) for task in done])
+            conn.executemany('''
+                UPDATE enrichment_tasks
+                SET status = 'done', error = NULL, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', [(task['task_id'],) for task in done])
+            conn.executemany('''
+                UPDATE enrichment_tasks
+                SET status = CASE WHEN attempts >= ? THEN 'error' ELSE 'pending' END,
+                    error = ?,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', [(self.max_attempts, task['error'], task['task_id']) for task in failed])
+
+        logger.info(f"KI-Anreicherung: {len(done)} Layer aktualisiert, {len(failed)} fehlgeschlagen")
+        return len(tasks)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self.process_batch():
+                    continue
+            except sqlite3.Error as e:
+                logger.error(f"Datenbankfehler in der KI-Anreicherung: {str(e)}")
+            except Exception as e:
+                logger.error(f"Fehler in der KI-Anreicherung: {str(e)}")
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def start(self):
+        """Setzt abgebrochene Aufgaben zurück und startet die Worker-Threads"""
+        if self._threads:
+            return
+        with self.lexicon_db.transaction() as conn:
+            conn.execute('''
+                UPDATE enrichment_tasks SET status = 'pending', updated_at = CURRENT_TIMESTAMP
+                WHERE status = 'running'
+            ''')
+
+        for i in range(self.workers):
+            thread = Thread(target=self._run, name=f'enrichment-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"KI-Anreicherung mit {self.workers} Workern gestartet")
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+    def progress(self, source_url=None):
+        """Zählt die Aufgaben je Status, optional nur für einen Dienst"""
+        query = '''
+            SELECT t.status, COUNT(*)
+            FROM enrichment_tasks t
+        '''
+        params = ()
+        if source_url:
+            query += ' JOIN wfs_layers l ON l.id = t.layer_id WHERE l.source_url = ?'
+            params = (source_url,)
+        query += ' GROUP BY t.status'
+
+        with self.lexicon_db.connection() as conn:
+            counts = dict(conn.execute(query, params).fetchall())
+
+        progress = {status: counts.get(status, 0) for status in ('pending', 'running', 'done', 'error')}
+        progress['total'] = sum(progress.values())
+        return progress
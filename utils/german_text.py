@@ -0,0 +1,60 @@
+import re
+
+UMLAUT_MAP = {
+    'ä': 'ae', 'ö': 'oe', 'ü': 'ue', 'ß': 'ss',
+    'Ä': 'Ae', 'Ö': 'Oe', 'Ü': 'Ue'
+}
+UMLAUT_TABLE = str.maketrans(UMLAUT_MAP)
+
+# Trennt zusammengeschriebene Namen (AX_FlurstueckPunkt -> AX Flurstueck Punkt)
+CAMEL_CASE = re.compile(r'(?<=[a-zäöüß0-9])(?=[A-ZÄÖÜ])')
+TOKEN_SPLIT = re.compile(r'[\W_]+')
+DOUBLE_LETTER = re.compile(r'(.)\1')
+MARKED_DOUBLE = re.compile(r'(.)\*')
+
+
+def fold_umlauts(text):
+    """Schreibt Umlaute und ß aus (Gewässer -> Gewaesser)"""
+    return text.translate(UMLAUT_TABLE)
+
+
+def stem(word):
+    """
+    Leichter deutscher Stemmer nach CISTEM: entfernt Flexionsendungen
+    (-em, -er, -nd, -e, -s, -n) von einem kleingeschriebenen, gefalteten Wort
+    """
+    if len(word) <= 3:
+        return word
+
+    # Buchstabenfolgen schützen, die sonst als Endungen gekürzt würden
+    word = word.replace('sch', '$').replace('ei', '%').replace('ie', '&')
+    word = DOUBLE_LETTER.sub(r'\1*', word)
+
+    while len(word) > 3:
+        if len(word) > 5 and word[-2:] in ('em', 'er', 'nd'):
+            word = word[:-2]
+        elif word[-1] in 'esn':
+            word = word[:-1]
+        else:
+            break
+
+    word = MARKED_DOUBLE.sub(r'\1\1', word)
+    return word.replace('&', 'ie').replace('%', 'ei').replace('$', 'sch')
+
+
+def tokenize(text):
+    """Zerlegt Text und technische Layer-Namen in kleingeschriebene, gefaltete Wörter"""
+    if not text:
+        return []
+    text = fold_umlauts(CAMEL_CASE.sub(' ', str(text))).lower()
+    return [token for token in TOKEN_SPLIT.split(text) if token]
+
+
+def normalize_text(text):
+    """Gibt den Text als Folge gestemmter Wörter zurück (Form des Suchindex)"""
+    return ' '.join(stem(token) for token in tokenize(text))
+
+
+def register_functions(conn):
+    """Stellt normalize_text in SQL als lexicon_normalize(text) bereit (für Trigger und Abfragen)"""
+    conn.create_function('lexicon_normalize', 1, normalize_text, deterministic=True)
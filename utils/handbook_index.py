@@ -0,0 +1,236 @@
+import argparse
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+from array import array
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_INDEX_DIR = os.path.join(PROJECT_ROOT, 'data', 'cache', 'handbook')
+
+# Handbücher, die als Kontext für die KI-Prompts dienen
+HANDBOOKS = {
+    'atkis': os.path.join(PROJECT_ROOT, 'docs', 'atkis_handbook.pdf'),
+    'basis_dlm': os.path.join(PROJECT_ROOT, 'docs', 'OK Basis-DLM 7.1.1.pdf'),
+}
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+MAGIC = b'HBIDX02\n'
+SEPARATORS = ('\n\n', '\n', ' ')
+
+_indexes = {}
+_indexes_lock = Lock()
+
+
+def _require_pypdf():
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise RuntimeError('Für den Aufbau des Handbuch-Index wird das Paket pypdf benötigt (pip install pypdf)')
+    return PdfReader
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _pieces(text, size, separators=SEPARATORS):
+    # Text an der gröbsten möglichen Stelle teilen, bis jedes Stück höchstens 'size' Zeichen hat
+    if len(text) <= size:
+        return [text]
+    for i, separator in enumerate(separators):
+        if separator in text:
+            parts = text.split(separator)
+            pieces = []
+            for j, part in enumerate(parts):
+                piece = part + separator if j < len(parts) - 1 else part
+                pieces.extend(_pieces(piece, size, separators[i + 1:]))
+            return pieces
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def split_text(text, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    """Teilt Text in Abschnitte von höchstens chunk_size Zeichen, die sich um bis zu 'overlap' Zeichen überlappen"""
+    chunks = []
+    current = []
+    length = 0
+    for piece in _pieces(text, chunk_size):
+        if current and length + len(piece) > chunk_size:
+            chunks.append(''.join(current).strip())
+            # Das Ende des vorigen Abschnitts als Überlappung behalten
+            while current and (length > overlap or length + len(piece) > chunk_size):
+                length -= len(current.pop(0))
+        current.append(piece)
+        length += len(piece)
+    if current:
+        chunks.append(''.join(current).strip())
+    return [chunk for chunk in chunks if chunk]
+
+
+def build_index(pdf_path, index_path, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    """
+    Extrahiert den Text einer PDF seitenweise, teilt ihn in Abschnitte und schreibt den Index.
+    Aufbau: MAGIC, Länge und JSON-Kopf, Offsets der Abschnitte, Seitennummern,
+    danach der Text aller Abschnitte.
+    """
+    PdfReader = _require_pypdf()
+    source_hash = file_hash(pdf_path)
+
+    chunks, pages = [], []
+    for page_number, page in enumerate(PdfReader(pdf_path).pages, start=1):
+        for chunk in split_text(page.extract_text() or '', chunk_size, overlap):
+            chunks.append(chunk)
+            pages.append(page_number)
+
+    text_offsets = array('Q', [0])
+    text_parts = []
+    for chunk in chunks:
+        encoded = chunk.encode('utf-8')
+        text_parts.append(encoded)
+        text_offsets.append(text_offsets[-1] + len(encoded))
+
+    header = json.dumps({
+        'source': os.path.basename(pdf_path),
+        'source_hash': source_hash,
+        'chunks': len(chunks),
+        'chunk_size': chunk_size,
+        'overlap': overlap
+    }).encode('utf-8')
+
+    os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+    tmp_path = f'{index_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        text_offsets.tofile(f)
+        array('I', pages).tofile(f)
+        for part in text_parts:
+            f.write(part)
+    os.replace(tmp_path, index_path)
+
+    logger.info(f'Handbuch-Index {index_path}: {len(chunks)} Abschnitte aus {len(set(pages))} Seiten')
+    return len(chunks)
+
+
+class HandbookIndex:
+    """Schreibgeschützter, per mmap geladener Handbuch-Index; Abschnitte werden erst beim Zugriff dekodiert"""
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        with open(index_path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.mm[:len(MAGIC)] != MAGIC:
+            self.mm.close()
+            raise ValueError(f'{index_path} ist kein Handbuch-Index')
+        position = len(MAGIC)
+        (header_length,) = struct.unpack_from('<Q', self.mm, position)
+        position += 8
+        self.header = json.loads(self.mm[position:position + header_length])
+        position += header_length
+
+        count = self.header['chunks']
+        self.text_offsets = array('Q')
+        self.text_offsets.frombytes(self.mm[position:position + 8 * (count + 1)])
+        position += 8 * (count + 1)
+        self.pages = array('I')
+        self.pages.frombytes(self.mm[position:position + self.pages.itemsize * count])
+        position += self.pages.itemsize * count
+
+        self.text_start = position
+
+    @property
+    def source_hash(self):
+        return self.header['source_hash']
+
+    def __len__(self):
+        return self.header['chunks']
+
+    def chunk(self, i):
+        start = self.text_start + self.text_offsets[i]
+        end = self.text_start + self.text_offsets[i + 1]
+        return self.mm[start:end].decode('utf-8')
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.chunk(i)
+
+    def close(self):
+        self.mm.close()
+
+
+def index_path_for(name, index_dir=DEFAULT_INDEX_DIR):
+    return os.path.join(index_dir, f'{name}.idx')
+
+
+def ensure_index(name, index_dir=DEFAULT_INDEX_DIR, force=False):
+    """Baut den Index eines Handbuchs, wenn er fehlt oder nicht zum Hash der PDF passt"""
+    pdf_path = HANDBOOKS[name]
+    index_path = index_path_for(name, index_dir)
+
+    if not force and os.path.exists(index_path):
+        if not os.path.exists(pdf_path):
+            return index_path
+        try:
+            index = HandbookIndex(index_path)
+            current = index.source_hash == file_hash(pdf_path)
+            index.close()
+            if current:
+                return index_path
+            logger.info(f'Handbuch {name} wurde geändert, Index wird neu aufgebaut')
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f'Handbuch-Index {index_path} unlesbar, wird neu aufgebaut: {str(e)}')
+
+    build_index(pdf_path, index_path)
+    return index_path
+
+
+def get_handbook_index(name='atkis'):
+    """
+    Lädt den Index eines Handbuchs beim ersten Zugriff (und baut ihn bei Bedarf).
+    Gibt None zurück, wenn weder Index noch PDF nutzbar sind.
+    """
+    with _indexes_lock:
+        if name not in _indexes:
+            try:
+                _indexes[name] = HandbookIndex(ensure_index(name))
+            except Exception as e:
+                logger.error(f'Handbuch-Index {name} nicht verfügbar: {str(e)}')
+                _indexes[name] = None
+        return _indexes[name]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Baut den Textindex der Handbücher (ATKIS, Basis-DLM)')
+    parser.add_argument('names', nargs='*', help=f"Handbücher ({', '.join(HANDBOOKS)}; Standard: alle)")
+    parser.add_argument('--index-dir', default=DEFAULT_INDEX_DIR, help='Zielverzeichnis der Indexdateien')
+    parser.add_argument('--force', action='store_true', help='Auch aktuelle Indexe neu aufbauen')
+    args = parser.parse_args()
+
+    unknown = [name for name in args.names if name not in HANDBOOKS]
+    if unknown:
+        parser.error(f"Unbekanntes Handbuch: {', '.join(unknown)}")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    for name in args.names or HANDBOOKS:
+        index_path = ensure_index(name, args.index_dir, args.force)
+        index = HandbookIndex(index_path)
+        print(f'{name}: {len(index)} Abschnitte ({index_path})')
+        index.close()
+
+
+if __name__ == '__main__':
+    main()
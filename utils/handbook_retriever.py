@@ -0,0 +1,254 @@
+import heapq
+import logging
+import math
+from threading import Lock
+
+from utils.german_text import normalize_text, tokenize
+from utils.handbook_index import HANDBOOKS, get_handbook_index
+
+logger = logging.getLogger(__name__)
+
+# Häufige Wörter, die in fast jedem Abschnitt vorkommen und nichts zur Relevanz beitragen
+STOPWORDS = set(normalize_text(
+    'der die das den dem des ein eine einer eines einem einen und oder in im an am auf aus bei '
+    'mit von vom zu zum zur für ist sind wird werden wurde nicht als auch es sich diese dieser '
+    'bzw nach über wie so kann können'
+).split())
+
+# Länge der Zeichen-n-Gramme für die unscharfe Suche (Abkürzungen, Wortteile, Schreibvarianten)
+NGRAM_RANGE = (3, 5)
+
+# Ab dieser Kosinus-Ähnlichkeit gilt ein Abschnitt als Treffer der unscharfen Suche
+MIN_SIMILARITY = 0.1
+
+_retriever = None
+_retriever_lock = Lock()
+_vector_retriever = None
+_vector_retriever_lock = Lock()
+
+
+def analyze(text):
+    """Zerlegt Text in gestemmte, gefaltete Suchbegriffe ohne Stoppwörter (wie der Lexikon-Suchindex)"""
+    return [term for term in normalize_text(text).split() if term not in STOPWORDS]
+
+
+class BM25Retriever:
+    """
+    Invertierter Index mit BM25-Ranking über Textabschnitte.
+    Die BM25-Gewichte werden beim Aufbau pro (Begriff, Abschnitt) vorberechnet,
+    eine Abfrage summiert nur noch die Gewichte der Postings ihrer Begriffe.
+    """
+
+    def __init__(self, chunks, k1=1.5, b=0.75):
+        self.chunks = list(chunks)
+        term_frequencies = []
+        document_frequency = {}
+        for chunk in self.chunks:
+            frequencies = {}
+            for term in analyze(chunk):
+                frequencies[term] = frequencies.get(term, 0) + 1
+            term_frequencies.append(frequencies)
+            for term in frequencies:
+                document_frequency[term] = document_frequency.get(term, 0) + 1
+
+        count = len(self.chunks)
+        lengths = [sum(frequencies.values()) for frequencies in term_frequencies]
+        average_length = (sum(lengths) / count) if count else 0
+
+        # Postings: Begriff -> [(Abschnitt, BM25-Gewicht)]
+        self.postings = {}
+        for doc_id, frequencies in enumerate(term_frequencies):
+            norm = k1 * (1 - b + b * lengths[doc_id] / average_length) if average_length else k1
+            for term, tf in frequencies.items():
+                idf = math.log(1 + (count - document_frequency[term] + 0.5) / (document_frequency[term] + 0.5))
+                self.postings.setdefault(term, []).append((doc_id, idf * tf * (k1 + 1) / (tf + norm)))
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def search(self, query, k=3):
+        """Gibt die k relevantesten Abschnitte als [(doc_id, score)] zurück"""
+        scores = {}
+        for term in set(analyze(query)):
+            for doc_id, weight in self.postings.get(term, ()):
+                scores[doc_id] = scores.get(doc_id, 0.0) + weight
+        return heapq.nlargest(k, scores.items(), key=lambda item: (item[1], -item[0]))
+
+    def retrieve(self, query, k=3):
+        """Gibt die Texte der k relevantesten Abschnitte zurück"""
+        return [self.chunks[doc_id] for doc_id, _ in self.search(query, k)]
+
+
+def _require_scipy():
+    try:
+        import numpy
+        import scipy.sparse
+    except ImportError:
+        raise RuntimeError('Für die unscharfe Handbuch-Suche werden numpy und scipy benötigt (pip install numpy scipy)')
+    return numpy, scipy.sparse
+
+
+def char_ngrams(word, ngram_range=NGRAM_RANGE):
+    """Zeichen-n-Gramme eines Wortes mit Wortgrenzen (' gew', 'gewae', ...)"""
+    word = f' {word} '
+    low, high = ngram_range
+    return [
+        word[i:i + n]
+        for n in range(low, high + 1)
+        for i in range(len(word) - n + 1)
+    ]
+
+
+class TfidfRetriever:
+    """
+    TF-IDF über Zeichen-n-Gramme als dünn besetzte Matrix (Abschnitte x n-Gramme).
+    Zeilen sind L2-normiert, die Kosinus-Ähnlichkeit aller Anfragen eines Batches zu
+    allen Abschnitten ergibt sich aus einer einzigen Matrixmultiplikation.
+    """
+
+    def __init__(self, chunks, ngram_range=NGRAM_RANGE):
+        np, sparse = _require_scipy()
+        self.np, self.sparse = np, sparse
+        self.chunks = list(chunks)
+        self.ngram_range = ngram_range
+        self.vocabulary = {}
+        self._word_cache = {}
+
+        rows, columns, values = [], [], []
+        for doc_id, chunk in enumerate(self.chunks):
+            counts = self._count(chunk, grow=True)
+            rows.extend([doc_id] * len(counts))
+            columns.extend(counts)
+            values.extend(counts.values())
+        self._word_cache = {}
+
+        shape = (len(self.chunks), len(self.vocabulary))
+        matrix = self._csr(rows, columns, values, shape)
+        # Geglättete IDF wie üblich: log((1 + n) / (1 + df)) + 1
+        document_frequency = np.bincount(matrix.indices, minlength=shape[1])
+        self.idf = (np.log((1 + shape[0]) / (1 + document_frequency)) + 1).astype(np.float32)
+        self.matrix = self._weight(matrix)
+
+    def _count(self, text, grow=False):
+        # n-Gramme pro Wort nur einmal bilden; Handbuchtexte wiederholen ihre Fachbegriffe oft
+        counts = {}
+        for word in tokenize(text):
+            grams = self._word_cache.get(word)
+            if grams is None:
+                grams = []
+                for gram in char_ngrams(word, self.ngram_range):
+                    column = self.vocabulary.get(gram)
+                    if column is None and grow:
+                        column = self.vocabulary[gram] = len(self.vocabulary)
+                    if column is not None:
+                        grams.append(column)
+                if grow:
+                    self._word_cache[word] = grams
+            for column in grams:
+                counts[column] = counts.get(column, 0) + 1
+        return counts
+
+    def _csr(self, rows, columns, values, shape):
+        np = self.np
+        return self.sparse.csr_matrix(
+            (np.array(values, dtype=np.float32), (np.array(rows, dtype=np.int64), np.array(columns, dtype=np.int64))),
+            shape=shape
+        )
+
+    def _weight(self, matrix):
+        # Sublineare Termhäufigkeit mal IDF, danach jede Zeile auf Länge 1 normieren
+        np = self.np
+        matrix = matrix.tocsr(copy=True)
+        matrix.data = (1 + np.log(matrix.data)) * self.idf[matrix.indices]
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        return matrix.multiply(1 / norms[:, None]).tocsr()
+
+    def _vectorize(self, queries):
+        rows, columns, values = [], [], []
+        for row, query in enumerate(queries):
+            counts = self._count(query)
+            rows.extend([row] * len(counts))
+            columns.extend(counts)
+            values.extend(counts.values())
+        return self._weight(self._csr(rows, columns, values, (len(queries), len(self.vocabulary))))
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def search_batch(self, queries, k=3, min_similarity=MIN_SIMILARITY):
+        """
+        Kosinus-Top-k für mehrere Anfragen mit einer Matrixmultiplikation.
+        Gibt pro Anfrage [(doc_id, similarity)] absteigend sortiert zurück.
+        """
+        np = self.np
+        if not queries or not len(self.chunks):
+            return [[] for _ in queries]
+
+        scores = (self._vectorize(queries) @ self.matrix.T).toarray()
+        k = min(k, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+
+        results = []
+        for row, candidates in enumerate(top):
+            ranked = sorted(candidates, key=lambda doc_id: (-scores[row, doc_id], doc_id))
+            results.append([
+                (int(doc_id), float(scores[row, doc_id]))
+                for doc_id in ranked
+                if scores[row, doc_id] >= min_similarity
+            ])
+        return results
+
+    def retrieve_batch(self, queries, k=3):
+        """Gibt pro Anfrage die Texte der k ähnlichsten Abschnitte zurück"""
+        return [[self.chunks[doc_id] for doc_id, _ in hits] for hits in self.search_batch(queries, k)]
+
+
+def handbook_chunks(names=None):
+    """Abschnitte aller Handbücher; gleiche Abschnitte (z.B. aus identischen PDFs) nur einmal"""
+    seen = set()
+    chunks = []
+    for name in names or HANDBOOKS:
+        index = get_handbook_index(name)
+        if index is None:
+            continue
+        for chunk in index:
+            if chunk not in seen:
+                seen.add(chunk)
+                chunks.append(chunk)
+    return chunks
+
+
+def get_handbook_retriever():
+    """Baut den BM25-Index über die Handbücher beim ersten Zugriff einmal auf"""
+    global _retriever
+    if _retriever is None:
+        with _retriever_lock:
+            if _retriever is None:
+                _retriever = BM25Retriever(handbook_chunks())
+                logger.info(f'BM25-Index über {len(_retriever)} Handbuch-Abschnitte aufgebaut')
+    return _retriever
+
+
+def retrieve_context(query, k=3):
+    """Die k relevantesten Handbuch-Abschnitte für eine Anfrage (leer, wenn nichts passt)"""
+    return get_handbook_retriever().retrieve(query, k)
+
+
+def get_vector_retriever():
+    """Baut die TF-IDF-Matrix über die Handbücher beim ersten Zugriff einmal auf"""
+    global _vector_retriever
+    if _vector_retriever is None:
+        with _vector_retriever_lock:
+            if _vector_retriever is None:
+                _vector_retriever = TfidfRetriever(get_handbook_retriever().chunks)
+                logger.info(
+                    f'TF-IDF-Matrix über {len(_vector_retriever)} Handbuch-Abschnitte aufgebaut '
+                    f'({len(_vector_retriever.vocabulary)} n-Gramme)'
+                )
+    return _vector_retriever
+
+
+def retrieve_context_batch(queries, k=3):
+    """Unscharfe Suche (TF-IDF über Zeichen-n-Gramme) für mehrere Anfragen auf einmal"""
+    return get_vector_retriever().retrieve_batch(list(queries), k)
@@ -0,0 +1,158 @@
+import logging
+import os
+from threading import Lock
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+import urllib3
+from urllib3.util.retry import Retry
+
+# SSL-Warnungen für Hosts ohne Zertifikatsprüfung unterdrücken
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 30
+
+# Verbindungen pro Host, die offen gehalten werden
+DEFAULT_POOL_SIZE = 10
+
+# Größere Pools für Hosts, von denen viele Anfragen parallel kommen
+HOST_POOL_SIZES = {}
+
+# Hosts mit selbstsignierten oder abgelaufenen Zertifikaten, für die TLS nicht geprüft wird
+INSECURE_HOSTS = {
+    host.strip().lower() for host in os.getenv('HTTP_INSECURE_HOSTS', '').split(',') if host.strip()
+}
+
+_session = None
+_session_lock = Lock()
+
+
+def _build_retry():
+    """
+    Wiederholt GET- und HEAD-Anfragen bei Verbindungsfehlern und 5xx-Antworten mit exponentiellem
+    Backoff. Lese-Timeouts werden nicht wiederholt, sonst blockiert ein hängender Server den Aufrufer
+    ein Vielfaches des Timeouts. POST wird nie automatisch wiederholt, da die Anfrage den Server
+    bereits erreicht haben kann.
+    """
+    return Retry(
+        total=3,
+        connect=3,
+        read=0,
+        backoff_factor=0.5,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        raise_on_status=False
+    )
+
+
+def _build_adapter(pool_size):
+    return HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=_build_retry()
+    )
+
+
+def _create_session():
+    session = requests.Session()
+    session.headers.update({
+        'Accept-Encoding': 'gzip, deflate',
+        'User-Agent': 'geodata-explorer'
+    })
+
+    adapter = _build_adapter(DEFAULT_POOL_SIZE)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    for host, pool_size in HOST_POOL_SIZES.items():
+        _mount_host(session, host, pool_size)
+
+    logger.info("HTTP-Session mit Connection-Pooling erstellt")
+    return session
+
+
+def _mount_host(session, host, pool_size):
+    adapter = _build_adapter(pool_size)
+    session.mount(f'http://{host}', adapter)
+    session.mount(f'https://{host}', adapter)
+
+
+def get_session():
+    """Gibt die gemeinsame HTTP-Session mit Keep-Alive-Verbindungen zurück"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _create_session()
+    return _session
+
+
+def configure_host(host, pool_size):
+    """Legt die Pool-Größe für einen einzelnen Host fest"""
+    HOST_POOL_SIZES[host] = pool_size
+    with _session_lock:
+        if _session is not None:
+            _mount_host(_session, host, pool_size)
+
+
+def allow_insecure(host):
+    """Schaltet die TLS-Zertifikatsprüfung für einen einzelnen Host ab"""
+    INSECURE_HOSTS.add(host.lower())
+
+
+def _verify(url):
+    return urlparse(url).hostname not in INSECURE_HOSTS
+
+
+def request(method, url, timeout=DEFAULT_TIMEOUT, **kwargs):
+    """Führt eine Anfrage über die gemeinsame Session aus (mit TLS-Prüfung außer für INSECURE_HOSTS)"""
+    kwargs.setdefault('verify', _verify(url))
+    return get_session().request(method, url, timeout=timeout, **kwargs)
+
+
+def get(url, params=None, timeout=DEFAULT_TIMEOUT, **kwargs):
+    """GET-Anfrage über die gemeinsame Session"""
+    return request('GET', url, params=params, timeout=timeout, **kwargs)
+
+
+def head(url, timeout=DEFAULT_TIMEOUT, **kwargs):
+    """HEAD-Anfrage über die gemeinsame Session"""
+    kwargs.setdefault('allow_redirects', True)
+    return request('HEAD', url, timeout=timeout, **kwargs)
+
+
+class _SessionRequests:
+    """Ersetzt das requests-Modul in owslib, damit dessen Anfragen die gemeinsame Session nutzen"""
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('verify', _verify(url))
+        return get_session().request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def __getattr__(self, name):
+        # exceptions, codes, ... kommen weiterhin aus dem echten Modul
+        return getattr(requests, name)
+
+
+_owslib_patched = False
+
+
+def patch_owslib():
+    """Leitet alle HTTP-Anfragen von owslib über die gemeinsame Session"""
+    global _owslib_patched
+    if _owslib_patched:
+        return
+    try:
+        import owslib.util
+    except ImportError:
+        return
+    owslib.util.requests = _SessionRequests()
+    _owslib_patched = True
+    logger.info("owslib nutzt die gemeinsame HTTP-Session")
@@ -0,0 +1,110 @@
+import logging
+import os
+import sqlite3
+from contextlib import contextmanager
+from queue import Empty, Full, LifoQueue
+from threading import Lock
+
+from utils.german_text import register_functions
+
+logger = logging.getLogger(__name__)
+
+# Seitencache pro Verbindung in KiB (negativer Wert für PRAGMA cache_size)
+DEFAULT_CACHE_SIZE_KB = 64 * 1024
+
+# Anzahl vorbereiteter Statements, die jede Verbindung im Cache hält
+DEFAULT_CACHED_STATEMENTS = 256
+
+_pools = {}
+_pools_lock = Lock()
+
+
+class LexiconDB:
+    """
+    Pool wiederverwendbarer SQLite-Verbindungen für das Daten-Lexikon.
+    Jede Verbindung läuft im WAL-Modus mit synchronous=NORMAL, sodass Lesezugriffe
+    nicht hinter einem laufenden Import warten. Da die Verbindungen erhalten bleiben,
+    bleibt auch ihr Cache vorbereiteter Statements über Anfragen hinweg gültig.
+    """
+
+    def __init__(self, db_path, pool_size=8, cache_size_kb=DEFAULT_CACHE_SIZE_KB,
+                 cached_statements=DEFAULT_CACHED_STATEMENTS, busy_timeout=30):
+        self.db_path = db_path
+        self.cache_size_kb = cache_size_kb
+        self.cached_statements = cached_statements
+        self.busy_timeout = busy_timeout
+        self.pool = LifoQueue(maxsize=pool_size)
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout,
+            cached_statements=self.cached_statements,
+            check_same_thread=False
+        )
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA cache_size=-{self.cache_size_kb}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        # Wird von den Triggern des Volltextindex benötigt
+        register_functions(conn)
+        return conn
+
+    def acquire(self):
+        """Entnimmt eine Verbindung aus dem Pool oder öffnet eine neue"""
+        try:
+            return self.pool.get_nowait()
+        except Empty:
+            return self._connect()
+
+    def release(self, conn):
+        """Gibt eine Verbindung an den Pool zurück; offene Transaktionen werden verworfen"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.row_factory = None
+            self.pool.put_nowait(conn)
+        except Full:
+            conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"Verbindung verworfen: {str(e)}")
+            conn.close()
+
+    @contextmanager
+    def connection(self, row_factory=None):
+        """Stellt eine Verbindung für die Dauer des with-Blocks bereit"""
+        conn = self.acquire()
+        conn.row_factory = row_factory
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    @contextmanager
+    def transaction(self):
+        """Schreibt alle Änderungen des with-Blocks in einer Transaktion"""
+        with self.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+
+    def close_all(self):
+        """Schließt alle Verbindungen im Pool"""
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except Empty:
+                break
+
+
+def get_lexicon_db(db_path):
+    """Gibt den gemeinsamen Verbindungspool für eine Lexikon-Datenbank zurück"""
+    key = os.path.abspath(db_path)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = LexiconDB(db_path)
+        return _pools[key]
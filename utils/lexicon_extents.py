@@ -0,0 +1,162 @@
+from utils.lexicon_search import COLUMN_WEIGHTS, LAYER_COLUMNS, build_match_query
+
+# Zulässiger Wertebereich für WGS84-Koordinaten (Länge, Breite)
+WORLD = (-180.0, -90.0, 180.0, 90.0)
+
+
+def normalize_bbox(bbox):
+    """
+    Prüft eine Ausdehnung (min_x, min_y, max_x, max_y) in WGS84 und gibt sie als Tupel zurück.
+    Akzeptiert auch owslib-Tupel mit angehängtem CRS; ungültige Angaben ergeben None.
+    """
+    if not bbox or len(bbox) < 4:
+        return None
+    try:
+        min_x, min_y, max_x, max_y = (float(value) for value in bbox[:4])
+    except (TypeError, ValueError):
+        return None
+    if min_x > max_x or min_y > max_y:
+        return None
+    if min_x < WORLD[0] or min_y < WORLD[1] or max_x > WORLD[2] or max_y > WORLD[3]:
+        return None
+    return min_x, min_y, max_x, max_y
+
+
+def parse_bbox_param(value):
+    """Liest 'min_x,min_y,max_x,max_y' aus einem Query-Parameter"""
+    bbox = normalize_bbox(value.split(',')) if value else None
+    if bbox is None:
+        raise ValueError('Ungültige Bounding Box (erwartet: min_x,min_y,max_x,max_y in WGS84)')
+    return bbox
+
+
+def parse_point_param(value):
+    """Liest 'x,y' aus einem Query-Parameter als Bounding Box der Ausdehnung 0"""
+    parts = value.split(',') if value else []
+    bbox = normalize_bbox(parts + parts) if len(parts) == 2 else None
+    if bbox is None:
+        raise ValueError('Ungültiger Punkt (erwartet: x,y in WGS84)')
+    return bbox
+
+
+def store_layer_extents(conn, rows):
+    """
+    Schreibt die Ausdehnung importierter Layer in den R-Tree.
+    rows: (name, source_url, bbox); Layer ohne gültige Ausdehnung werden übersprungen.
+    """
+    extent_rows = []
+    for name, source_url, bbox in rows:
+        bbox = normalize_bbox(bbox)
+        if bbox is not None:
+            min_x, min_y, max_x, max_y = bbox
+            extent_rows.append((min_x, max_x, min_y, max_y, name, source_url))
+
+    conn.executemany('''
+        INSERT OR REPLACE INTO layer_extents (id, min_x, max_x, min_y, max_y)
+        SELECT id, ?, ?, ?, ? FROM wfs_layers WHERE name = ? AND source_url = ?
+    ''', extent_rows)
+
+
+def update_service_extent(conn, url, service_type=None):
+    """Setzt die Ausdehnung eines Dienstes auf die Vereinigung der Ausdehnungen seiner Layer"""
+    params = [url]
+    type_filter = ''
+    if service_type:
+        type_filter = ' AND s.type = ?'
+        params.append(service_type)
+
+    # Ohne aktuelle Layer mit Ausdehnung entfällt auch die Ausdehnung des Dienstes
+    conn.execute(f'''
+        DELETE FROM service_extents
+        WHERE id IN (SELECT s.id FROM services s WHERE s.url = ?{type_filter})
+    ''', params)
+    conn.execute(f'''
+        INSERT INTO service_extents (id, min_x, max_x, min_y, max_y)
+        SELECT s.id, MIN(e.min_x), MAX(e.max_x), MIN(e.min_y), MAX(e.max_y)
+        FROM services s
+        JOIN wfs_layers l ON l.source_url = s.url AND l.stale = 0
+        JOIN layer_extents e ON e.id = l.id
+        WHERE s.url = ?{type_filter}
+        GROUP BY s.id
+    ''', params)
+
+
+def find_layers(conn, bbox, text=None, limit=50, offset=0, state=None, source_type=None, include_stale=False):
+    """
+    Sucht Layer, deren Ausdehnung die Bounding Box schneidet (Punkt: Ausdehnung 0),
+    veraltete Layer nur mit include_stale.
+    Mit Suchtext werden die Treffer zusätzlich über den Volltextindex gefiltert und nach
+    Relevanz sortiert, sonst nach Fläche (die genauesten Layer zuerst).
+    Gibt (Treffer, Gesamtanzahl) zurück; jeder Treffer enthält seine Bounding Box.
+    """
+    min_x, min_y, max_x, max_y = bbox
+    joins = ''
+    clauses = ['e.max_x >= ?', 'e.min_x <= ?', 'e.max_y >= ?', 'e.min_y <= ?']
+    params = [min_x, max_x, min_y, max_y]
+    rank = '(e.max_x - e.min_x) * (e.max_y - e.min_y)'
+
+    if text:
+        match = build_match_query(text)
+        if not match:
+            return [], 0
+        joins = 'JOIN lexicon_fts ON lexicon_fts.rowid = l.id'
+        clauses.append('lexicon_fts MATCH ?')
+        params.append(match)
+        rank = f"bm25(lexicon_fts, {', '.join(str(weight) for weight in COLUMN_WEIGHTS)})"
+
+    if not include_stale:
+        clauses.append('l.stale = 0')
+    for column, value in (('l.state', state), ('l.source_type', source_type)):
+        if value:
+            clauses.append(f'{column} = ?')
+            params.append(value)
+
+    where = ' AND '.join(clauses)
+    columns = ', '.join(f'l.{column}' for column in LAYER_COLUMNS)
+
+    rows = conn.execute(f'''
+        SELECT {columns}, e.min_x, e.min_y, e.max_x, e.max_y, {rank} AS rank
+        FROM layer_extents e
+        JOIN wfs_layers l ON l.id = e.id
+        {joins}
+        WHERE {where}
+        ORDER BY rank, l.id
+        LIMIT ? OFFSET ?
+    ''', [*params, limit, offset]).fetchall()
+
+    total = conn.execute(f'''
+        SELECT COUNT(*)
+        FROM layer_extents e
+        JOIN wfs_layers l ON l.id = e.id
+        {joins}
+        WHERE {where}
+    ''', params).fetchone()[0]
+
+    results = []
+    for row in rows:
+        result = dict(zip(LAYER_COLUMNS, row))
+        result['bbox'] = list(row[len(LAYER_COLUMNS):len(LAYER_COLUMNS) + 4])
+        results.append(result)
+    return results, total
+
+
+def find_services(conn, bbox, limit=50):
+    """Sucht Dienste, deren Gesamtausdehnung die Bounding Box schneidet"""
+    min_x, min_y, max_x, max_y = bbox
+    rows = conn.execute('''
+        SELECT s.id, s.url, s.type, s.title, s.state, s.status,
+               e.min_x, e.min_y, e.max_x, e.max_y
+        FROM service_extents e
+        JOIN services s ON s.id = e.id
+        WHERE e.max_x >= ? AND e.min_x <= ? AND e.max_y >= ? AND e.min_y <= ?
+        ORDER BY (e.max_x - e.min_x) * (e.max_y - e.min_y), s.id
+        LIMIT ?
+    ''', (min_x, max_x, min_y, max_y, limit)).fetchall()
+
+    return [
+        {
+            'id': row[0], 'url': row[1], 'type': row[2], 'title': row[3],
+            'state': row[4], 'status': row[5], 'bbox': list(row[6:10])
+        }
+        for row in rows
+    ]
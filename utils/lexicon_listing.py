@@ -0,0 +1,75 @@
+import base64
+
+# Spalten der Lexikon-Übersicht
+LISTING_COLUMNS = (
+    'id', 'name', 'cleaned_name', 'title', 'description', 'ai_description',
+    'source_url', 'source_type', 'state', 'stale', 'created_at', 'last_updated'
+)
+
+# Filter der Übersicht und die zugehörigen Spalten
+FILTER_COLUMNS = ('state', 'source_type', 'source_url')
+
+
+def encode_cursor(created_at, layer_id):
+    """Kodiert die Position des letzten Layers einer Seite als URL-tauglichen Cursor"""
+    return base64.urlsafe_b64encode(f'{created_at}|{layer_id}'.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Gibt (created_at, id) eines Cursors zurück"""
+    try:
+        created_at, layer_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').rsplit('|', 1)
+        return created_at, int(layer_id)
+    except (ValueError, UnicodeError):
+        raise ValueError('Ungültiger Cursor')
+
+
+def list_layers(conn, limit=50, cursor=None, include_stale=False, **filters):
+    """
+    Liefert eine Seite des Lexikons, neueste zuerst.
+    Statt OFFSET wird ab der Position des Cursors gesucht (Keyset-Pagination über
+    (created_at, id)), jede Seite kostet damit gleich viel, egal wie weit hinten sie liegt.
+    Veraltete Layer (vom Dienst nicht mehr angeboten) nur mit include_stale.
+    Gibt (Layer, Cursor der nächsten Seite oder None) zurück.
+    """
+    clauses, params = [], []
+    if not include_stale:
+        clauses.append('stale = 0')
+    for column in FILTER_COLUMNS:
+        if filters.get(column):
+            clauses.append(f'{column} = ?')
+            params.append(filters[column])
+
+    if cursor:
+        clauses.append('(created_at, id) < (?, ?)')
+        params.extend(decode_cursor(cursor))
+
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+
+    # Eine Zeile mehr lesen, um zu wissen, ob es eine weitere Seite gibt
+    rows = conn.execute(f'''
+        SELECT {', '.join(LISTING_COLUMNS)}
+        FROM wfs_layers
+        {where}
+        ORDER BY created_at DESC, id DESC
+        LIMIT ?
+    ''', [*params, limit + 1]).fetchall()
+
+    layers = [dict(zip(LISTING_COLUMNS, row)) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = layers[-1]
+        next_cursor = encode_cursor(last['created_at'], last['id'])
+    return layers, next_cursor
+
+
+def filter_options(conn):
+    """Vorhandene Bundesländer und Diensttypen für die Filterauswahl (aus lexicon_filter_values)"""
+    options = {'state': [], 'source_type': []}
+    for column, value in conn.execute('''
+        SELECT column_name, value FROM lexicon_filter_values
+        WHERE layers > 0
+        ORDER BY column_name, value
+    '''):
+        options[column].append(value)
+    return {'states': options['state'], 'source_types': options['source_type']}
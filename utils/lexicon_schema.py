@@ -0,0 +1,321 @@
+from utils.german_text import register_functions
+
+
+def init_lexicon_schema(cursor):
+    """Legt die Tabellen des Daten-Lexikons an bzw. ergänzt fehlende Spalten"""
+    # Die Trigger des Suchindex nutzen lexicon_normalize()
+    register_functions(cursor.connection)
+
+    # Erstelle Tabelle für Layer
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS wfs_layers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            cleaned_name TEXT,
+            title TEXT,
+            description TEXT,
+            ai_description TEXT,
+            source_url TEXT NOT NULL,
+            source_type TEXT NOT NULL,
+            state TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(name, source_url)
+        )
+    ''')
+    
+    # Füge neue Spalten hinzu, falls sie noch nicht existieren
+    cursor.execute("PRAGMA table_info(wfs_layers)")
+    columns = [column[1] for column in cursor.fetchall()]
+    
+    if 'cleaned_name' not in columns:
+        cursor.execute('ALTER TABLE wfs_layers ADD COLUMN cleaned_name TEXT')
+    if 'ai_description' not in columns:
+        cursor.execute('ALTER TABLE wfs_layers ADD COLUMN ai_description TEXT')
+
+    # Abgleich per Inhalts-Hash (utils/lexicon_sync.py): nicht mehr angebotene Layer bleiben als veraltet erhalten
+    sync_columns = {
+        'content_hash': 'TEXT',
+        'stale': 'INTEGER NOT NULL DEFAULT 0',
+        'stale_since': 'TIMESTAMP'
+    }
+    for column, column_type in sync_columns.items():
+        if column not in columns:
+            cursor.execute(f'ALTER TABLE wfs_layers ADD COLUMN {column} {column_type}')
+
+    # Indizes für die Lexikon-Übersicht: Sortierung und Keyset-Cursor über (created_at, id),
+    # je Filter mit vorangestellter Filterspalte
+    for index_name, columns in (
+        ('idx_wfs_layers_created', 'created_at, id'),
+        ('idx_wfs_layers_state_created', 'state, created_at, id'),
+        ('idx_wfs_layers_type_created', 'source_type, created_at, id'),
+        ('idx_wfs_layers_source_created', 'source_url, created_at, id'),
+        ('idx_wfs_layers_cleaned_name', 'cleaned_name')
+    ):
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {index_name} ON wfs_layers ({columns})')
+
+    # Werte der Filter (Bundesland, Diensttyp) mit Anzahl der Layer, per Trigger gepflegt,
+    # damit die Filterauswahl der Übersicht nicht bei jedem Aufruf die ganze Tabelle liest
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'lexicon_filter_values'")
+    filter_values_exist = cursor.fetchone() is not None
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS lexicon_filter_values (
+            column_name TEXT NOT NULL,
+            value TEXT NOT NULL,
+            layers INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (column_name, value)
+        )
+    ''')
+
+    def count_filter_values(ref, delta):
+        return ''.join(f'''
+            INSERT INTO lexicon_filter_values (column_name, value, layers)
+            SELECT '{column}', {ref}.{column}, {delta} WHERE {ref}.{column} IS NOT NULL
+            ON CONFLICT(column_name, value) DO UPDATE SET layers = layers + ({delta});
+        ''' for column in ('state', 'source_type'))
+
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS lexicon_filter_values_insert AFTER INSERT ON wfs_layers BEGIN
+            {count_filter_values('new', 1)}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS lexicon_filter_values_update
+        AFTER UPDATE OF state, source_type ON wfs_layers
+        WHEN old.state IS NOT new.state OR old.source_type IS NOT new.source_type BEGIN
+            {count_filter_values('old', -1)}
+            {count_filter_values('new', 1)}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS lexicon_filter_values_delete AFTER DELETE ON wfs_layers BEGIN
+            {count_filter_values('old', -1)}
+        END
+    ''')
+
+    if not filter_values_exist:
+        for column in ('state', 'source_type'):
+            cursor.execute(f'''
+                INSERT INTO lexicon_filter_values (column_name, value, layers)
+                SELECT '{column}', {column}, COUNT(*) FROM wfs_layers
+                WHERE {column} IS NOT NULL
+                GROUP BY {column}
+            ''')
+
+    # Erstelle Tabelle für Layer-Attribute
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS layer_attributes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            layer_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            type TEXT,
+            description TEXT,
+            FOREIGN KEY (layer_id) REFERENCES wfs_layers(id)
+        )
+    ''')
+    
+    # Attribute eindeutig pro Layer; vor dem Anlegen des Index vorhandene Duplikate entfernen
+    cursor.execute('''
+        SELECT 1 FROM sqlite_master
+        WHERE type = 'index' AND name = 'idx_layer_attributes_unique'
+    ''')
+    if cursor.fetchone() is None:
+        cursor.execute('''
+            DELETE FROM layer_attributes
+            WHERE id NOT IN (
+                SELECT MAX(id) FROM layer_attributes GROUP BY layer_id, name
+            )
+        ''')
+        cursor.execute('''
+            CREATE UNIQUE INDEX idx_layer_attributes_unique
+            ON layer_attributes (layer_id, name)
+        ''')
+
+    # Wertestatistik der Attribute (siehe utils/attribute_profiler.py)
+    cursor.execute("PRAGMA table_info(layer_attributes)")
+    columns = [column[1] for column in cursor.fetchall()]
+
+    profile_columns = {
+        'value_count': 'INTEGER',
+        'null_count': 'INTEGER',
+        'distinct_count': 'INTEGER',
+        'distinct_exact': 'INTEGER',
+        'profiled_at': 'TIMESTAMP'
+    }
+    for column, column_type in profile_columns.items():
+        if column not in columns:
+            cursor.execute(f'ALTER TABLE layer_attributes ADD COLUMN {column} {column_type}')
+
+    # Häufigste Werte je Attribut; bei distinct_exact = 0 sind die Häufigkeiten Schätzungen
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS attribute_values (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            attribute_id INTEGER NOT NULL,
+            value TEXT,
+            frequency INTEGER DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (attribute_id) REFERENCES layer_attributes(id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_attribute_values_attribute_id
+        ON attribute_values (attribute_id, frequency)
+    ''')
+
+    # Erstelle Tabelle für Services
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS services (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            url TEXT NOT NULL,
+            type TEXT NOT NULL,
+            title TEXT,
+            description TEXT,
+            state TEXT,
+            status TEXT DEFAULT 'active',
+            last_checked TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(url, type)
+        )
+    ''')
+
+    # Ergebnisse des Dienst-Monitors an den Services ergänzen
+    cursor.execute("PRAGMA table_info(services)")
+    columns = [column[1] for column in cursor.fetchall()]
+
+    monitor_columns = {
+        'etag': 'TEXT',
+        'last_modified': 'TEXT',
+        'capabilities_hash': 'TEXT',
+        'capabilities_checked': 'TIMESTAMP',
+        'sample_layer': 'TEXT',
+        'preferred_version': 'TEXT',
+        'preferred_format': 'TEXT',
+        'availability': 'REAL',
+        'latency_p50': 'INTEGER',
+        'latency_p95': 'INTEGER',
+        'content_hash': 'TEXT'
+    }
+    for column, column_type in monitor_columns.items():
+        if column not in columns:
+            cursor.execute(f'ALTER TABLE services ADD COLUMN {column} {column_type}')
+
+    # Erstelle Tabelle für einzelne Prüfungen der Dienste
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS service_checks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            service_id INTEGER NOT NULL,
+            checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            available INTEGER NOT NULL,
+            status_code INTEGER,
+            latency_ms INTEGER,
+            hits_ms INTEGER,
+            capabilities_changed INTEGER DEFAULT 0,
+            error TEXT,
+            FOREIGN KEY (service_id) REFERENCES services(id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_service_checks_service
+        ON service_checks (service_id, checked_at)
+    ''')
+
+    # Erstelle Tabelle für die Warteschlange der KI-Anreicherung
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS enrichment_tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            layer_id INTEGER NOT NULL UNIQUE,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (layer_id) REFERENCES wfs_layers(id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_enrichment_tasks_status
+        ON enrichment_tasks (status, id)
+    ''')
+
+    # Räumliche Indizes (R-Tree) der Ausdehnung von Layern und Diensten in WGS84,
+    # die id entspricht wfs_layers.id bzw. services.id
+    for table in ('layer_extents', 'service_extents'):
+        cursor.execute(f'''
+            CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING rtree(
+                id, min_x, max_x, min_y, max_y
+            )
+        ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS layer_extents_delete AFTER DELETE ON wfs_layers BEGIN
+            DELETE FROM layer_extents WHERE id = old.id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS service_extents_delete AFTER DELETE ON services BEGIN
+            DELETE FROM service_extents WHERE id = old.id;
+        END
+    ''')
+
+    # Volltextindex über Layer und Attributnamen, Texte werden vorab gefaltet und gestemmt
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'lexicon_fts'")
+    fts_exists = cursor.fetchone() is not None
+
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS lexicon_fts USING fts5(
+            name, cleaned_name, title, description, ai_description, attributes,
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS lexicon_fts_insert AFTER INSERT ON wfs_layers BEGIN
+            INSERT INTO lexicon_fts (rowid, name, cleaned_name, title, description, ai_description, attributes)
+            VALUES (
+                new.id,
+                lexicon_normalize(new.name),
+                lexicon_normalize(new.cleaned_name),
+                lexicon_normalize(new.title),
+                lexicon_normalize(new.description),
+                lexicon_normalize(new.ai_description),
+                (SELECT lexicon_normalize(group_concat(name, ' ')) FROM layer_attributes WHERE layer_id = new.id)
+            );
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS lexicon_fts_update
+        AFTER UPDATE OF name, cleaned_name, title, description, ai_description ON wfs_layers BEGIN
+            UPDATE lexicon_fts SET
+                name = lexicon_normalize(new.name),
+                cleaned_name = lexicon_normalize(new.cleaned_name),
+                title = lexicon_normalize(new.title),
+                description = lexicon_normalize(new.description),
+                ai_description = lexicon_normalize(new.ai_description)
+            WHERE rowid = new.id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS lexicon_fts_delete AFTER DELETE ON wfs_layers BEGIN
+            DELETE FROM lexicon_fts WHERE rowid = old.id;
+        END
+    ''')
+
+    # Die Attributspalte schreiben die Importe einmal pro Layer (lexicon_search.refresh_attribute_index);
+    # Trigger pro Attributzeile würden den Index bei jedem Attribut für den ganzen Layer neu aufbauen
+    for event in ('insert', 'update', 'delete'):
+        cursor.execute(f'DROP TRIGGER IF EXISTS lexicon_fts_attributes_{event}')
+
+    # Bestehende Layer beim ersten Anlegen des Index übernehmen
+    if not fts_exists:
+        cursor.execute('''
+            INSERT INTO lexicon_fts (rowid, name, cleaned_name, title, description, ai_description, attributes)
+            SELECT
+                l.id,
+                lexicon_normalize(l.name),
+                lexicon_normalize(l.cleaned_name),
+                lexicon_normalize(l.title),
+                lexicon_normalize(l.description),
+                lexicon_normalize(l.ai_description),
+                (SELECT lexicon_normalize(group_concat(a.name, ' ')) FROM layer_attributes a WHERE a.layer_id = l.id)
+            FROM wfs_layers l
+        ''')
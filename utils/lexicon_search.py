@@ -0,0 +1,82 @@
+from utils.german_text import normalize_text
+
+# Gewichte der Indexspalten für bm25 (name, cleaned_name, title, description, ai_description, attributes)
+COLUMN_WEIGHTS = (5.0, 5.0, 4.0, 1.0, 1.0, 2.0)
+
+LAYER_COLUMNS = (
+    'id', 'name', 'cleaned_name', 'title', 'description', 'ai_description',
+    'source_url', 'source_type', 'state', 'stale', 'created_at', 'last_updated'
+)
+
+
+def build_match_query(text):
+    """
+    Wandelt eine Benutzereingabe in eine FTS5-Abfrage um: jedes Wort wird wie der
+    Index gefaltet und gestemmt und als Präfix gesucht, alle Wörter müssen vorkommen
+    """
+    terms = normalize_text(text).split()
+    return ' AND '.join(f'"{term}"*' for term in terms)
+
+
+def refresh_attribute_index(conn, layer_keys):
+    """
+    Schreibt die Attributnamen der Layer (name, source_url) neu in den Volltextindex.
+    Aufzurufen nach dem Schreiben der Attribute, in derselben Transaktion.
+    """
+    conn.executemany('''
+        UPDATE lexicon_fts
+        SET attributes = (
+            SELECT lexicon_normalize(group_concat(a.name, ' '))
+            FROM layer_attributes a WHERE a.layer_id = lexicon_fts.rowid
+        )
+        WHERE rowid = (SELECT id FROM wfs_layers WHERE name = ? AND source_url = ?)
+    ''', list(dict.fromkeys(layer_keys)))
+
+
+def _filters(state=None, source_type=None, source_url=None, include_stale=False):
+    clauses, params = [], []
+    if not include_stale:
+        clauses.append('l.stale = 0')
+    for column, value in (('l.state', state), ('l.source_type', source_type), ('l.source_url', source_url)):
+        if value:
+            clauses.append(f'{column} = ?')
+            params.append(value)
+    return ''.join(f' AND {clause}' for clause in clauses), params
+
+
+def search_layers(conn, text, limit=20, offset=0, state=None, source_type=None, source_url=None,
+                  include_stale=False):
+    """
+    Durchsucht das Lexikon nach Relevanz sortiert, veraltete Layer nur mit include_stale.
+    Gibt (Treffer, Gesamtanzahl) zurück; jeder Treffer ist ein Dictionary mit Rang.
+    """
+    match = build_match_query(text)
+    if not match:
+        return [], 0
+
+    filter_sql, filter_params = _filters(state, source_type, source_url, include_stale)
+    weights = ', '.join(str(weight) for weight in COLUMN_WEIGHTS)
+    columns = ', '.join(f'l.{column}' for column in LAYER_COLUMNS)
+
+    rows = conn.execute(f'''
+        SELECT {columns}, bm25(lexicon_fts, {weights}) AS rank
+        FROM lexicon_fts
+        JOIN wfs_layers l ON l.id = lexicon_fts.rowid
+        WHERE lexicon_fts MATCH ?{filter_sql}
+        ORDER BY rank
+        LIMIT ? OFFSET ?
+    ''', [match, *filter_params, limit, offset]).fetchall()
+
+    total = conn.execute(f'''
+        SELECT COUNT(*)
+        FROM lexicon_fts
+        JOIN wfs_layers l ON l.id = lexicon_fts.rowid
+        WHERE lexicon_fts MATCH ?{filter_sql}
+    ''', [match, *filter_params]).fetchone()[0]
+
+    results = []
+    for row in rows:
+        result = dict(zip(LAYER_COLUMNS, row))
+        result['rank'] = row[-1]
+        results.append(result)
+    return results, total
@@ -0,0 +1,171 @@
+import hashlib
+import json
+
+from utils.enrichment_queue import enqueue_layers
+from utils.lexicon_extents import store_layer_extents, update_service_extent
+from utils.lexicon_search import refresh_attribute_index
+
+
+def _digest(data):
+    return hashlib.sha256(
+        json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    ).hexdigest()
+
+
+def _schema(layer):
+    return sorted([attr['name'], attr.get('type', '')] for attr in layer.get('attributes') or [])
+
+
+def schema_missing(layer):
+    """True, wenn das Schema (DescribeFeatureType) eines Layers nicht geladen werden konnte"""
+    return 'attributes' in layer and layer['attributes'] is None
+
+
+def capabilities_fingerprint(service_info, layers):
+    """
+    Hash über den Inhalt eines Dienstes (Dienst-Informationen sowie Name, Titel, Beschreibung,
+    Ausdehnung und Schema aller Layer). Anders als der Hash des Dienst-Monitors hängt er nicht
+    von Formatierung, Reihenfolge oder Zeitstempeln (updateSequence) im Dokument ab.
+    """
+    return _digest({
+        'title': service_info.get('title'),
+        'abstract': service_info.get('abstract'),
+        'layers': sorted(
+            [layer['name'], layer.get('title'), layer.get('description'), layer.get('bbox'), _schema(layer)]
+            for layer in layers
+        )
+    })
+
+
+def layer_fingerprint(layer):
+    """Hash über Name, Titel, Beschreibung und Schema (Attributnamen und -typen) eines Layers"""
+    return _digest({
+        'name': layer['name'],
+        'title': layer.get('title'),
+        'description': layer.get('description'),
+        'attributes': _schema(layer)
+    })
+
+
+def load_service_fingerprint(conn, url, service_type):
+    """Gespeicherter Inhalts-Hash eines Dienstes oder None"""
+    row = conn.execute(
+        'SELECT content_hash FROM services WHERE url = ? AND type = ?', (url, service_type)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def sync_service(conn, url, service_type, state, service_info, layers, content_hash):
+    """
+    Gleicht die Layer eines Dienstes mit dem Lexikon ab (im with-Block des Aufrufers).
+    Nur neue oder geänderte Layer werden geschrieben und erneut zur KI-Anreicherung
+    eingereiht; Layer, die der Dienst nicht mehr anbietet, werden als veraltet markiert.
+    Layer ohne geladenes Schema (attributes = None) behalten Hash und Attribute; der Hash des
+    Dienstes wird nur gespeichert, wenn content_hash nicht None ist.
+    Gibt die Anzahl neuer, geänderter, unveränderter und entfernter Layer zurück.
+    """
+    stored = {
+        name: (layer_hash, stale)
+        for name, layer_hash, stale in conn.execute(
+            'SELECT name, content_hash, stale FROM wfs_layers WHERE source_url = ?', (url,)
+        )
+    }
+
+    new, changed, modified = [], [], []
+    for layer in layers:
+        if schema_missing(layer):
+            # Ohne Schema lässt sich der Layer nicht vergleichen: neu anlegen bzw. nur reaktivieren
+            layer['content_hash'] = None
+            if layer['name'] not in stored:
+                new.append(layer)
+            elif stored[layer['name']][1]:
+                changed.append(layer)
+            continue
+        layer['content_hash'] = layer_fingerprint(layer)
+        if layer['name'] not in stored:
+            new.append(layer)
+            continue
+        stored_hash, stale = stored[layer['name']]
+        if stored_hash != layer['content_hash'] or stale:
+            changed.append(layer)
+        # Ohne gespeicherten Hash (vor dem ersten Abgleich importiert) gilt der Inhalt als bekannt
+        if stored_hash is not None and stored_hash != layer['content_hash']:
+            modified.append(layer)
+
+    current = {layer['name'] for layer in layers}
+    removed = [
+        (name, url) for name, (_, stale) in stored.items()
+        if name not in current and not stale
+    ]
+
+    upserts = new + changed
+    conn.executemany('''
+        INSERT INTO wfs_layers (
+            name, title, description, source_url, source_type, state,
+            content_hash, stale, created_at, last_updated
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, 0, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+        ON CONFLICT(name, source_url) DO UPDATE SET
+            title = excluded.title,
+            description = excluded.description,
+            state = excluded.state,
+            content_hash = COALESCE(excluded.content_hash, wfs_layers.content_hash),
+            stale = 0,
+            stale_since = NULL,
+            last_updated = CURRENT_TIMESTAMP
+    ''', [
+        (layer['name'], layer['title'], layer['description'], url, service_type, state, layer['content_hash'])
+        for layer in upserts
+    ])
+
+    # Schema geänderter Layer ersetzen: fehlende Attribute entfernen, übrige per Upsert schreiben
+    for layer in changed:
+        if schema_missing(layer):
+            continue
+        names = [attr['name'] for attr in layer.get('attributes') or []]
+        dropped = f'''
+            SELECT id FROM layer_attributes
+            WHERE layer_id = (SELECT id FROM wfs_layers WHERE name = ? AND source_url = ?)
+              AND name NOT IN ({', '.join('?' * len(names))})
+        '''
+        params = [layer['name'], url, *names]
+        conn.execute(f'DELETE FROM attribute_values WHERE attribute_id IN ({dropped})', params)
+        conn.execute(f'DELETE FROM layer_attributes WHERE id IN ({dropped})', params)
+
+    conn.executemany('''
+        INSERT INTO layer_attributes (layer_id, name, type, description)
+        SELECT id, ?, ?, ? FROM wfs_layers WHERE name = ? AND source_url = ?
+        ON CONFLICT(layer_id, name) DO UPDATE SET
+            type = excluded.type,
+            description = excluded.description
+    ''', [
+        (attr['name'], attr.get('type', ''), attr.get('description', ''), layer['name'], url)
+        for layer in upserts
+        for attr in layer.get('attributes') or []
+    ])
+    refresh_attribute_index(conn, [(layer['name'], url) for layer in upserts])
+
+    conn.executemany('''
+        UPDATE wfs_layers SET stale = 1, stale_since = CURRENT_TIMESTAMP
+        WHERE name = ? AND source_url = ?
+    ''', removed)
+
+    # Ausdehnungen gehen nicht in den Layer-Hash ein und werden immer übernommen
+    # Veraltete Layer behalten ihre Ausdehnung, Abfragen blenden sie über wfs_layers.stale aus
+    store_layer_extents(conn, [(layer['name'], url, layer.get('bbox')) for layer in layers])
+    update_service_extent(conn, url, service_type)
+
+    enqueue_layers(conn, [(layer['name'], url) for layer in upserts])
+    enqueue_layers(conn, [(layer['name'], url) for layer in modified], force=True)
+
+    if content_hash is not None:
+        conn.execute(
+            'UPDATE services SET content_hash = ? WHERE url = ? AND type = ?',
+            (content_hash, url, service_type)
+        )
+
+    return {
+        'new': len(new),
+        'changed': len(changed),
+        'unchanged': len(layers) - len(upserts),
+        'removed': len(removed)
+    }
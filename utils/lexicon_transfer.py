@@ -0,0 +1,369 @@
+import argparse
+import json
+import logging
+import os
+
+from utils.enrichment_queue import enqueue_layers
+from utils.lexicon_db import get_lexicon_db
+from utils.lexicon_extents import store_layer_extents, update_service_extent
+from utils.lexicon_schema import init_lexicon_schema
+from utils.lexicon_search import refresh_attribute_index
+
+logger = logging.getLogger(__name__)
+
+# Zeilen pro Block beim Lesen und Schreiben; der Speicherbedarf hängt nur hiervon ab
+CHUNK_SIZE = 5000
+
+FORMATS = {'ndjson': '.ndjson', 'parquet': '.parquet'}
+
+# Exportierte Spalten je Tabelle. IDs unterscheiden sich zwischen den Instanzen, daher werden
+# Layer über (name, source_url), Attribute über ihren Layer und Services über (url, type) zugeordnet.
+# Die Ausdehnung eines Layers (R-Tree layer_extents) wird mit dem Layer exportiert.
+TABLES = {
+    'wfs_layers': {
+        'columns': (
+            ('name', 'text'), ('cleaned_name', 'text'), ('title', 'text'), ('description', 'text'),
+            ('ai_description', 'text'), ('source_url', 'text'), ('source_type', 'text'),
+            ('state', 'text'), ('created_at', 'text'), ('last_updated', 'text'),
+            ('stale', 'integer'), ('stale_since', 'text'),
+            ('min_x', 'real'), ('min_y', 'real'), ('max_x', 'real'), ('max_y', 'real')
+        ),
+        # Veraltete Layer nur mit include_stale; ein inkrementeller Export enthält aber die seit
+        # 'since' veralteten Layer, damit das Ziel sie ebenfalls als veraltet markiert
+        'select': '''
+            SELECT l.id, l.name, l.cleaned_name, l.title, l.description, l.ai_description,
+                   l.source_url, l.source_type, l.state, l.created_at, l.last_updated,
+                   l.stale, l.stale_since, e.min_x, e.min_y, e.max_x, e.max_y
+            FROM wfs_layers l
+            LEFT JOIN layer_extents e ON e.id = l.id
+            WHERE l.id > :last_id
+              AND (:since IS NULL OR l.last_updated >= :since OR l.stale_since >= :since)
+              AND (l.stale = 0 OR :include_stale OR l.stale_since >= :since)
+            ORDER BY l.id
+            LIMIT :limit
+        ''',
+        # Neuere lokale Stände werden nicht überschrieben, vorhandene KI-Daten bleiben erhalten
+        'upsert': '''
+            INSERT INTO wfs_layers (
+                name, cleaned_name, title, description, ai_description,
+                source_url, source_type, state, created_at, last_updated, stale, stale_since
+            ) VALUES (
+                :name, :cleaned_name, :title, :description, :ai_description,
+                :source_url, :source_type, :state,
+                COALESCE(:created_at, CURRENT_TIMESTAMP), COALESCE(:last_updated, CURRENT_TIMESTAMP),
+                COALESCE(:stale, 0), :stale_since
+            )
+            ON CONFLICT(name, source_url) DO UPDATE SET
+                cleaned_name = COALESCE(excluded.cleaned_name, wfs_layers.cleaned_name),
+                title = excluded.title,
+                description = excluded.description,
+                ai_description = COALESCE(excluded.ai_description, wfs_layers.ai_description),
+                source_type = excluded.source_type,
+                state = excluded.state,
+                last_updated = excluded.last_updated,
+                stale = excluded.stale,
+                stale_since = excluded.stale_since
+            WHERE wfs_layers.last_updated IS NULL OR excluded.last_updated >= wfs_layers.last_updated
+        '''
+    },
+    'layer_attributes': {
+        'columns': (
+            ('layer_name', 'text'), ('layer_source_url', 'text'), ('name', 'text'), ('type', 'text'),
+            ('description', 'text'), ('value_count', 'integer'), ('null_count', 'integer'),
+            ('distinct_count', 'integer'), ('distinct_exact', 'integer'), ('profiled_at', 'text')
+        ),
+        'select': '''
+            SELECT a.id, l.name, l.source_url, a.name, a.type, a.description,
+                   a.value_count, a.null_count, a.distinct_count, a.distinct_exact, a.profiled_at
+            FROM layer_attributes a
+            JOIN wfs_layers l ON l.id = a.layer_id
+            WHERE a.id > :last_id AND (:since IS NULL OR l.last_updated >= :since OR a.profiled_at >= :since)
+              AND (l.stale = 0 OR :include_stale)
+            ORDER BY a.id
+            LIMIT :limit
+        ''',
+        'upsert': '''
+            INSERT INTO layer_attributes (
+                layer_id, name, type, description,
+                value_count, null_count, distinct_count, distinct_exact, profiled_at
+            )
+            SELECT id, :name, :type, :description,
+                   :value_count, :null_count, :distinct_count, :distinct_exact, :profiled_at
+            FROM wfs_layers
+            WHERE name = :layer_name AND source_url = :layer_source_url
+            ON CONFLICT(layer_id, name) DO UPDATE SET
+                type = excluded.type,
+                description = excluded.description,
+                value_count = COALESCE(excluded.value_count, layer_attributes.value_count),
+                null_count = COALESCE(excluded.null_count, layer_attributes.null_count),
+                distinct_count = COALESCE(excluded.distinct_count, layer_attributes.distinct_count),
+                distinct_exact = COALESCE(excluded.distinct_exact, layer_attributes.distinct_exact),
+                profiled_at = COALESCE(excluded.profiled_at, layer_attributes.profiled_at)
+        '''
+    },
+    'services': {
+        'columns': (
+            ('url', 'text'), ('type', 'text'), ('title', 'text'), ('description', 'text'),
+            ('state', 'text'), ('status', 'text'), ('last_checked', 'text'), ('created_at', 'text'),
+            ('etag', 'text'), ('last_modified', 'text'), ('capabilities_hash', 'text'),
+            ('capabilities_checked', 'text'), ('sample_layer', 'text'), ('preferred_version', 'text'),
+            ('preferred_format', 'text'), ('availability', 'real'), ('latency_p50', 'integer'),
+            ('latency_p95', 'integer')
+        ),
+        'select': '''
+            SELECT id, url, type, title, description, state, status, last_checked, created_at,
+                   etag, last_modified, capabilities_hash, capabilities_checked, sample_layer,
+                   preferred_version, preferred_format, availability, latency_p50, latency_p95
+            FROM services
+            WHERE id > :last_id AND (:since IS NULL OR last_checked >= :since OR created_at >= :since)
+            ORDER BY id
+            LIMIT :limit
+        ''',
+        'upsert': '''
+            INSERT INTO services (
+                url, type, title, description, state, status, last_checked, created_at,
+                etag, last_modified, capabilities_hash, capabilities_checked, sample_layer,
+                preferred_version, preferred_format, availability, latency_p50, latency_p95
+            ) VALUES (
+                :url, :type, :title, :description, :state, COALESCE(:status, 'active'), :last_checked,
+                COALESCE(:created_at, CURRENT_TIMESTAMP),
+                :etag, :last_modified, :capabilities_hash, :capabilities_checked, :sample_layer,
+                :preferred_version, :preferred_format, :availability, :latency_p50, :latency_p95
+            )
+            ON CONFLICT(url, type) DO UPDATE SET
+                title = excluded.title,
+                description = excluded.description,
+                state = excluded.state,
+                status = excluded.status,
+                last_checked = excluded.last_checked,
+                etag = excluded.etag,
+                last_modified = excluded.last_modified,
+                capabilities_hash = excluded.capabilities_hash,
+                capabilities_checked = excluded.capabilities_checked,
+                sample_layer = excluded.sample_layer,
+                preferred_version = excluded.preferred_version,
+                preferred_format = excluded.preferred_format,
+                availability = excluded.availability,
+                latency_p50 = excluded.latency_p50,
+                latency_p95 = excluded.latency_p95
+            WHERE services.last_checked IS NULL OR excluded.last_checked >= services.last_checked
+        '''
+    }
+}
+
+# Reihenfolge beim Import: Attribute brauchen ihre Layer
+TABLE_ORDER = ('wfs_layers', 'layer_attributes', 'services')
+
+
+def _column_names(table):
+    return [name for name, _ in TABLES[table]['columns']]
+
+
+def _normalize_timestamp(value):
+    """Bringt ISO-Zeitangaben (2024-05-01T12:00:00) in die Form von CURRENT_TIMESTAMP"""
+    return value.replace('T', ' ').rstrip('Z') if value else None
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError('Für Parquet wird das Paket pyarrow benötigt (pip install pyarrow)')
+    return pyarrow, pyarrow.parquet
+
+
+def iter_chunks(conn, table, since=None, chunk_size=CHUNK_SIZE, include_stale=False):
+    """Liest eine Tabelle blockweise über die ID (Keyset), jeder Block ist eine Liste von Dictionaries"""
+    columns = _column_names(table)
+    last_id = 0
+    params = {'since': since, 'limit': chunk_size, 'include_stale': int(include_stale)}
+    while True:
+        rows = conn.execute(TABLES[table]['select'], {**params, 'last_id': last_id}).fetchall()
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        yield [dict(zip(columns, row[1:])) for row in rows]
+
+
+class _NDJSONWriter:
+    def __init__(self, path, table):
+        self.file = open(path, 'w', encoding='utf-8')
+
+    def write(self, rows):
+        self.file.writelines(json.dumps(row, ensure_ascii=False) + '\n' for row in rows)
+
+    def close(self):
+        self.file.close()
+
+
+class _ParquetWriter:
+    def __init__(self, path, table):
+        pa, pq = _require_pyarrow()
+        types = {'text': pa.string(), 'integer': pa.int64(), 'real': pa.float64()}
+        self.pa = pa
+        self.schema = pa.schema([(name, types[kind]) for name, kind in TABLES[table]['columns']])
+        self.writer = pq.ParquetWriter(path, self.schema, compression='zstd')
+
+    def write(self, rows):
+        self.writer.write_table(self.pa.Table.from_pylist(rows, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def export_lexicon(db_path, out_dir, fmt='ndjson', since=None, chunk_size=CHUNK_SIZE, tables=TABLE_ORDER,
+                   include_stale=False):
+    """
+    Exportiert das Lexikon als eine Datei pro Tabelle nach out_dir.
+    Alle Tabellen werden aus demselben Lesestand exportiert; mit 'since' nur Zeilen,
+    die seitdem geändert wurden. Veraltete Layer werden nur mit include_stale exportiert.
+    Gibt das Manifest mit Zeilenzahlen und Exportzeitpunkt zurück.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f'Unbekanntes Format: {fmt}')
+    if fmt == 'parquet':
+        _require_pyarrow()
+    writer_class = _ParquetWriter if fmt == 'parquet' else _NDJSONWriter
+    since = _normalize_timestamp(since)
+    os.makedirs(out_dir, exist_ok=True)
+
+    lexicon_db = get_lexicon_db(db_path)
+    with lexicon_db.connection() as conn:
+        # Eine Lesetransaktion für alle Tabellen, parallele Importe verschieben den Stand nicht
+        conn.execute('BEGIN')
+        exported_at = conn.execute('SELECT CURRENT_TIMESTAMP').fetchone()[0]
+
+        counts = {}
+        for table in tables:
+            path = os.path.join(out_dir, table + FORMATS[fmt])
+            writer = writer_class(path, table)
+            counts[table] = 0
+            try:
+                for rows in iter_chunks(conn, table, since, chunk_size, include_stale):
+                    writer.write(rows)
+                    counts[table] += len(rows)
+            finally:
+                writer.close()
+            logger.info(f'{table}: {counts[table]} Zeilen exportiert')
+
+    manifest = {
+        'format': fmt,
+        'exported_at': exported_at,
+        'since': since,
+        'include_stale': include_stale,
+        'tables': counts
+    }
+    with open(os.path.join(out_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def _read_ndjson(path, chunk_size):
+    chunk = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                chunk.append(json.loads(line))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def _read_parquet(path, chunk_size):
+    _, pq = _require_pyarrow()
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+        yield batch.to_pylist()
+
+
+def _find_table_file(in_dir, table):
+    for fmt, extension in FORMATS.items():
+        path = os.path.join(in_dir, table + extension)
+        if os.path.exists(path):
+            return path, fmt
+    return None, None
+
+
+def import_lexicon(db_path, in_dir, chunk_size=CHUNK_SIZE, enqueue=True):
+    """
+    Importiert einen Export aus in_dir per Upsert, eine Transaktion pro Block.
+    Layer ohne bereinigten Namen oder KI-Beschreibung werden zur Anreicherung eingereiht.
+    Die Ausdehnungen der Layer gehen in den R-Tree, die der Dienste werden nach dem Import
+    aller Tabellen neu berechnet. Gibt die Anzahl gelesener Zeilen je Tabelle zurück.
+    """
+    lexicon_db = get_lexicon_db(db_path)
+    with lexicon_db.transaction() as conn:
+        init_lexicon_schema(conn.cursor())
+
+    counts = {}
+    source_urls = set()
+    for table in TABLE_ORDER:
+        path, fmt = _find_table_file(in_dir, table)
+        if path is None:
+            continue
+
+        reader = _read_parquet if fmt == 'parquet' else _read_ndjson
+        columns = _column_names(table)
+        counts[table] = 0
+        for chunk in reader(path, chunk_size):
+            # Fehlende Spalten (ältere Exporte) als NULL übernehmen
+            rows = [{column: row.get(column) for column in columns} for row in chunk]
+            with lexicon_db.transaction() as conn:
+                conn.executemany(TABLES[table]['upsert'], rows)
+                if table == 'wfs_layers':
+                    store_layer_extents(conn, [
+                        (row['name'], row['source_url'], (row['min_x'], row['min_y'], row['max_x'], row['max_y']))
+                        for row in rows
+                    ])
+                    source_urls.update(row['source_url'] for row in rows)
+                    if enqueue:
+                        enqueue_layers(conn, [(row['name'], row['source_url']) for row in rows])
+                if table == 'layer_attributes':
+                    refresh_attribute_index(conn, [(row['layer_name'], row['layer_source_url']) for row in rows])
+            counts[table] += len(rows)
+        logger.info(f'{table}: {counts[table]} Zeilen importiert')
+
+    # Erst jetzt sind auch die Dienste importiert, zu denen die Ausdehnungen gehören
+    if source_urls:
+        with lexicon_db.transaction() as conn:
+            for source_url in source_urls:
+                update_service_extent(conn, source_url)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export und Import des Daten-Lexikons als NDJSON oder Parquet')
+    parser.add_argument('--db', default='database/development_lexicon.db', help='Pfad zur Lexikon-Datenbank')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Zeilen pro Block')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = commands.add_parser('export', help='Lexikon in ein Verzeichnis exportieren')
+    export_parser.add_argument('out_dir', help='Zielverzeichnis (eine Datei pro Tabelle und manifest.json)')
+    export_parser.add_argument('--format', choices=sorted(FORMATS), default='ndjson', help='Dateiformat')
+    export_parser.add_argument('--since', help='Nur seit diesem Zeitpunkt geänderte Zeilen, z.B. exported_at eines früheren Exports')
+    export_parser.add_argument('--include-stale', action='store_true', help='Auch veraltete, vom Dienst nicht mehr angebotene Layer exportieren')
+
+    import_parser = commands.add_parser('import', help='Export in die Datenbank übernehmen')
+    import_parser.add_argument('in_dir', help='Verzeichnis eines Exports')
+    import_parser.add_argument('--no-enrichment', action='store_true', help='Importierte Layer nicht zur KI-Anreicherung einreihen')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if args.command == 'export':
+        manifest = export_lexicon(
+            args.db, args.out_dir, args.format, args.since, args.chunk_size, include_stale=args.include_stale
+        )
+        for table, count in manifest['tables'].items():
+            print(f'{table}: {count} Zeilen')
+        print(f"Stand: {manifest['exported_at']} (für den nächsten inkrementellen Export: --since '{manifest['exported_at']}')")
+    else:
+        counts = import_lexicon(args.db, args.in_dir, args.chunk_size, enqueue=not args.no_enrichment)
+        for table, count in counts.items():
+            print(f'{table}: {count} Zeilen')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+from threading import Lock
+
+from utils.lexicon_db import get_lexicon_db
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CACHE_PATH = os.getenv('LLM_CACHE_PATH', os.path.join(PROJECT_ROOT, 'data', 'cache', 'llm_cache.db'))
+
+# Nach so vielen neuen Einträgen wird die Größe geprüft und ggf. aufgeräumt
+EVICTION_CHECK_INTERVAL = 100
+
+# Zugriffe (last_used, hits) werden gesammelt und gemeinsam geschrieben, sobald so viele
+# Einträge oder so viele Sekunden seit dem letzten Schreiben zusammengekommen sind
+TOUCH_FLUSH_SIZE = 100
+TOUCH_FLUSH_INTERVAL = 30
+
+WHITESPACE = re.compile(r'\s+')
+
+_cache = None
+_cache_lock = Lock()
+
+
+def template_hash(*parts):
+    """Hash der Prompt-Vorlage (System-Prompt, Vorlage der Benutzernachricht, ...)"""
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+
+def normalize_input(value):
+    """
+    Vereinheitlicht die Eingabe für den Schlüssel: Unicode-Normalform NFC und
+    zusammengefasste Leerzeichen; Listen und Dictionaries werden als JSON kanonisiert
+    """
+    if not isinstance(value, str):
+        value = json.dumps(value, ensure_ascii=False, sort_keys=True)
+    return WHITESPACE.sub(' ', unicodedata.normalize('NFC', value)).strip()
+
+
+class LLMCache:
+    """
+    Persistenter Cache für KI-Antworten in SQLite.
+    Schlüssel ist (Modell, Temperatur, Hash der Prompt-Vorlage, normalisierte Eingabe).
+    Einträge verfallen nach 'ttl' Sekunden; über 'max_entries' hinaus werden die am
+    längsten nicht genutzten Einträge entfernt. Lesende Zugriffe brauchen keine
+    Schreibsperre, die Nutzungszeiten werden gesammelt nachgetragen.
+    """
+
+    def __init__(self, db_path=DEFAULT_CACHE_PATH, ttl=30 * 24 * 3600, max_entries=100000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.db = get_lexicon_db(db_path)
+        self.metrics = {'hits': 0, 'misses': 0, 'expired': 0, 'stores': 0, 'evictions': 0}
+        self.metrics_lock = Lock()
+        self._stores_since_check = 0
+        self._touched = {}
+        self._touched_since = time.time()
+        self._touch_lock = Lock()
+
+        with self.db.transaction() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    template_hash TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache (last_used)')
+
+    def _count(self, metric, amount=1):
+        with self.metrics_lock:
+            self.metrics[metric] += amount
+
+    @staticmethod
+    def make_key(model, temperature, prompt_hash, value):
+        return hashlib.sha256(json.dumps(
+            [model, round(float(temperature), 4), prompt_hash, normalize_input(value)],
+            ensure_ascii=False
+        ).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+        Gibt die gespeicherte Antwort zurück oder None (auch bei abgelaufenen Einträgen,
+        die evict() entfernt). Liest ohne Schreibtransaktion.
+        """
+        now = time.time()
+        with self.db.connection() as conn:
+            row = conn.execute('SELECT response, created_at FROM llm_cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self._count('misses')
+            return None
+        if now - row[1] > self.ttl:
+            self._count('expired')
+            self._count('misses')
+            return None
+
+        self._count('hits')
+        self._touch(key, now)
+        return json.loads(row[0])
+
+    def _touch(self, key, now):
+        with self._touch_lock:
+            hits = self._touched.get(key, (now, 0))[1]
+            self._touched[key] = (now, hits + 1)
+            flush = len(self._touched) >= TOUCH_FLUSH_SIZE or now - self._touched_since >= TOUCH_FLUSH_INTERVAL
+        if flush:
+            try:
+                self.flush_touches()
+            except sqlite3.Error as e:
+                logger.warning(f"Nutzung der KI-Cache-Einträge nicht gespeichert: {str(e)}")
+
+    def flush_touches(self):
+        """Schreibt gesammelte Zugriffe (last_used, hits) in einer Transaktion"""
+        with self._touch_lock:
+            touched, self._touched = self._touched, {}
+            self._touched_since = time.time()
+        if not touched:
+            return
+        with self.db.transaction() as conn:
+            conn.executemany(
+                'UPDATE llm_cache SET last_used = MAX(last_used, ?), hits = hits + ? WHERE key = ?',
+                [(last_used, hits, key) for key, (last_used, hits) in touched.items()]
+            )
+
+    def set(self, key, model, prompt_hash, response):
+        now = time.time()
+        with self.db.transaction() as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO llm_cache (key, model, template_hash, response, created_at, last_used, hits)
+                VALUES (?, ?, ?, ?, ?, ?, 0)
+            ''', (key, model, prompt_hash, json.dumps(response, ensure_ascii=False), now, now))
+
+        with self.metrics_lock:
+            self.metrics['stores'] += 1
+            self._stores_since_check += 1
+            check = self._stores_since_check >= EVICTION_CHECK_INTERVAL
+            if check:
+                self._stores_since_check = 0
+        if check:
+            self.evict()
+
+    def evict(self):
+        """Entfernt abgelaufene Einträge und kürzt den Cache auf max_entries (LRU)"""
+        # Gesammelte Zugriffe zuerst schreiben, damit die LRU-Reihenfolge stimmt
+        self.flush_touches()
+        with self.db.transaction() as conn:
+            expired = conn.execute('DELETE FROM llm_cache WHERE created_at < ?', (time.time() - self.ttl,)).rowcount
+            excess = conn.execute('SELECT COUNT(*) FROM llm_cache').fetchone()[0] - self.max_entries
+            removed = 0
+            if excess > 0:
+                removed = conn.execute('''
+                    DELETE FROM llm_cache WHERE key IN (
+                        SELECT key FROM llm_cache ORDER BY last_used LIMIT ?
+                    )
+                ''', (excess,)).rowcount
+        self._count('expired', expired)
+        self._count('evictions', removed)
+
+    def cached(self, model, temperature, prompt_hash, value, compute):
+        """
+        Liefert die Antwort aus dem Cache oder ruft compute() auf und speichert das Ergebnis.
+        Ausnahmen von compute() werden nicht gespeichert, sondern weitergereicht.
+        """
+        key = self.make_key(model, temperature, prompt_hash, value)
+        try:
+            response = self.get(key)
+        except Exception as e:
+            logger.warning(f"KI-Cache nicht lesbar: {str(e)}")
+            return compute()
+        if response is not None:
+            return response
+
+        response = compute()
+        if response is not None:
+            try:
+                self.set(key, model, prompt_hash, response)
+            except Exception as e:
+                logger.warning(f"KI-Antwort nicht zwischengespeichert: {str(e)}")
+        return response
+
+    def stats(self):
+        """Trefferquote und Größe des Caches"""
+        with self.metrics_lock:
+            stats = dict(self.metrics)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else None
+        with self.db.connection() as conn:
+            stats['entries'] = conn.execute('SELECT COUNT(*) FROM llm_cache').fetchone()[0]
+        return stats
+
+
+def get_llm_cache():
+    """Gibt den gemeinsamen KI-Cache zurück"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = LLMCache()
+    return _cache
@@ -0,0 +1,192 @@
+import logging
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore, Lock
+
+logger = logging.getLogger(__name__)
+
+# Grobe Schätzung für das Token-Budget, falls keine genauere Zählung vorliegt
+CHARS_PER_TOKEN = 4
+
+# Angenommene Antwortlänge, wenn eine Anfrage kein max_tokens setzt
+DEFAULT_COMPLETION_TOKENS = 500
+
+_dispatcher = None
+_dispatcher_lock = Lock()
+
+
+def estimate_tokens(*texts, completion_tokens=DEFAULT_COMPLETION_TOKENS):
+    """Schätzt den Token-Verbrauch einer Anfrage (Prompt-Texte plus erwartete Antwort)"""
+    return sum(len(text or '') for text in texts) // CHARS_PER_TOKEN + completion_tokens
+
+
+def is_rate_limit_error(error):
+    """Erkennt 429-Antworten der OpenAI-Clients (openai 0.x und 1.x, langchain)"""
+    if type(error).__name__ == 'RateLimitError':
+        return True
+    for attribute in ('status_code', 'http_status'):
+        if getattr(error, attribute, None) == 429:
+            return True
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None) == 429
+
+
+def _retry_after(error):
+    """Wartezeit aus dem Retry-After-Header einer 429-Antwort in Sekunden oder None"""
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Budget pro Minute, das sich kontinuierlich auffüllt; acquire() wartet, bis genug vorhanden ist"""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount=1):
+        """Entnimmt 'amount' Tokens; gibt die Wartezeit in Sekunden zurück"""
+        # Größere Anfragen als das Minutenbudget dürfen nicht ewig warten
+        amount = min(float(amount), self.capacity)
+        waited = 0.0
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+class LLMDispatcher:
+    """
+    Führt KI-Anfragen nebenläufig aus.
+    Höchstens 'max_in_flight' Anfragen laufen gleichzeitig; Anfragen pro Minute und
+    Tokens pro Minute werden über Token-Buckets begrenzt. Antworten mit Status 429
+    werden mit exponentiell wachsender, zufällig gestreuter Wartezeit wiederholt.
+    """
+
+    def __init__(self, max_in_flight=4, requests_per_minute=500, tokens_per_minute=90000,
+                 max_retries=5, base_delay=1.0, max_delay=60.0, max_workers=None):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.in_flight = BoundedSemaphore(max_in_flight)
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        # Mehr Worker als gleichzeitige Anfragen, damit Cache-Treffer nicht warten müssen
+        self.max_workers = max_workers or max_in_flight * 2
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='llm')
+        self.metrics = {'requests': 0, 'rate_limited': 0, 'retries': 0, 'failures': 0, 'throttled_seconds': 0.0}
+        self.metrics_lock = Lock()
+
+    def _count(self, metric, amount=1):
+        with self.metrics_lock:
+            self.metrics[metric] += amount
+
+    def _backoff(self, attempt, error):
+        delay = _retry_after(error)
+        if delay is None:
+            delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+            # Gestreute Wartezeit, damit wartende Threads nicht gleichzeitig erneut anfragen
+            delay = delay / 2 + random.uniform(0, delay / 2)
+        return delay
+
+    def call(self, fn, tokens=0):
+        """
+        Führt eine einzelne API-Anfrage fn() im aufrufenden Thread aus, sobald Budget und
+        ein freier Platz vorhanden sind. 'tokens' ist der geschätzte Token-Verbrauch.
+        """
+        attempt = 0
+        while True:
+            throttled = self.request_bucket.acquire(1) + self.token_bucket.acquire(tokens)
+            if throttled:
+                self._count('throttled_seconds', throttled)
+
+            with self.in_flight:
+                self._count('requests')
+                try:
+                    return fn()
+                except Exception as e:
+                    if not is_rate_limit_error(e):
+                        self._count('failures')
+                        raise
+                    error = e
+
+            self._count('rate_limited')
+            if attempt >= self.max_retries:
+                self._count('failures')
+                raise error
+            delay = self._backoff(attempt, error)
+            attempt += 1
+            self._count('retries')
+            logger.warning(f'KI-Ratenlimit erreicht, Versuch {attempt} von {self.max_retries} in {delay:.1f}s')
+            time.sleep(delay)
+
+    def submit(self, fn, *args, **kwargs):
+        """Startet fn(*args, **kwargs) im Hintergrund und gibt ein Future zurück"""
+        return self.executor.submit(fn, *args, **kwargs)
+
+    def map(self, fn, items, return_exceptions=False):
+        """
+        Wendet fn nebenläufig auf alle Elemente an und gibt die Ergebnisse in der
+        Reihenfolge der Eingabe zurück. Mit return_exceptions stehen Fehler als
+        Exception-Objekt an der Stelle des Ergebnisses, sonst wird der erste Fehler weitergereicht.
+        fn läuft in eigenen Threads dieses Aufrufs, nicht im gemeinsamen Executor: verschachtelte
+        oder viele gleichzeitige map-Aufrufe können sich so nicht gegenseitig blockieren.
+        Die Begrenzung der API-Anfragen übernimmt call().
+        """
+        items = list(items)
+        if not items:
+            return []
+
+        results = []
+        with ThreadPoolExecutor(
+            max_workers=min(len(items), self.max_workers), thread_name_prefix='llm-map'
+        ) as executor:
+            futures = [executor.submit(fn, item) for item in items]
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    if not return_exceptions:
+                        for pending in futures:
+                            pending.cancel()
+                        raise
+                    results.append(e)
+        return results
+
+    def stats(self):
+        with self.metrics_lock:
+            stats = dict(self.metrics)
+        stats['throttled_seconds'] = round(stats['throttled_seconds'], 1)
+        return stats
+
+
+def get_llm_dispatcher():
+    """Gibt den gemeinsamen Dispatcher zurück (Limits über LLM_MAX_IN_FLIGHT, LLM_RPM, LLM_TPM)"""
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = LLMDispatcher(
+                    max_in_flight=int(os.getenv('LLM_MAX_IN_FLIGHT', '4')),
+                    requests_per_minute=int(os.getenv('LLM_RPM', '500')),
+                    tokens_per_minute=int(os.getenv('LLM_TPM', '90000'))
+                )
+    return _dispatcher
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+import xmltodict
+from utils import http_client
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CACHE_DIR = os.path.join(PROJECT_ROOT, 'data', 'cache', 'metadata')
+
+_resolver = None
+_resolver_lock = Lock()
+
+
+class MetadataResolver:
+    """
+    Lädt CSW/ISO-Metadatensätze parallel und legt die geparsten Datensätze
+    pro URL als JSON-Datei auf der Festplatte ab. Fehlgeschlagene Abrufe werden
+    ebenfalls vermerkt und erst nach 'failure_ttl' Sekunden erneut versucht.
+    Gleichzeitige Anfragen für dieselbe URL werden zusammengefasst.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_workers=8, timeout=5, cache_ttl=7 * 24 * 3600,
+                 failure_ttl=15 * 60):
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.failure_ttl = failure_ttl
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='metadata')
+        self.pending = {}
+        self.pending_lock = Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _cache_path(self, url):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f'{key}.json')
+
+    def _load(self, url):
+        # Gültiger Cache-Eintrag ({'record': ...} oder {'error': ...}) oder None
+        path = self._cache_path(url)
+        try:
+            age = time.time() - os.path.getmtime(path)
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        ttl = self.failure_ttl if 'error' in entry else self.cache_ttl
+        if age > ttl or not ('record' in entry or 'error' in entry):
+            return None
+        return entry
+
+    def get_cached(self, url):
+        """Gibt den zwischengespeicherten Datensatz zurück oder None"""
+        entry = self._load(url)
+        return entry.get('record') if entry else None
+
+    def is_resolved(self, url):
+        """True, wenn für die URL ein Datensatz oder ein noch gültiger Fehlschlag vermerkt ist"""
+        return self._load(url) is not None
+
+    def _store(self, url, entry):
+        path = self._cache_path(url)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'url': url, **entry}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f'Metadaten für {url} nicht zwischengespeichert: {str(e)}')
+
+    def _fetch(self, url):
+        try:
+            response = http_client.get(url, timeout=self.timeout)
+            if response.status_code != 200:
+                raise Exception(f'Status: {response.status_code}')
+            record = xmltodict.parse(response.content)
+        except Exception as e:
+            logger.warning(f'Fehler beim Abrufen der Metadaten {url}: {str(e)}')
+            # Fehlschlag vermerken, damit die URL nicht bei jedem Aufruf erneut geladen wird
+            self._store(url, {'error': str(e)})
+            return None
+
+        self._store(url, {'record': record})
+        return record
+
+    def _finish(self, url):
+        with self.pending_lock:
+            self.pending.pop(url, None)
+
+    def submit(self, url):
+        """Startet das Laden einer URL im Hintergrund und gibt das Future zurück"""
+        with self.pending_lock:
+            future = self.pending.get(url)
+            if future is not None:
+                return future
+            future = self.executor.submit(self._fetch, url)
+            self.pending[url] = future
+        # Außerhalb der Sperre registrieren, der Callback läuft ggf. sofort
+        future.add_done_callback(lambda _: self._finish(url))
+        return future
+
+    def prefetch(self, urls):
+        """Lädt alle noch nicht zwischengespeicherten URLs im Hintergrund"""
+        missing = [url for url in dict.fromkeys(urls) if url and not self.is_resolved(url)]
+        for url in missing:
+            self.submit(url)
+        return len(missing)
+
+    def resolve(self, url):
+        """Gibt den Datensatz einer URL zurück, lädt ihn falls nötig"""
+        entry = self._load(url)
+        if entry is not None:
+            return entry.get('record')
+        return self.submit(url).result()
+
+    def resolve_many(self, urls):
+        """Löst mehrere URLs parallel auf und gibt {url: datensatz} zurück"""
+        urls = [url for url in dict.fromkeys(urls) if url]
+        records = {}
+        futures = {}
+        for url in urls:
+            entry = self._load(url)
+            if entry is not None:
+                records[url] = entry.get('record')
+            else:
+                futures[url] = self.submit(url)
+        for url, future in futures.items():
+            records[url] = future.result()
+        return records
+
+
+def get_resolver():
+    """Gibt den gemeinsamen MetadataResolver zurück"""
+    global _resolver
+    if _resolver is None:
+        with _resolver_lock:
+            if _resolver is None:
+                _resolver = MetadataResolver()
+    return _resolver
@@ -0,0 +1,179 @@
+import re
+from threading import Lock
+
+from utils.german_text import fold_umlauts, tokenize
+
+# Namespace-Präfix aus WFS-Typnamen (adv:AX_Flurstueck, ave:Flurstueck)
+NAMESPACE_PREFIX = re.compile(r'^[\w.-]+:')
+
+# Wörter eines Bezeichners (ohne Unterstrich und Satzzeichen)
+WORD = re.compile(r'[^\W_]+')
+
+# Präfixe der AdV-Objektartenkataloge (ALKIS, ATKIS, AFIS) mit optionalem 'adv_'
+ADV_PREFIX = re.compile(r'^(?:adv_)?(?:aa|ap|ax|au|ag|ad|ks|lb|ln|ta)_', re.IGNORECASE)
+
+# AdV-Objektarten: Schlüssel ist der Name ohne Präfix als gefaltete, zusammengeschriebene
+# Kleinbuchstaben (AX_Fliessgewaesser, ax_fließgewässer -> fliessgewaesser)
+ADV_OBJECT_TYPES = {
+    # Flurstücke, Lage, Punkte
+    'flurstueck': ('Flurstück', 'Kleinste Buchungseinheit des Liegenschaftskatasters mit Flurstückskennzeichen, amtlicher Fläche und Lage'),
+    'besondereflurstuecksgrenze': ('Besondere Flurstücksgrenze', 'Flurstücksgrenze mit besonderer Eigenschaft, z.B. strittige Grenze oder Grenze der Gemarkung'),
+    'grenzpunkt': ('Grenzpunkt', 'Punkt einer Flurstücksgrenze mit Abmarkung und Punktkennung'),
+    'aufnahmepunkt': ('Aufnahmepunkt', 'Vermessungspunkt des Aufnahmepunktfeldes für Liegenschaftsvermessungen'),
+    'sicherungspunkt': ('Sicherungspunkt', 'Punkt zur Sicherung eines Aufnahmepunktes'),
+    'sonstigervermessungspunkt': ('Sonstiger Vermessungspunkt', 'Vermessungspunkt, der keiner anderen Punktart zugeordnet ist'),
+    'lagebezeichnungmithausnummer': ('Lagebezeichnung mit Hausnummer', 'Adresse aus Straße und Hausnummer, die einem Gebäude oder Flurstück zugeordnet ist'),
+    'lagebezeichnungohnehausnummer': ('Lagebezeichnung ohne Hausnummer', 'Straßen- oder Gewannenname ohne Hausnummer'),
+    'lagebezeichnungmitpseudonummer': ('Lagebezeichnung mit Pseudonummer', 'Lagebezeichnung für Nebengebäude ohne eigene Hausnummer'),
+    'lagebezeichnungkatalogeintrag': ('Lagebezeichnungskatalog', 'Katalog der Straßennamen und Straßenschlüssel einer Gemeinde'),
+    'lagebezeichnungskatalogeintrag': ('Lagebezeichnungskatalog', 'Katalog der Straßennamen und Straßenschlüssel einer Gemeinde'),
+    'georeferenziertegebaeudeadresse': ('Georeferenzierte Gebäudeadresse', 'Gebäudeadresse mit Koordinate des Gebäudes'),
+
+    # Eigentum und Buchung
+    'buchungsstelle': ('Buchungsstelle', 'Eintrag im Bestandsverzeichnis eines Grundbuchblatts'),
+    'buchungsblatt': ('Buchungsblatt', 'Grundbuchblatt mit Angaben zu Eigentum und gebuchten Flurstücken'),
+    'buchungsblattbezirk': ('Buchungsblattbezirk', 'Grundbuchbezirk eines Buchungsblatts'),
+    'namensnummer': ('Namensnummer', 'Eigentumsanteil einer Person an einem Buchungsblatt'),
+    'person': ('Person', 'Natürliche oder juristische Person als Eigentümer oder Erbbauberechtigter'),
+    'anschrift': ('Anschrift', 'Postanschrift einer Person'),
+
+    # Verwaltungseinheiten
+    'bundesland': ('Bundesland', 'Gebiet eines Landes der Bundesrepublik Deutschland'),
+    'regierungsbezirk': ('Regierungsbezirk', 'Gebiet eines Regierungsbezirks innerhalb eines Landes'),
+    'kreisregion': ('Kreis', 'Gebiet eines Landkreises oder einer kreisfreien Stadt'),
+    'gemeinde': ('Gemeinde', 'Gebiet einer Gemeinde mit amtlichem Gemeindeschlüssel'),
+    'gemeindeteil': ('Gemeindeteil', 'Ortsteil innerhalb einer Gemeinde'),
+    'gemarkung': ('Gemarkung', 'Katasterbezirk aus mehreren Fluren mit Gemarkungsnummer'),
+    'gemarkungsteilflur': ('Flur', 'Teil einer Gemarkung, in dem die Flurstücke nummeriert sind'),
+    'flur': ('Flur', 'Teil einer Gemarkung, in dem die Flurstücke nummeriert sind'),
+    'kommunalesgebiet': ('Kommunales Gebiet', 'Gebiet einer Gemeinde als Verwaltungseinheit'),
+    'verwaltungsgemeinschaft': ('Verwaltungsgemeinschaft', 'Zusammenschluss von Gemeinden zur gemeinsamen Verwaltung'),
+    'gebietsgrenze': ('Gebietsgrenze', 'Grenze einer Verwaltungseinheit (Staat, Land, Kreis, Gemeinde)'),
+
+    # Gebäude und Bauwerke
+    'gebaeude': ('Gebäude', 'Amtliche Gebäudedaten mit Attributen wie Gebäudefunktion, Geschosszahl und Dachform'),
+    'bauteil': ('Bauteil', 'Teil eines Gebäudes mit abweichender Geschosszahl oder Bauart'),
+    'besonderegebaeudelinie': ('Besondere Gebäudelinie', 'Gebäudelinie mit besonderer Eigenschaft, z.B. Durchfahrt oder Arkade'),
+    'firstlinie': ('Firstlinie', 'Verlauf des Dachfirstes eines Gebäudes'),
+    'turm': ('Turm', 'Hohes Bauwerk mit geringer Grundfläche, z.B. Aussichts- oder Kirchturm'),
+    'mast': ('Mast', 'Senkrechter Träger für Leitungen, Antennen oder Beleuchtung'),
+    'leitung': ('Leitung', 'Oberirdische Energie- oder Fernmeldeleitung'),
+    'bauwerkoderanlagefuerindustrieundgewerbe': ('Industrie- und Gewerbeanlage', 'Bauwerk oder Anlage für Industrie und Gewerbe, z.B. Silo oder Kläranlage'),
+    'bauwerkoderanlagefuersportfreizeitunderholung': ('Sport- und Freizeitanlage', 'Bauwerk oder Anlage für Sport, Freizeit und Erholung'),
+    'sonstigesbauwerkodersonstigeeinrichtung': ('Sonstiges Bauwerk', 'Bauwerk oder Einrichtung ohne eigene Objektart, z.B. Mauer oder Zaun'),
+    'bauwerkimverkehrsbereich': ('Bauwerk im Verkehrsbereich', 'Brücke, Tunnel oder anderes Bauwerk eines Verkehrsweges'),
+    'bauwerkimgewaesserbereich': ('Bauwerk im Gewässerbereich', 'Wehr, Schleuse, Damm oder anderes Bauwerk an einem Gewässer'),
+    'historischesbauwerkoderhistorischeeinrichtung': ('Historisches Bauwerk', 'Historisches Bauwerk oder Einrichtung, z.B. Burg oder Ruine'),
+
+    # Tatsächliche Nutzung: Siedlung
+    'wohnbauflaeche': ('Wohnbaufläche', 'Baulich geprägte Fläche, die überwiegend dem Wohnen dient'),
+    'industrieundgewerbeflaeche': ('Industrie- und Gewerbefläche', 'Fläche für Industrie, Gewerbe, Handel und Dienstleistungen'),
+    'halde': ('Halde', 'Aufgeschüttete Fläche aus Abraum oder Lagergut'),
+    'bergbaubetrieb': ('Bergbaubetrieb', 'Fläche für den untertägigen Abbau von Bodenschätzen'),
+    'tagebaugrubesteinbruch': ('Tagebau, Grube, Steinbruch', 'Fläche für den oberirdischen Abbau von Bodenschätzen'),
+    'flaechegemischternutzung': ('Fläche gemischter Nutzung', 'Bebaute Fläche mit Wohnen und Gewerbe ohne vorherrschende Nutzung'),
+    'flaechebesondererfunktionalerpraegung': ('Fläche besonderer funktionaler Prägung', 'Fläche für öffentliche Zwecke, z.B. Verwaltung, Bildung oder Gesundheit'),
+    'sportfreizeitunderholungsflaeche': ('Sport-, Freizeit- und Erholungsfläche', 'Fläche für Sport, Freizeit und Erholung, z.B. Sportplatz oder Grünanlage'),
+    'friedhof': ('Friedhof', 'Fläche für die Bestattung von Verstorbenen'),
+
+    # Tatsächliche Nutzung: Verkehr
+    'strassenverkehr': ('Straßenverkehr', 'Fläche des Straßenkörpers einschließlich Nebenflächen'),
+    'weg': ('Weg', 'Fläche, die dem Fuß-, Rad- oder landwirtschaftlichen Verkehr dient'),
+    'platz': ('Platz', 'Verkehrsfläche in Ortschaften, z.B. Marktplatz oder Parkplatz'),
+    'bahnverkehr': ('Bahnverkehr', 'Fläche für den Schienenverkehr einschließlich Bahnanlagen'),
+    'flugverkehr': ('Flugverkehr', 'Fläche für den Luftverkehr, z.B. Flughafen oder Landeplatz'),
+    'schiffsverkehr': ('Schiffsverkehr', 'Fläche für den Schiffsverkehr, z.B. Hafen oder Anleger'),
+    'strassenachse': ('Straßenachse', 'Mittellinie einer Straße im Verkehrsnetz'),
+    'fahrbahnachse': ('Fahrbahnachse', 'Mittellinie einer Fahrbahn bei getrennten Richtungsfahrbahnen'),
+    'strasse': ('Straße', 'Straße als Verkehrsweg mit Widmung und Bezeichnung'),
+    'wegachse': ('Wegachse', 'Mittellinie eines Weges im Verkehrsnetz'),
+    'bahnstrecke': ('Bahnstrecke', 'Schienenweg zwischen zwei Betriebsstellen'),
+
+    # Tatsächliche Nutzung: Vegetation
+    'landwirtschaft': ('Landwirtschaft', 'Fläche für den Anbau von Feldfrüchten sowie Grünland und Sonderkulturen'),
+    'wald': ('Wald', 'Mit Forstpflanzen bestockte Fläche'),
+    'gehoelz': ('Gehölz', 'Mit Bäumen oder Sträuchern bewachsene Fläche, die kein Wald ist'),
+    'heide': ('Heide', 'Fläche mit Heidekraut und Zwergsträuchern'),
+    'moor': ('Moor', 'Fläche mit Torfboden und moortypischer Vegetation'),
+    'sumpf': ('Sumpf', 'Wassergesättigte, zeitweise unter Wasser stehende Fläche'),
+    'unlandvegetationsloseflaeche': ('Unland, vegetationslose Fläche', 'Nicht nutzbare Fläche ohne oder mit geringem Bewuchs'),
+
+    # Tatsächliche Nutzung: Gewässer
+    'fliessgewaesser': ('Fließgewässer', 'Fläche eines fließenden Gewässers, z.B. Fluss, Bach oder Kanal'),
+    'hafenbecken': ('Hafenbecken', 'Wasserfläche eines Hafens zum Be- und Entladen von Schiffen'),
+    'stehendesgewaesser': ('Stehendes Gewässer', 'Fläche eines stehenden Gewässers, z.B. See oder Teich'),
+    'meer': ('Meer', 'Fläche der Nord- oder Ostsee innerhalb der Hoheitsgrenze'),
+    'gewaesserachse': ('Gewässerachse', 'Mittellinie eines Fließgewässers im Gewässernetz'),
+    'wasserlauf': ('Wasserlauf', 'Gewässer als Ganzes mit Name und Gewässerkennzahl'),
+    'kanal': ('Kanal', 'Künstlich angelegtes Fließgewässer'),
+
+    # Relief und Gesetzliche Festlegungen
+    'boeschungkliff': ('Böschung, Kliff', 'Geländekante mit deutlichem Höhenunterschied'),
+    'hoehenlinie': ('Höhenlinie', 'Linie gleicher Geländehöhe'),
+    'bodenschaetzung': ('Bodenschätzung', 'Ergebnis der amtlichen Bodenschätzung mit Bodenart und Wertzahlen'),
+    'musterlandesmusterundvergleichsstueck': ('Muster- und Vergleichsstück', 'Musterfläche der Bodenschätzung'),
+    'bewertung': ('Bewertung', 'Fläche mit einheitlicher Bewertung nach dem Bewertungsgesetz'),
+    'klassifizierungnachstrassenrecht': ('Klassifizierung nach Straßenrecht', 'Einstufung einer Straße nach Straßenrecht, z.B. Bundes- oder Landesstraße'),
+    'klassifizierungnachwasserrecht': ('Klassifizierung nach Wasserrecht', 'Einstufung eines Gewässers nach Wasserrecht'),
+    'schutzgebietnachwasserrecht': ('Schutzgebiet nach Wasserrecht', 'Wasserschutz- oder Heilquellenschutzgebiet'),
+    'schutzgebietnachnaturumweltoderbodenschutzrecht': ('Schutzgebiet nach Naturschutzrecht', 'Natur-, Landschafts- oder Bodenschutzgebiet'),
+    'naturumweltoderbodenschutzrecht': ('Natur-, Umwelt- oder Bodenschutzrecht', 'Fläche mit Festlegung nach Natur-, Umwelt- oder Bodenschutzrecht'),
+    'denkmalschutzrecht': ('Denkmalschutzrecht', 'Fläche oder Objekt mit Festlegung nach Denkmalschutzrecht'),
+    'bauraumoderbodenordnungsrecht': ('Bau-, Raum- oder Bodenordnungsrecht', 'Fläche mit Festlegung nach Bau-, Raumordnungs- oder Bodenordnungsrecht, z.B. Flurbereinigung'),
+    'sonstigesrecht': ('Sonstiges Recht', 'Fläche mit Festlegung nach sonstigem Recht, z.B. Truppenübungsplatz'),
+
+    # Präsentationsobjekte (AP_)
+    'pto': ('Punktförmiges Textobjekt', 'Präsentationsobjekt für die Beschriftung an einem Punkt'),
+    'lto': ('Linienförmiges Textobjekt', 'Präsentationsobjekt für die Beschriftung entlang einer Linie'),
+    'ppo': ('Punktförmiges Präsentationsobjekt', 'Präsentationsobjekt für ein Symbol an einem Punkt'),
+    'lpo': ('Linienförmiges Präsentationsobjekt', 'Präsentationsobjekt für die Darstellung einer Linie'),
+    'fpo': ('Flächenförmiges Präsentationsobjekt', 'Präsentationsobjekt für die Darstellung einer Fläche'),
+    'darstellung': ('Darstellung', 'Angaben zur kartographischen Darstellung eines Objekts'),
+}
+
+_metrics = {'lookups': 0, 'local': 0}
+_metrics_lock = Lock()
+
+
+def object_type_key(name):
+    """
+    Entfernt Namespace- und AdV-Präfix und gibt den Namen als gefaltete,
+    zusammengeschriebene Kleinbuchstaben zurück (adv:AX_FlurstueckPunkt -> flurstueckpunkt)
+    """
+    name = NAMESPACE_PREFIX.sub('', (name or '').strip())
+    name = ADV_PREFIX.sub('', name)
+    return ''.join(tokenize(name))
+
+
+def resolve_layer_name(name):
+    """
+    Löst einen Layer-Namen ohne KI über das AdV-Objektartenverzeichnis auf.
+    Gibt {'cleaned_name', 'explanation'} zurück oder None, wenn die Regeln nicht greifen.
+    """
+    entry = ADV_OBJECT_TYPES.get(object_type_key(name))
+    with _metrics_lock:
+        _metrics['lookups'] += 1
+        if entry is not None:
+            _metrics['local'] += 1
+    if entry is None:
+        return None
+    cleaned_name, explanation = entry
+    return {'cleaned_name': cleaned_name, 'explanation': explanation}
+
+
+def to_identifier(name, separator='_', lower=True):
+    """
+    Schreibt einen bereinigten Namen als technischen Bezeichner ohne Umlaute und
+    Sonderzeichen (Tatsächliche Nutzung -> tatsaechliche_nutzung)
+    """
+    words = WORD.findall(fold_umlauts(name))
+    return separator.join(word.lower() if lower else word for word in words)
+
+
+def normalizer_stats():
+    """Anteil der lokal (ohne KI) aufgelösten Namen"""
+    with _metrics_lock:
+        stats = dict(_metrics)
+    stats['llm'] = stats['lookups'] - stats['local']
+    stats['local_share'] = round(stats['local'] / stats['lookups'], 3) if stats['lookups'] else None
+    return stats
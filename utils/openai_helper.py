@@ -2,9 +2,52 @@ import json
 import os
 from openai import OpenAI
 import logging
+from utils.llm_cache import get_llm_cache, template_hash
+from utils.llm_dispatcher import estimate_tokens, get_llm_dispatcher
+from utils.batch_packer import berechne_tokens, format_batch, pack_batches
+from utils.name_normalizer import resolve_layer_name, to_identifier
 
 logger = logging.getLogger(__name__)
 
+CLEAN_NAMES_MODEL = "gpt-3.5-turbo"
+
+# Erwartete Antwortlänge pro Layer (JSON-Eintrag mit bereinigtem Namen und Erklärung)
+CLEAN_NAMES_OUTPUT_TOKENS = 120
+
+CLEAN_NAMES_SYSTEM_PROMPT = """Du bist ein Experte für GIS-Daten und ALKIS (Amtliches Liegenschaftskatasterinformationssystem).
+                    
+                    Deine Aufgaben sind:
+                    1. Bereinige die Layer-Namen:
+                       - Entferne technische Präfixe wie 'adv_AX_' oder 'adv_AP_'
+                       - Trenne zusammengeschriebene Wörter mit Leerzeichen
+                       - Formatiere sie einheitlich und benutzerfreundlich
+                       - Wenn der Name unklar ist, verwende die offizielle Bezeichnung aus der ALKIS-Dokumentation
+                       
+                    2. Füge eine präzise Erklärung hinzu:
+                       - Nutze die offiziellen Erklärungen aus der ALKIS-Dokumentation
+                       - Halte die Erklärung kurz und verständlich
+                       - Füge wichtige Attribute oder Besonderheiten hinzu
+                       
+                    Du erhältst pro Zeile ein JSON-Objekt {"id": ..., "name": ..., "title": ...},
+                    optional mit "description" (Originalbeschreibung und Attribute des Layers).
+                    Antworte als JSON-Objekt, dessen Schlüssel die unveränderten IDs sind:
+                    {
+                        "layers": {
+                            "1": {"cleaned_name": "Gebäude", "explanation": "Amtliche Gebäudedaten mit Attributen wie Gebäudenutzung, Baujahr und Geschosszahl"},
+                            "2": {"cleaned_name": "Flurstück", "explanation": "Amtliche Grundstücksfläche mit Flurstücksnummer und Grundbuchbezug"}
+                        }
+                    }"""
+
+CLEAN_NAMES_USER_TEMPLATE = """Bitte bereinige diese Layer-Namen und füge die offiziellen ALKIS-Erklärungen hinzu.
+                    Beachte dabei:
+                    - Nutze die offiziellen Bezeichnungen und Erklärungen aus der ALKIS-Dokumentation
+                    - Behalte wichtige Fachbegriffe bei
+                    - Füge relevante Attribute in der Erklärung hinzu
+                    
+                    Layer:
+                    {layers}"""
+
+
 class OpenAIHelper:
     def __init__(self, config_path='config/config.json', prompts_dir='prompts'):
         self.prompts_dir = prompts_dir
@@ -18,7 +61,42 @@ class OpenAIHelper:
         except Exception as e:
             logger.error(f"Fehler bei der OpenAI-Initialisierung: {e}")
             raise
-        
+        try:
+            self.cache = get_llm_cache()
+        except Exception as e:
+            logger.warning(f"KI-Cache nicht verfügbar, Anfragen werden nicht zwischengespeichert: {e}")
+            self.cache = None
+        self.dispatcher = get_llm_dispatcher()
+
+    def _chat(self, system_prompt, user_template, cache_input, model="gpt-3.5-turbo", temperature=0.3, **kwargs):
+        """
+        Sendet eine Chat-Anfrage und gibt den Antworttext zurück.
+        Antworten werden über (Modell, Temperatur, Vorlage, Eingabe) zwischengespeichert,
+        die Anfrage selbst läuft über den gemeinsamen Dispatcher (Ratenlimits, Wiederholung bei 429).
+        """
+        user_content = user_template.format(**cache_input)
+
+        def request():
+            response = self.client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_content}
+                ],
+                temperature=temperature,
+                **kwargs
+            )
+            return response.choices[0].message.content
+
+        def request_limited():
+            tokens = estimate_tokens(system_prompt, user_content, completion_tokens=kwargs.get('max_tokens', 500))
+            return self.dispatcher.call(request, tokens)
+
+        if self.cache is None:
+            return request_limited()
+        prompt_hash = template_hash(system_prompt, user_template, json.dumps(kwargs, sort_keys=True))
+        return self.cache.cached(model, temperature, prompt_hash, cache_input, request_limited)
+
     def _load_api_key(self):
         try:
             with open(self.config_path, 'r') as f:
@@ -47,83 +125,147 @@ class OpenAIHelper:
             logger.error(f"Fehler beim Laden der Prompt-Konfiguration: {str(e)}")
             raise
 
+    @staticmethod
+    def _layer_input(layer):
+        # Eingabe eines Layers für Prompt und Cache-Schlüssel; die Beschreibung nur, wenn vorhanden
+        layer_input = {'name': layer['name'], 'title': layer.get('title') or ''}
+        if layer.get('description'):
+            layer_input['description'] = layer['description']
+        return layer_input
+
+    @classmethod
+    def _layer_lines(cls, layers):
+        # Eine JSON-Zeile pro Layer; die ID ist die Position, damit doppelte Namen eindeutig bleiben
+        return [
+            (str(i + 1), json.dumps({'id': str(i + 1), **cls._layer_input(layer)}, ensure_ascii=False))
+            for i, layer in enumerate(layers)
+        ]
+
+    def layer_batches(self, layers, model=CLEAN_NAMES_MODEL):
+        """
+        Teilt Layer so auf Anfragen auf, dass jede Anfrage Kontextfenster und Ausgabebudget
+        des Modells ausschöpft. Gibt zusammenhängende Teillisten in Eingabereihenfolge zurück.
+        """
+        prompt_tokens = berechne_tokens(CLEAN_NAMES_SYSTEM_PROMPT + CLEAN_NAMES_USER_TEMPLATE, model)
+        batches = pack_batches(self._layer_lines(layers), model, prompt_tokens, CLEAN_NAMES_OUTPUT_TOKENS)
+        return [[layers[int(item_id) - 1] for item_id, _ in batch] for batch in batches]
+
+    def _clean_layers_request(self, layers, model, temperature):
+        """Eine Anfrage für einen gepackten Batch; gibt {Position: {'cleaned_name', 'explanation'}} zurück"""
+        lines = self._layer_lines(layers)
+        user_content = CLEAN_NAMES_USER_TEMPLATE.format(layers=format_batch(lines))
+        max_tokens = CLEAN_NAMES_OUTPUT_TOKENS * len(lines)
+
+        response = self.dispatcher.call(
+            lambda: self.client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": CLEAN_NAMES_SYSTEM_PROMPT},
+                    {"role": "user", "content": user_content}
+                ],
+                temperature=temperature,
+                max_tokens=max_tokens,
+                response_format={"type": "json_object"}
+            ),
+            estimate_tokens(CLEAN_NAMES_SYSTEM_PROMPT, user_content, completion_tokens=max_tokens)
+        )
+
+        answer = json.loads(response.choices[0].message.content).get('layers') or {}
+        if isinstance(answer, list):
+            # Manche Modelle liefern eine Liste mit 'id' statt eines Objekts
+            answer = {str(entry.get('id')): entry for entry in answer if isinstance(entry, dict)}
+
+        results = {}
+        for position, layer in enumerate(layers):
+            entry = answer.get(str(position + 1))
+            if isinstance(entry, dict) and str(entry.get('cleaned_name') or '').strip():
+                results[position] = {
+                    'cleaned_name': str(entry['cleaned_name']).strip(),
+                    'explanation': str(entry.get('explanation') or '').strip()
+                }
+        return results
+
+    def clean_layers_batch(self, layers):
+        """
+        Bereinigt Namen und erzeugt Erklärungen für N Layer mit einer strukturierten
+        JSON-Anfrage pro gepacktem Batch.
+        layers: Liste von Dictionaries mit 'id', 'name' und optional 'title' und 'description'.
+        Gibt [{'id', 'cleaned_name', 'explanation'}] in Eingabereihenfolge zurück;
+        Layer ohne verwertbare Antwort fehlen in der Liste.
+        """
+        if not layers:
+            raise ValueError("Keine Layer zum Verarbeiten")
+
+        model, temperature = CLEAN_NAMES_MODEL, 0.3
+
+        # AdV-Objektarten ohne KI auflösen
+        results = {}
+        for position, layer in enumerate(layers):
+            resolved = resolve_layer_name(layer['name'])
+            if resolved is not None:
+                results[position] = resolved
+
+        # Bereits bekannte Layer aus dem Cache, nur der Rest geht an die API
+        keys = {}
+        if self.cache is not None:
+            prompt_hash = template_hash(CLEAN_NAMES_SYSTEM_PROMPT, CLEAN_NAMES_USER_TEMPLATE)
+            for position, layer in enumerate(layers):
+                if position in results:
+                    continue
+                keys[position] = self.cache.make_key(model, temperature, prompt_hash, self._layer_input(layer))
+                try:
+                    cached = self.cache.get(keys[position])
+                except Exception as e:
+                    logger.warning(f"KI-Cache nicht lesbar: {str(e)}")
+                    cached = None
+                if cached is not None:
+                    results[position] = cached
+        missing = [position for position in range(len(layers)) if position not in results]
+
+        # Fehlende Layer in so wenige Anfragen wie möglich packen
+        offset = 0
+        for batch in self.layer_batches([layers[position] for position in missing], model):
+            positions = missing[offset:offset + len(batch)]
+            offset += len(batch)
+            for index, result in self._clean_layers_request(batch, model, temperature).items():
+                position = positions[index]
+                results[position] = result
+                if position in keys:
+                    try:
+                        self.cache.set(keys[position], model, prompt_hash, result)
+                    except Exception as e:
+                        logger.warning(f"KI-Antwort nicht zwischengespeichert: {str(e)}")
+
+        return [
+            {'id': layer.get('id', layer['name']), **results[position]}
+            for position, layer in enumerate(layers)
+            if position in results
+        ]
+
     def clean_layer_names_batch(self, layer_names):
-        """Verarbeitet eine Liste von Layer-Namen in einem Batch und fügt Erklärungen hinzu."""
+        """
+        Verarbeitet eine Liste von Layer-Namen in einem Batch und fügt Erklärungen hinzu.
+        'names' und 'explanations' stehen in der Reihenfolge von layer_names; fehlt die
+        Antwort für einen Layer, wird ein ValueError ausgelöst.
+        """
         try:
             if not layer_names:
                 raise ValueError("Keine Layer-Namen zum Verarbeiten")
-                
-            names_list = "\n".join([f"{i+1}. {name}" for i, name in enumerate(layer_names)])
-            
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": """Du bist ein Experte für GIS-Daten und ALKIS (Amtliches Liegenschaftskatasterinformationssystem).
-                    
-                    Deine Aufgaben sind:
-                    1. Bereinige die Layer-Namen:
-                       - Entferne technische Präfixe wie 'adv_AX_' oder 'adv_AP_'
-                       - Trenne zusammengeschriebene Wörter mit Leerzeichen
-                       - Formatiere sie einheitlich und benutzerfreundlich
-                       - Wenn der Name unklar ist, verwende die offizielle Bezeichnung aus der ALKIS-Dokumentation
-                       
-                    2. Füge eine präzise Erklärung hinzu:
-                       - Nutze die offiziellen Erklärungen aus der ALKIS-Dokumentation
-                       - Halte die Erklärung kurz und verständlich
-                       - Füge wichtige Attribute oder Besonderheiten hinzu
-                       
-                    Beispiele:
-                    - 'adv_AX_Gebaeude' -> 'Gebäude (Amtliche Gebäudedaten mit Attributen wie Gebäudenutzung, Baujahr und Geschosszahl)'
-                    - 'adv_AX_Flurstueck' -> 'Flurstück (Amtliche Grundstücksfläche mit Flurstücksnummer und Grundbuchbezug)'
-                    
-                    Antworte im Format:
-                    Name: [bereinigter Name]
-                    Erklärung: [offizielle Erklärung aus ALKIS]
-                    ---"""},
-                    {"role": "user", "content": f"""Bitte bereinige diese Layer-Namen und füge die offiziellen ALKIS-Erklärungen hinzu.
-                    Beachte dabei:
-                    - Nutze die offiziellen Bezeichnungen und Erklärungen aus der ALKIS-Dokumentation
-                    - Behalte wichtige Fachbegriffe bei
-                    - Füge relevante Attribute in der Erklärung hinzu
-                    
-                    Layer-Namen:
-                    {names_list}"""}
-                ],
-                temperature=0.3,
-                max_tokens=2000
-            )
-            
-            # Verarbeite die Antwort
-            response_text = response.choices[0].message.content.strip()
-            entries = response_text.split('---\n')
-            
-            cleaned_names = []
-            explanations = []
-            
-            for entry in entries:
-                if not entry.strip():
-                    continue
-                    
-                lines = entry.strip().split('\n')
-                name = ''
-                explanation = ''
-                
-                for line in lines:
-                    if line.startswith('Name:'):
-                        name = line.replace('Name:', '').strip()
-                    elif line.startswith('Erklärung:'):
-                        explanation = line.replace('Erklärung:', '').strip()
-                
-                if name:
-                    cleaned_names.append(name)
-                    explanations.append(explanation)
-            
-            if not cleaned_names:
-                raise ValueError("Keine bereinigten Namen in der API-Antwort")
-                
+
+            # Zuordnung über die Position, damit doppelte Namen und fehlende Antworten nichts verschieben
+            cleaned = {
+                result['id']: result
+                for result in self.clean_layers_batch([
+                    {'id': position, 'name': name} for position, name in enumerate(layer_names)
+                ])
+            }
+            missing = [name for position, name in enumerate(layer_names) if position not in cleaned]
+            if missing:
+                raise ValueError(f"Keine bereinigten Namen in der API-Antwort für: {', '.join(missing)}")
+
             return {
-                'names': cleaned_names,
-                'explanations': explanations
+                'names': [cleaned[position]['cleaned_name'] for position in range(len(layer_names))],
+                'explanations': [cleaned[position]['explanation'] for position in range(len(layer_names))]
             }
             
         except Exception as e:
@@ -132,15 +274,16 @@ class OpenAIHelper:
             
     def clean_layer_name(self, layer_name):
         """Bereinigt den Layer-Namen mit Hilfe von OpenAI"""
+        # Bekannte AdV-Objektarten ohne KI
+        resolved = resolve_layer_name(layer_name)
+        if resolved is not None:
+            return to_identifier(resolved['cleaned_name'], '-', lower=False)
+
         if not self.api_key:
-            logger.error("Kein API-Key konfiguriert")
-            return layer_name
+            raise ValueError("Kein API-Key konfiguriert")
             
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": """Du bist ein Experte für GIS-Layer-Namen. 
+            system_prompt = """Du bist ein Experte für GIS-Layer-Namen. 
                     Deine Aufgabe ist es, technische Layer-Namen in benutzerfreundliche, verständliche deutsche Namen umzuwandeln.
                     
                     WICHTIGE REGELN:
@@ -159,13 +302,13 @@ class OpenAIHelper:
                     - 'adv_ax_flurstueck' -> 'Flurstueck'
                     - 'ap_pto' -> 'Punktfoermiges-Topographisches-Objekt'
                     - 'ax_gewässer' -> 'Gewaesser'"""
-                    },
-                    {"role": "user", "content": f"Bereinige diesen Layer-Namen: {layer_name}"}
-                ],
+            cleaned_name = self._chat(
+                system_prompt,
+                "Bereinige diesen Layer-Namen: {layer_name}",
+                {'layer_name': layer_name},
                 temperature=0.1,
                 max_tokens=50
-            )
-            cleaned_name = response.choices[0].message.content.strip()
+            ).strip()
             # Entferne alle unerwünschten Zeichen
             cleaned_name = cleaned_name.strip('"\'')
             # Ersetze Umlaute
@@ -180,7 +323,7 @@ class OpenAIHelper:
             return cleaned_name
         except Exception as e:
             logger.error(f"Fehler bei der Layer-Namen-Bereinigung: {str(e)}")
-            return layer_name
+            raise ValueError(f"Layer-Name nicht bereinigt: {str(e)}")
 
     def get_alkis_definition(self, layer_name):
         """Holt die ALKIS-Definition für einen Layer-Namen."""
@@ -188,10 +331,7 @@ class OpenAIHelper:
             # Bereinige den Layer-Namen für die Suche
             search_name = layer_name.lower().replace('adv_ax_', '').replace('adv_ap_', '')
             
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": """Du bist ein ALKIS-Experte. Deine Aufgabe ist es, 
+            system_prompt = """Du bist ein ALKIS-Experte. Deine Aufgabe ist es, 
                     die offizielle ALKIS-Definition und Attribute für den angegebenen Layer zu liefern.
                     
                     Antworte im Format:
@@ -206,14 +346,16 @@ class OpenAIHelper:
                         ]
                     }
                     
-                    Verwende NUR offizielle ALKIS-Definitionen und Attribute."""},
-                    {"role": "user", "content": f"Gib mir die ALKIS-Definition und Attribute für: {search_name}"}
-                ],
+                    Verwende NUR offizielle ALKIS-Definitionen und Attribute."""
+            content = self._chat(
+                system_prompt,
+                "Gib mir die ALKIS-Definition und Attribute für: {search_name}",
+                {'search_name': search_name},
                 temperature=0.1,
                 response_format={ "type": "json_object" }
             )
             
-            return json.loads(response.choices[0].message.content)
+            return json.loads(content)
             
         except Exception as e:
             logger.error(f"Fehler beim Laden der ALKIS-Definition: {str(e)}")
@@ -229,10 +371,7 @@ class OpenAIHelper:
                     for attr in attributes
                 ])
             
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": """Du bist ein GIS-Experte. Deine Aufgabe ist es, 
+            system_prompt = """Du bist ein GIS-Experte. Deine Aufgabe ist es, 
                     Layer-Namen zu analysieren und verständliche Erklärungen zu generieren.
                     
                     Berücksichtige dabei:
@@ -244,16 +383,18 @@ class OpenAIHelper:
                     {
                         "explanation": "Deine Erklärung",
                         "source": "Quelle der Information (falls bekannt)"
-                    }"""},
-                    {"role": "user", "content": f"""Erkläre diesen Layer:
+                    }"""
+            content = self._chat(
+                system_prompt,
+                """Erkläre diesen Layer:
                     Name: {layer_name}
-                    {attributes_text}"""}
-                ],
+                    {attributes_text}""",
+                {'layer_name': layer_name, 'attributes_text': attributes_text},
                 temperature=0.3,
                 response_format={ "type": "json_object" }
             )
             
-            return json.loads(response.choices[0].message.content)
+            return json.loads(content)
             
         except Exception as e:
             logger.error(f"Fehler bei der Erklärungsgenerierung: {str(e)}")
@@ -265,14 +406,10 @@ class OpenAIHelper:
     def generate_layer_description(self, layer_name, original_description):
         """Generiert eine ausführliche Layer-Beschreibung mit Hilfe von OpenAI"""
         if not self.api_key:
-            logger.error("Kein API-Key konfiguriert")
-            return original_description
+            raise ValueError("Kein API-Key konfiguriert")
             
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": """Du bist ein Experte für Geodaten und GIS-Layer. 
+            system_prompt = """Du bist ein Experte für Geodaten und GIS-Layer. 
                     Deine Aufgabe ist es, technische Layer-Beschreibungen in ausführliche, verständliche Erklärungen umzuwandeln.
                     
                     WICHTIGE REGELN für die Beschreibung:
@@ -288,16 +425,16 @@ class OpenAIHelper:
                     Beispiel:
                     Name: ax_flurstueck
                     Beschreibung: Ein Flurstück ist die kleinste Einheit des amtlichen Liegenschaftskatasters. Dieser Layer enthält die geometrischen und beschreibenden Informationen aller Flurstücke, einschließlich ihrer eindeutigen Kennungen und Flächengrößen. Die Daten werden für Grundstücksverwaltung, Stadtplanung und rechtliche Dokumentation verwendet."""
-                    },
-                    {"role": "user", "content": f"""Erstelle eine verständliche Beschreibung für diesen Layer:
+            return self._chat(
+                system_prompt,
+                """Erstelle eine verständliche Beschreibung für diesen Layer:
                     
                     Name: {layer_name}
-                    Originalbeschreibung: {original_description}"""}
-                ],
+                    Originalbeschreibung: {original_description}""",
+                {'layer_name': layer_name, 'original_description': original_description},
                 temperature=0.3,
                 max_tokens=300
-            )
-            return response.choices[0].message.content.strip()
+            ).strip()
         except Exception as e:
             logger.error(f"Fehler bei der Beschreibungsgenerierung: {str(e)}")
-            return original_description 
\ No newline at end of file
+            raise ValueError(f"Keine Beschreibung generiert: {str(e)}") 
\ No newline at end of file
@@ -0,0 +1,175 @@
+import logging
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from threading import Lock
+from utils import http_client
+
+logger = logging.getLogger(__name__)
+
+XSD_NS = '{http://www.w3.org/2001/XMLSchema}'
+
+
+def _local(name):
+    """Entfernt Namespace-Präfixe (adv:AX_Flurstueck -> AX_Flurstueck)"""
+    return name.split(':')[-1] if name else name
+
+
+def _complex_type_attributes(complex_type):
+    """Sammelt alle Elemente eines complexType als Attribute"""
+    attributes = []
+    for elem in complex_type.iter(f'{XSD_NS}element'):
+        attr_name = elem.get('name') or _local(elem.get('ref'))
+        if not attr_name:
+            continue
+        attributes.append({
+            'name': attr_name,
+            'type': _local(elem.get('type', '')) or 'complex'
+        })
+    return attributes
+
+
+def parse_schema(content):
+    """
+    Parst ein DescribeFeatureType-XSD einmalig.
+    Gibt ({featuretyp: [attribute]}, [importierte Schema-URLs]) zurück.
+    """
+    root = ET.fromstring(content)
+
+    complex_types = {
+        complex_type.get('name'): complex_type
+        for complex_type in root.findall(f'{XSD_NS}complexType')
+    }
+
+    schemas = {}
+    for element in root.findall(f'{XSD_NS}element'):
+        name = element.get('name')
+        if not name:
+            continue
+
+        inline_type = element.find(f'{XSD_NS}complexType')
+        if inline_type is not None:
+            schemas[name] = _complex_type_attributes(inline_type)
+            continue
+
+        complex_type = complex_types.get(_local(element.get('type')))
+        if complex_type is not None:
+            schemas[name] = _complex_type_attributes(complex_type)
+
+    imports = [
+        imp.get('schemaLocation')
+        for imp in root.findall(f'{XSD_NS}import')
+        if imp.get('schemaLocation') and 'DescribeFeatureType' in imp.get('schemaLocation')
+    ]
+
+    return schemas, imports
+
+
+class SchemaLoader:
+    """
+    Lädt Attributlisten per DescribeFeatureType für viele Featuretypen auf einmal.
+    Die Typnamen werden in Blöcken angefragt, die Blöcke laufen parallel.
+    Ergebnisse werden pro Dienst zwischengespeichert.
+    """
+
+    def __init__(self, chunk_size=25, max_workers=4, timeout=60, cache_ttl=6 * 3600, host_limiter=None):
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.host_limiter = host_limiter
+        self.cache = {}
+        self.cache_lock = Lock()
+
+    def _request_slot(self, url):
+        if self.host_limiter is None:
+            return nullcontext()
+        return self.host_limiter.slot(url)
+
+    def _cached(self, url):
+        with self.cache_lock:
+            entry = self.cache.get(url)
+            if entry and time.time() - entry['loaded_at'] < self.cache_ttl:
+                return entry['schemas']
+            return {}
+
+    def _store(self, url, schemas):
+        with self.cache_lock:
+            entry = self.cache.get(url)
+            if not entry or time.time() - entry['loaded_at'] >= self.cache_ttl:
+                entry = {'loaded_at': time.time(), 'schemas': {}}
+                self.cache[url] = entry
+            entry['schemas'].update(schemas)
+
+    def _fetch(self, url, params=None):
+        with self._request_slot(url):
+            response = http_client.get(url, params=params, timeout=self.timeout)
+        if response.status_code != 200:
+            raise Exception(f'DescribeFeatureType fehlgeschlagen (Status: {response.status_code})')
+        return response.content
+
+    def _describe(self, url, typenames, version):
+        """Fragt einen Block von Typnamen mit einer einzigen Anfrage ab"""
+        type_param = 'typeNames' if version.startswith('2') else 'typeName'
+        content = self._fetch(url, {
+            'service': 'WFS',
+            'version': version,
+            'request': 'DescribeFeatureType',
+            type_param: ','.join(typenames)
+        })
+        schemas, imports = parse_schema(content)
+
+        # Bei Typen aus mehreren Namespaces liefern manche Server nur Imports
+        for location in imports:
+            try:
+                imported, _ = parse_schema(self._fetch(location))
+                schemas.update(imported)
+            except Exception as e:
+                logger.warning(f'Importiertes Schema {location} nicht ladbar: {str(e)}')
+
+        return schemas
+
+    def _describe_chunk(self, url, typenames, version):
+        """Lädt einen Block, bei Fehlern werden die Typen einzeln angefragt"""
+        try:
+            schemas = self._describe(url, typenames, version)
+        except Exception as e:
+            if len(typenames) == 1:
+                logger.warning(f'Schema für {typenames[0]} nicht ladbar: {str(e)}')
+                return {}
+            logger.info(f'Block-Anfrage fehlgeschlagen, lade {len(typenames)} Typen einzeln: {str(e)}')
+            schemas = {}
+            for typename in typenames:
+                schemas.update(self._describe_chunk(url, [typename], version))
+            return schemas
+
+        # Ergebnisse den angefragten (ggf. mit Präfix versehenen) Typnamen zuordnen
+        return {
+            typename: schemas[_local(typename)]
+            for typename in typenames
+            if _local(typename) in schemas
+        }
+
+    def load(self, url, typenames, version='2.0.0'):
+        """Liefert {typname: [{'name', 'type'}]} für alle angefragten Featuretypen"""
+        cached = self._cached(url)
+        result = {typename: cached[typename] for typename in typenames if typename in cached}
+        missing = [typename for typename in typenames if typename not in cached]
+        if not missing:
+            return result
+
+        chunks = [missing[i:i + self.chunk_size] for i in range(0, len(missing), self.chunk_size)]
+        logger.info(f'Lade Schemas für {len(missing)} Featuretypen in {len(chunks)} Anfragen von {url}')
+
+        loaded = {}
+        if len(chunks) == 1:
+            loaded.update(self._describe_chunk(url, chunks[0], version))
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(chunks))) as executor:
+                for schemas in executor.map(lambda chunk: self._describe_chunk(url, chunk, version), chunks):
+                    loaded.update(schemas)
+
+        self._store(url, loaded)
+        result.update(loaded)
+        return result
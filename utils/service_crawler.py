@@ -0,0 +1,360 @@
+import argparse
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from threading import BoundedSemaphore, Lock
+from urllib.parse import urlparse
+
+from utils.capabilities_parser import open_capabilities
+from utils.lexicon_db import get_lexicon_db
+from utils.lexicon_extents import store_layer_extents, update_service_extent
+from utils.lexicon_schema import init_lexicon_schema
+from utils.lexicon_search import refresh_attribute_index
+from utils.lexicon_sync import capabilities_fingerprint, load_service_fingerprint, schema_missing, sync_service
+from utils.schema_loader import SchemaLoader
+from utils.service_detector import ServiceDetector
+from utils.state_classifier import classify_state
+
+logger = logging.getLogger(__name__)
+
+
+class HostLimiter:
+    """Begrenzt gleichzeitige Anfragen und Anfragefrequenz pro Host"""
+
+    def __init__(self, max_per_host=2, min_interval=0.5):
+        self.max_per_host = max_per_host
+        self.min_interval = min_interval
+        self.semaphores = {}
+        self.last_request = {}
+        self.lock = Lock()
+
+    def _host_state(self, host):
+        with self.lock:
+            if host not in self.semaphores:
+                self.semaphores[host] = BoundedSemaphore(self.max_per_host)
+                self.last_request[host] = 0.0
+            return self.semaphores[host]
+
+    @contextmanager
+    def slot(self, url):
+        """Wartet auf einen freien Platz für den Host der URL"""
+        host = urlparse(url).netloc.lower()
+        semaphore = self._host_state(host)
+        with semaphore:
+            # Mindestabstand zwischen zwei Anfragen an denselben Host einhalten
+            with self.lock:
+                now = time.monotonic()
+                start_at = max(now, self.last_request[host] + self.min_interval)
+                self.last_request[host] = start_at
+            if start_at > now:
+                time.sleep(start_at - now)
+            yield
+
+
+def _percentile(values, percent):
+    """Berechnet ein Perzentil (nächster Rang) einer Werteliste"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(percent / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+class ServiceCrawler:
+    """
+    Lädt die Capabilities vieler WFS/WMS-Dienste parallel und schreibt Dienste,
+    Layer und Attribute gesammelt in das Daten-Lexikon.
+    Im Abgleich-Modus (sync) werden nur neue und geänderte Layer geschrieben; Dienste mit
+    unverändertem Inhalt (Capabilities und Schemas) werden nicht geschrieben (außer mit full).
+    """
+
+    def __init__(self, db_path, max_workers=8, max_per_host=2, host_interval=0.5,
+                 timeout=30, state_detector=None, sync=False, full=False):
+        self.db_path = db_path
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.sync = sync
+        self.full = full
+        self.state_detector = state_detector or classify_state
+        self.host_limiter = HostLimiter(max_per_host, host_interval)
+        self.schema_loader = SchemaLoader(max_workers=max_per_host, host_limiter=self.host_limiter)
+        self.detector = ServiceDetector({
+            'WFS': lambda url: self._read_service(url, 'WFS'),
+            'WMS': lambda url: self._read_service(url, 'WMS')
+        }, max_workers=max_workers * 2)
+
+    def _read_service(self, url, service_type):
+        """Liest Dienst-Informationen und Layer eines Dienstes"""
+        with self.host_limiter.slot(url):
+            reader = open_capabilities(url, service_type, timeout=self.timeout)
+            try:
+                if reader.read_header() != service_type:
+                    raise Exception(f'Kein {service_type}-Dienst (Antwort: {reader.root_tag})')
+                layers = list(reader.iter_layers())
+            finally:
+                reader.close()
+
+        if not layers:
+            raise Exception(f'Keine Layer im {service_type}-Dienst gefunden')
+
+        result = {
+            'version': reader.version,
+            'service_info': reader.service_info,
+            'layers': layers,
+            'unchanged': False
+        }
+
+        if service_type == 'WFS':
+            self._load_attributes(url, layers, reader.version or '2.0.0')
+
+        if self.sync:
+            # Der Hash schließt die Schemas ein; fehlt eines, ist der Inhalt nicht vergleichbar
+            result['content_hash'] = None
+            if not any(schema_missing(layer) for layer in layers):
+                result['content_hash'] = capabilities_fingerprint(reader.service_info, layers)
+                with get_lexicon_db(self.db_path).connection() as conn:
+                    stored_hash = load_service_fingerprint(conn, url, service_type)
+                result['unchanged'] = stored_hash == result['content_hash'] and not self.full
+
+        return result
+
+    def _load_attributes(self, url, layers, version):
+        """
+        Ergänzt die Layer um ihre Attribute aus DescribeFeatureType.
+        Layer, deren Schema nicht geladen werden konnte, erhalten attributes = None.
+        """
+        try:
+            schemas = self.schema_loader.load(url, [layer['name'] for layer in layers], version)
+        except Exception as e:
+            logger.warning(f'Attribute für {url} nicht ladbar: {str(e)}')
+            schemas = {}
+        for layer in layers:
+            layer['attributes'] = schemas.get(layer['name'])
+
+    def _detect_state(self, url, service_info):
+        try:
+            return self.state_detector(url, service_info)
+        except Exception as e:
+            logger.warning(f'Bundesland für {url} nicht erkannt: {str(e)}')
+            return 'unknown'
+
+    def crawl_service(self, url):
+        """Lädt einen einzelnen Dienst und misst die Antwortzeit"""
+        start = time.monotonic()
+        try:
+            service_type, result = self.detector.detect(url)
+            return {
+                'url': url,
+                'status': 'ok',
+                'service_type': service_type,
+                'state': self._detect_state(url, result['service_info']),
+                'latency_ms': round((time.monotonic() - start) * 1000),
+                'layer_count': len(result['layers']),
+                'result': result
+            }
+        except Exception as e:
+            return {
+                'url': url,
+                'status': 'error',
+                'error': str(e),
+                'latency_ms': round((time.monotonic() - start) * 1000),
+                'layer_count': 0
+            }
+
+    def store_service(self, conn, crawled):
+        """Schreibt einen gecrawlten Dienst mit allen Layern in einer Transaktion"""
+        result = crawled['result']
+        service_info = result['service_info']
+        url = crawled['url']
+
+        with conn:
+            conn.execute('''
+                INSERT INTO services (url, type, title, description, state, status, last_checked)
+                VALUES (?, ?, ?, ?, ?, 'active', CURRENT_TIMESTAMP)
+                ON CONFLICT(url, type) DO UPDATE SET
+                    title = excluded.title,
+                    description = excluded.description,
+                    state = excluded.state,
+                    status = 'active',
+                    last_checked = CURRENT_TIMESTAMP
+            ''', (
+                url,
+                crawled['service_type'],
+                service_info.get('title'),
+                service_info.get('abstract'),
+                crawled['state']
+            ))
+
+            if self.sync:
+                if result['unchanged']:
+                    crawled['sync'] = {'new': 0, 'changed': 0, 'unchanged': len(result['layers']), 'removed': 0}
+                else:
+                    crawled['sync'] = sync_service(
+                        conn, url, crawled['service_type'], crawled['state'],
+                        service_info, result['layers'], result['content_hash']
+                    )
+                return
+
+            conn.executemany('''
+                INSERT INTO wfs_layers (
+                    name, title, description, source_url, source_type, state,
+                    created_at, last_updated
+                ) VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+                ON CONFLICT(name, source_url) DO UPDATE SET
+                    title = excluded.title,
+                    description = excluded.description,
+                    state = excluded.state,
+                    last_updated = CURRENT_TIMESTAMP
+            ''', [
+                (
+                    layer['name'],
+                    layer['title'],
+                    layer['description'],
+                    url,
+                    crawled['service_type'],
+                    crawled['state']
+                )
+                for layer in result['layers']
+            ])
+
+            attribute_rows = [
+                (attr['name'], attr.get('type', ''), attr.get('description', ''), layer['name'], url)
+                for layer in result['layers']
+                for attr in layer.get('attributes') or []
+            ]
+            if attribute_rows:
+                conn.executemany('''
+                    INSERT INTO layer_attributes (layer_id, name, type, description)
+                    SELECT id, ?, ?, ? FROM wfs_layers WHERE name = ? AND source_url = ?
+                    ON CONFLICT(layer_id, name) DO UPDATE SET
+                        type = excluded.type,
+                        description = excluded.description
+                ''', attribute_rows)
+            refresh_attribute_index(conn, [(layer['name'], url) for layer in result['layers']])
+
+            store_layer_extents(conn, [(layer['name'], url, layer.get('bbox')) for layer in result['layers']])
+            update_service_extent(conn, url, crawled['service_type'])
+
+    def mark_failed(self, conn, crawled):
+        """Vermerkt einen nicht erreichbaren, bereits bekannten Dienst"""
+        with conn:
+            conn.execute('''
+                UPDATE services SET status = 'error', last_checked = CURRENT_TIMESTAMP
+                WHERE url = ?
+            ''', (crawled['url'],))
+
+    def crawl(self, urls, progress_callback=None):
+        """
+        Crawlt alle URLs parallel. Ergebnisse werden vom aufrufenden Thread
+        in die Datenbank geschrieben, sodass es nur einen Schreiber gibt.
+        """
+        urls = list(dict.fromkeys(url.strip() for url in urls if url and url.strip()))
+        started = time.monotonic()
+        services = []
+
+        lexicon_db = get_lexicon_db(self.db_path)
+        conn = lexicon_db.acquire()
+        try:
+            init_lexicon_schema(conn.cursor())
+            conn.commit()
+
+            with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='crawler') as executor:
+                futures = [executor.submit(self.crawl_service, url) for url in urls]
+                for done, future in enumerate(as_completed(futures), start=1):
+                    crawled = future.result()
+                    try:
+                        if crawled['status'] == 'ok':
+                            self.store_service(conn, crawled)
+                        else:
+                            self.mark_failed(conn, crawled)
+                    except sqlite3.Error as e:
+                        logger.error(f"Fehler beim Speichern von {crawled['url']}: {str(e)}")
+                        crawled['status'] = 'error'
+                        crawled['error'] = f'Datenbankfehler: {str(e)}'
+
+                    crawled.pop('result', None)
+                    services.append(crawled)
+
+                    if progress_callback:
+                        progress_callback(done, len(urls), crawled)
+        finally:
+            lexicon_db.release(conn)
+
+        return self.summarize(services, time.monotonic() - started)
+
+    def summarize(self, services, duration):
+        """Erstellt die Zusammenfassung mit Latenzen und Fehlern pro Dienst"""
+        latencies = [s['latency_ms'] for s in services if s['status'] == 'ok']
+        summary = {
+            'total': len(services),
+            'succeeded': len(latencies),
+            'failed': len(services) - len(latencies),
+            'layer_count': sum(s['layer_count'] for s in services),
+            'duration_s': round(duration, 1),
+            'latency_ms': {
+                'p50': _percentile(latencies, 50),
+                'p95': _percentile(latencies, 95),
+                'max': max(latencies) if latencies else None
+            },
+            'services': sorted(services, key=lambda s: s['url'])
+        }
+        if self.sync:
+            summary['sync'] = {
+                key: sum(s['sync'][key] for s in services if 'sync' in s)
+                for key in ('new', 'changed', 'unchanged', 'removed')
+            }
+        return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Crawlt WFS/WMS-Dienste in das Daten-Lexikon')
+    parser.add_argument('url_file', help='Textdatei mit einer Dienst-URL pro Zeile')
+    parser.add_argument('--db', default='database/development_lexicon.db', help='Pfad zur Lexikon-Datenbank')
+    parser.add_argument('--workers', type=int, default=8, help='Anzahl paralleler Dienste')
+    parser.add_argument('--per-host', type=int, default=2, help='Maximal gleichzeitige Anfragen pro Host')
+    parser.add_argument('--host-interval', type=float, default=0.5, help='Mindestabstand in Sekunden zwischen Anfragen an einen Host')
+    parser.add_argument('--timeout', type=int, default=30, help='Timeout pro Anfrage in Sekunden')
+    parser.add_argument('--sync', action='store_true', help='Nur neue und geänderte Layer schreiben, entfernte als veraltet markieren')
+    parser.add_argument('--full', action='store_true', help='Im Abgleich auch Dienste mit unverändertem Inhalts-Hash abgleichen')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    with open(args.url_file, 'r', encoding='utf-8') as f:
+        urls = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+    def print_progress(done, total, service):
+        if service['status'] == 'ok':
+            print(f"[{done}/{total}] {service['url']} - {service['service_type']} - "
+                  f"{service['layer_count']} Layer - {service['latency_ms']} ms")
+        else:
+            print(f"[{done}/{total}] {service['url']} - FEHLER: {service['error']}")
+
+    crawler = ServiceCrawler(
+        args.db,
+        max_workers=args.workers,
+        max_per_host=args.per_host,
+        host_interval=args.host_interval,
+        timeout=args.timeout,
+        sync=args.sync,
+        full=args.full
+    )
+    summary = crawler.crawl(urls, progress_callback=print_progress)
+
+    print()
+    print(f"Dienste: {summary['total']} (erfolgreich: {summary['succeeded']}, fehlgeschlagen: {summary['failed']})")
+    print(f"Layer: {summary['layer_count']}, Dauer: {summary['duration_s']} s")
+    print(f"Latenz p50/p95/max: {summary['latency_ms']['p50']} / {summary['latency_ms']['p95']} / {summary['latency_ms']['max']} ms")
+    if 'sync' in summary:
+        sync = summary['sync']
+        print(f"Abgleich: {sync['new']} neu, {sync['changed']} geändert, "
+              f"{sync['unchanged']} unverändert, {sync['removed']} als veraltet markiert")
+    for service in summary['services']:
+        if service['status'] != 'ok':
+            print(f"  {service['url']}: {service['error']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceDetector:
+    """
+    Erkennt den Typ eines Geodienstes (WFS, WMS, ...), indem alle Capabilities-Anfragen
+    gleichzeitig gestellt werden. Beantwortet ein Dienst mehrere Anfragen (z.B. GeoServer /ows),
+    gewinnt der Typ mit der höchsten Priorität, sofern er innerhalb von priority_grace Sekunden
+    nach der ersten gültigen Antwort ebenfalls antwortet. Der erkannte Typ wird pro URL gemerkt.
+    """
+
+    def __init__(self, probes, max_workers=8, priority_grace=2.0):
+        # probes: {service_type: funktion(url) -> Ergebnis}, die Funktion wirft bei ungültiger Antwort.
+        # Die Reihenfolge der Einträge ist die Priorität (erster Eintrag zuerst).
+        self.probes = dict(probes)
+        self.priority_grace = priority_grace
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='service-probe')
+        self.type_cache = {}
+        self.type_cache_lock = Lock()
+
+    def get_cached_type(self, url):
+        """Gibt den bereits erkannten Diensttyp einer URL zurück"""
+        with self.type_cache_lock:
+            return self.type_cache.get(url)
+
+    def invalidate(self, url):
+        """Entfernt den gemerkten Diensttyp einer URL"""
+        with self.type_cache_lock:
+            self.type_cache.pop(url, None)
+
+    def detect(self, url):
+        """
+        Ermittelt Diensttyp und Ergebnis der passenden Abfrage.
+        Gibt ein Tupel (service_type, result) zurück.
+        """
+        cached_type = self.get_cached_type(url)
+        if cached_type in self.probes:
+            try:
+                return cached_type, self.probes[cached_type](url)
+            except Exception as e:
+                logger.info(f'Gemerkter Diensttyp {cached_type} für {url} ungültig: {str(e)}')
+                self.invalidate(url)
+
+        futures = {
+            self.executor.submit(probe, url): service_type
+            for service_type, probe in self.probes.items()
+        }
+        priority = list(self.probes)
+
+        results = {}
+        errors = {}
+        pending = set(futures)
+        deadline = None
+        try:
+            while True:
+                best = next((service_type for service_type in priority if service_type in results), None)
+                if best is not None:
+                    # Typen höherer Priorität ohne Antwort bekommen nur die Gnadenfrist
+                    waiting = [
+                        service_type for service_type in priority[:priority.index(best)]
+                        if service_type not in errors
+                    ]
+                    if not waiting or time.monotonic() >= deadline:
+                        break
+                if not pending:
+                    break
+
+                timeout = None if deadline is None else max(0, deadline - time.monotonic())
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    service_type = futures[future]
+                    try:
+                        results[service_type] = future.result()
+                    except Exception as e:
+                        errors[service_type] = str(e)
+                if results and deadline is None:
+                    deadline = time.monotonic() + self.priority_grace
+        finally:
+            # Anfragen, die noch nicht gestartet sind, werden verworfen
+            for future in pending:
+                future.cancel()
+
+        if best is not None:
+            with self.type_cache_lock:
+                self.type_cache[url] = best
+            logger.info(f'Diensttyp für {url} erkannt: {best}')
+            return best, results[best]
+
+        details = ', '.join(f'{service_type}: {error}' for service_type, error in errors.items())
+        raise Exception(f'Service nicht erkannt ({details})')
@@ -0,0 +1,343 @@
+import calendar
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Thread
+
+from utils import http_client
+from utils.capabilities_parser import CapabilitiesReader
+from utils.lexicon_db import get_lexicon_db
+from utils.lexicon_schema import init_lexicon_schema
+from utils.service_crawler import HostLimiter, _percentile
+
+logger = logging.getLogger(__name__)
+
+# Ältere Prüfergebnisse gelten nicht mehr als Empfehlung für Downloads (Monitor läuft evtl. nicht)
+DOWNLOAD_PLAN_MAX_AGE = 3600
+
+# Bevorzugte Ausgabeformate für Downloads, das erste unterstützte gewinnt
+FORMAT_PREFERENCE = (
+    'application/json',
+    'json',
+    'geojson',
+    'application/gml+xml; version=3.2',
+    'gml32',
+    'GML3',
+    'gml3',
+    'GML2'
+)
+
+
+def best_format(formats):
+    """Wählt das bevorzugte Ausgabeformat aus den vom Dienst gemeldeten Formaten"""
+    lowered = {fmt.lower(): fmt for fmt in formats}
+    for preferred in FORMAT_PREFERENCE:
+        if preferred.lower() in lowered:
+            return lowered[preferred.lower()]
+    return formats[0] if formats else None
+
+
+class _HashingStream:
+    """Berechnet den Hash einer Antwort, während sie von iterparse gelesen wird"""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.hash = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.raw.read(size)
+        self.hash.update(data)
+        return data
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+
+class ServiceMonitor:
+    """
+    Prüft alle registrierten Dienste in regelmäßigen Abständen mit leichten Anfragen
+    (HEAD auf GetCapabilities, hits-Abfrage auf einen Beispiel-Layer) und schreibt
+    Verfügbarkeit, Latenz-Perzentile und Capabilities-Hash in die Tabelle services
+    """
+
+    def __init__(self, db_path, interval=900, max_workers=4, max_per_host=1, window=50,
+                 slow_ms=5000, refresh_interval=24 * 3600, timeout=15):
+        self.db_path = db_path
+        self.interval = interval
+        self.max_workers = max_workers
+        self.window = window
+        self.slow_ms = slow_ms
+        self.refresh_interval = refresh_interval
+        self.timeout = timeout
+        self.host_limiter = HostLimiter(max_per_host, min_interval=1.0)
+        self._stop = Event()
+        self._thread = None
+
+    def _capabilities_params(self, service):
+        return {'service': service['type'], 'request': 'GetCapabilities'}
+
+    def _head(self, service):
+        """HEAD auf die Capabilities; liefert Statuscode, Latenz und Validatoren"""
+        start = time.monotonic()
+        response = http_client.head(service['url'], params=self._capabilities_params(service),
+                                    timeout=self.timeout)
+        latency_ms = round((time.monotonic() - start) * 1000)
+        response.close()
+        return response.status_code, latency_ms, response.headers.get('ETag'), response.headers.get('Last-Modified')
+
+    def _needs_refresh(self, service, etag, last_modified):
+        """Die vollständigen Capabilities werden nur bei Änderung oder nach Ablauf neu geladen"""
+        if not service['capabilities_hash'] or not service['capabilities_checked']:
+            return True
+        if etag and etag != service['etag']:
+            return True
+        if last_modified and last_modified != service['last_modified']:
+            return True
+        if etag or last_modified:
+            return False
+        # CURRENT_TIMESTAMP von SQLite ist UTC
+        checked = calendar.timegm(time.strptime(service['capabilities_checked'], '%Y-%m-%d %H:%M:%S'))
+        return time.time() - checked > self.refresh_interval
+
+    def _read_capabilities(self, service):
+        """Lädt die Capabilities, berechnet den Hash und ermittelt Version, Format und Beispiel-Layer"""
+        response = http_client.get(service['url'], params=self._capabilities_params(service),
+                                   timeout=self.timeout, stream=True)
+        if response.status_code != 200:
+            response.close()
+            raise Exception(f"Capabilities nicht abrufbar (Status: {response.status_code})")
+
+        response.raw.decode_content = True
+        stream = _HashingStream(response.raw)
+        reader = CapabilitiesReader(stream, response=response)
+        sample_layer = None
+        for layer in reader.iter_layers():
+            if sample_layer is None:
+                sample_layer = layer['name']
+
+        return {
+            'capabilities_hash': stream.hexdigest(),
+            'preferred_version': reader.version,
+            'preferred_format': best_format(reader.output_formats),
+            'sample_layer': sample_layer
+        }
+
+    def _hits(self, service, version, typename):
+        """Zählt die Features des Beispiel-Layers per resultType=hits und misst die Dauer"""
+        version = version or '2.0.0'
+        type_param = 'typeNames' if version.startswith('2') else 'typeName'
+        start = time.monotonic()
+        response = http_client.get(service['url'], params={
+            'service': 'WFS',
+            'version': version,
+            'request': 'GetFeature',
+            type_param: typename,
+            'resultType': 'hits'
+        }, timeout=self.timeout)
+        hits_ms = round((time.monotonic() - start) * 1000)
+
+        if response.status_code != 200:
+            raise Exception(f"hits-Abfrage fehlgeschlagen (Status: {response.status_code})")
+        root = ET.fromstring(response.content)
+        if 'Exception' in root.tag:
+            raise Exception('hits-Abfrage vom Server abgelehnt')
+        return hits_ms
+
+    def check_service(self, service):
+        """Prüft einen einzelnen Dienst und gibt das Ergebnis der Prüfung zurück"""
+        check = {
+            'service_id': service['id'],
+            'available': False,
+            'status_code': None,
+            'latency_ms': None,
+            'hits_ms': None,
+            'capabilities': None,
+            'etag': None,
+            'last_modified': None,
+            'error': None
+        }
+
+        with self.host_limiter.slot(service['url']):
+            try:
+                status_code, latency_ms, etag, last_modified = self._head(service)
+                check.update(status_code=status_code, latency_ms=latency_ms,
+                             etag=etag, last_modified=last_modified)
+
+                # Manche Server unterstützen kein HEAD, dann entscheidet der GET
+                head_ok = status_code < 400
+                if not head_ok or self._needs_refresh(service, etag, last_modified):
+                    start = time.monotonic()
+                    check['capabilities'] = self._read_capabilities(service)
+                    if not head_ok:
+                        check['status_code'] = 200
+                        check['latency_ms'] = round((time.monotonic() - start) * 1000)
+                check['available'] = True
+
+                capabilities = check['capabilities'] or {}
+                sample_layer = capabilities.get('sample_layer') or service['sample_layer']
+                if service['type'] == 'WFS' and sample_layer:
+                    version = capabilities.get('preferred_version') or service['preferred_version']
+                    check['hits_ms'] = self._hits(service, version, sample_layer)
+            except Exception as e:
+                check['error'] = str(e)
+
+        return check
+
+    def store_check(self, conn, service, check):
+        """Schreibt eine Prüfung und aktualisiert die Kennzahlen des Dienstes"""
+        capabilities = check['capabilities']
+        changed = bool(capabilities and capabilities['capabilities_hash'] != service['capabilities_hash'])
+
+        with conn:
+            conn.execute('''
+                INSERT INTO service_checks (
+                    service_id, available, status_code, latency_ms, hits_ms,
+                    capabilities_changed, error
+                ) VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                service['id'], int(check['available']), check['status_code'],
+                check['latency_ms'], check['hits_ms'], int(changed), check['error']
+            ))
+
+            # Nur das Fenster der letzten Prüfungen aufbewahren
+            conn.execute('''
+                DELETE FROM service_checks
+                WHERE service_id = ? AND id NOT IN (
+                    SELECT id FROM service_checks
+                    WHERE service_id = ?
+                    ORDER BY checked_at DESC, id DESC
+                    LIMIT ?
+                )
+            ''', (service['id'], service['id'], self.window))
+
+            recent = conn.execute('''
+                SELECT available, latency_ms FROM service_checks
+                WHERE service_id = ?
+                ORDER BY checked_at DESC, id DESC
+                LIMIT ?
+            ''', (service['id'], self.window)).fetchall()
+
+            latencies = [row[1] for row in recent if row[0] and row[1] is not None]
+            availability = sum(row[0] for row in recent) / len(recent)
+            latency_p50 = _percentile(latencies, 50)
+            latency_p95 = _percentile(latencies, 95)
+
+            if not check['available']:
+                status = 'error'
+            elif latency_p95 is not None and latency_p95 > self.slow_ms:
+                status = 'slow'
+            else:
+                status = 'active'
+
+            conn.execute('''
+                UPDATE services SET
+                    status = ?,
+                    last_checked = CURRENT_TIMESTAMP,
+                    availability = ?,
+                    latency_p50 = ?,
+                    latency_p95 = ?,
+                    etag = COALESCE(?, etag),
+                    last_modified = COALESCE(?, last_modified)
+                WHERE id = ?
+            ''', (
+                status, availability, latency_p50, latency_p95,
+                check['etag'], check['last_modified'], service['id']
+            ))
+
+            if capabilities:
+                conn.execute('''
+                    UPDATE services SET
+                        capabilities_hash = ?,
+                        capabilities_checked = CURRENT_TIMESTAMP,
+                        preferred_version = COALESCE(?, preferred_version),
+                        preferred_format = COALESCE(?, preferred_format),
+                        sample_layer = COALESCE(?, sample_layer)
+                    WHERE id = ?
+                ''', (
+                    capabilities['capabilities_hash'], capabilities['preferred_version'],
+                    capabilities['preferred_format'], capabilities['sample_layer'], service['id']
+                ))
+
+        return status
+
+    def run_once(self):
+        """Prüft alle Dienste einmal parallel; geschrieben wird nur vom aufrufenden Thread"""
+        lexicon_db = get_lexicon_db(self.db_path)
+        conn = lexicon_db.acquire()
+        conn.row_factory = sqlite3.Row
+        summary = {'checked': 0, 'active': 0, 'slow': 0, 'error': 0}
+        try:
+            init_lexicon_schema(conn.cursor())
+            conn.commit()
+
+            services = [dict(row) for row in conn.execute('''
+                SELECT id, url, type, etag, last_modified, capabilities_hash,
+                       capabilities_checked, sample_layer, preferred_version
+                FROM services
+                WHERE type IN ('WFS', 'WMS')
+            ''')]
+
+            with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='monitor') as executor:
+                for service, check in zip(services, executor.map(self.check_service, services)):
+                    try:
+                        status = self.store_check(conn, service, check)
+                    except sqlite3.Error as e:
+                        logger.error(f"Fehler beim Speichern der Prüfung von {service['url']}: {str(e)}")
+                        continue
+                    summary['checked'] += 1
+                    summary[status] += 1
+        finally:
+            lexicon_db.release(conn)
+
+        logger.info(f"Dienst-Monitor: {summary['checked']} Dienste geprüft "
+                    f"({summary['active']} aktiv, {summary['slow']} langsam, {summary['error']} nicht erreichbar)")
+        return summary
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Fehler im Dienst-Monitor: {str(e)}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """Startet die regelmäßige Prüfung in einem Hintergrund-Thread"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name='service-monitor', daemon=True)
+        self._thread.start()
+        logger.info(f"Dienst-Monitor gestartet (Intervall: {self.interval} s)")
+
+    def stop(self):
+        self._stop.set()
+
+
+def load_download_plan(db_path, url, max_age=None):
+    """
+    Liefert die vom Monitor ermittelten Empfehlungen für einen WFS
+    (Status, Version, Format) oder None, wenn der Dienst unbekannt ist
+    oder (mit max_age) seit mehr als max_age Sekunden nicht geprüft wurde
+    """
+    if not os.path.exists(db_path):
+        return None
+    query = '''
+        SELECT status, preferred_version, preferred_format, availability, latency_p95
+        FROM services
+        WHERE url = ? AND type = 'WFS'
+    '''
+    params = [url]
+    if max_age is not None:
+        query += " AND last_checked >= datetime('now', ?)"
+        params.append(f'-{int(max_age)} seconds')
+    try:
+        with get_lexicon_db(db_path).connection(row_factory=sqlite3.Row) as conn:
+            row = conn.execute(query, params).fetchone()
+        return dict(row) if row else None
+    except sqlite3.Error:
+        return None
@@ -0,0 +1,113 @@
+import re
+from functools import lru_cache
+from urllib.parse import urlparse
+
+# Schlüsselwörter je Bundesland; Kürzel werden nur in Hostnamen und Pfaden gesucht
+STATE_NAMES = {
+    'baden-wuerttemberg': ['baden-wuerttemberg', 'baden-württemberg', 'baden', 'wuerttemberg', 'württemberg', 'bawue'],
+    'bayern': ['bayern', 'bavarian', 'bavaria'],
+    'berlin': ['berlin'],
+    'brandenburg': ['brandenburg'],
+    'bremen': ['bremen', 'bremerhaven'],
+    'hamburg': ['hamburg'],
+    'hessen': ['hessen'],
+    'mecklenburg-vorpommern': ['mecklenburg-vorpommern', 'mecklenburg', 'vorpommern'],
+    'niedersachsen': ['niedersachsen'],
+    'nordrhein-westfalen': ['nordrhein-westfalen', 'nordrhein', 'westfalen', 'nrw'],
+    'rheinland-pfalz': ['rheinland-pfalz', 'rheinland', 'pfalz'],
+    'saarland': ['saarland', 'saar'],
+    'sachsen': ['sachsen', 'saxony'],
+    'sachsen-anhalt': ['sachsen-anhalt'],
+    'schleswig-holstein': ['schleswig-holstein', 'schleswig'],
+    'thueringen': ['thueringen', 'thüringen']
+}
+
+STATE_ABBREVIATIONS = {
+    'baden-wuerttemberg': ['bw'],
+    'bayern': ['by'],
+    'berlin': ['be'],
+    'brandenburg': ['bb'],
+    'bremen': ['hb'],
+    'hamburg': ['hh'],
+    'hessen': ['he'],
+    'mecklenburg-vorpommern': ['mv'],
+    'niedersachsen': ['ni'],
+    'nordrhein-westfalen': ['nw'],
+    'rheinland-pfalz': ['rp', 'rlp'],
+    'saarland': ['sl'],
+    'sachsen': ['sn'],
+    'sachsen-anhalt': ['st', 'lsa'],
+    'schleswig-holstein': ['sh'],
+    'thueringen': ['th']
+}
+
+# Capabilities-Felder, die für die Erkennung gelesen werden
+SERVICE_FIELDS = ('title', 'abstract', 'provider', 'keywords')
+
+
+def _keyword_map(*sources):
+    keywords = {}
+    for source in sources:
+        for state, words in source.items():
+            for word in words:
+                keywords[word] = state
+    return keywords
+
+
+def _compile(keywords):
+    """Alle Schlüsselwörter in einem Muster; längere zuerst, nur ganze Wörter"""
+    alternatives = '|'.join(re.escape(word) for word in sorted(keywords, key=len, reverse=True))
+    return re.compile(rf'(?<![a-z0-9äöüß])(?:{alternatives})(?![a-z0-9äöüß])')
+
+
+URL_KEYWORDS = _keyword_map(STATE_NAMES, STATE_ABBREVIATIONS)
+TEXT_KEYWORDS = _keyword_map(STATE_NAMES)
+URL_PATTERN = _compile(URL_KEYWORDS)
+TEXT_PATTERN = _compile(TEXT_KEYWORDS)
+
+
+def _best_match(pattern, keywords, text):
+    """Gibt das Bundesland mit den meisten Treffern zurück (bei Gleichstand den ersten)"""
+    hits = {}
+    for match in pattern.finditer(text):
+        state = keywords[match.group(0)]
+        hits[state] = hits.get(state, 0) + 1
+    if not hits:
+        return None
+    return max(hits, key=hits.get)
+
+
+@lru_cache(maxsize=4096)
+def classify_host(host):
+    """Erkennt das Bundesland am Hostnamen, Ergebnis wird pro Host gemerkt"""
+    return _best_match(URL_PATTERN, URL_KEYWORDS, host.lower())
+
+
+def classify_state(url, service_info=None):
+    """
+    Erkennt das Bundesland aus Hostname, URL-Pfad und ausgewählten
+    Capabilities-Feldern (Titel, Anbieter, Schlüsselwörter)
+    """
+    parsed = urlparse(url or '')
+
+    state = classify_host(parsed.netloc)
+    if state:
+        return state
+
+    state = _best_match(URL_PATTERN, URL_KEYWORDS, f'{parsed.path} {parsed.query}'.lower())
+    if state:
+        return state
+
+    if service_info:
+        parts = []
+        for field in SERVICE_FIELDS:
+            value = service_info.get(field)
+            if isinstance(value, (list, tuple)):
+                parts.extend(str(v) for v in value if v)
+            elif value:
+                parts.append(str(value))
+        state = _best_match(TEXT_PATTERN, TEXT_KEYWORDS, ' '.join(parts).lower())
+        if state:
+            return state
+
+    return 'unknown'